@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import pandas as pd
+
+try:
+    from scripts.schema import read_typed_csv
+except ImportError:  # run as `python scripts/benchmark.py`
+    from schema import read_typed_csv
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RAW_CSV_PATH = os.path.join("data", "raw", "usurdb_raw.csv")
+
+
+def benchmark_engines(
+    path=RAW_CSV_PATH, schema="usurdb", engines=[None, "pyarrow"], repeat=3
+):
+    """Times reading the same CSV with each engine of `schema.read_typed_csv`
+
+    Parameters
+    ----------
+    path : str
+        Path to the CSV.
+    schema : str
+        Name of the schema in `schema.SCHEMAS`.
+    engines : list
+        Engines to compare. Default is [None, "pyarrow"], where None is the
+        default pandas engine.
+    repeat : int
+        Number of times to read the CSV with each engine. Default is 3.
+
+    Raises
+    ------
+    AssertionError
+        If the engines do not read the same DataFrame.
+
+    Returns
+    -------
+    dict
+        The fastest time (s) of each engine
+    """
+    size = os.path.getsize(path)
+    print(f"Reading {path} ({size / (1 << 20):.1f} MiB) on {os.cpu_count()} cores")
+    times = {}
+    expected = None
+    for engine in engines:
+        best = float("inf")
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            df = read_typed_csv(path, schema, engine=engine, low_memory=False)
+            best = min(best, time.perf_counter() - start_time)
+        # check that every engine gives the same result
+        if expected is None:
+            expected = df
+        else:
+            pd.testing.assert_frame_equal(df, expected)
+        times[engine] = best
+        print(
+            f"{engine or 'default'}: {best:.2f} s "
+            f"({size / best / (1 << 20):.1f} MiB/s, best of {repeat})"
+        )
+    return times
+
+
+if __name__ == "__main__":
+    benchmark_engines(*sys.argv[1:2])
@@ -1,9 +1,22 @@
 import os
+import re
 import ast
 import math
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-import pgeocode as pg
+
+try:
+    from scripts.geocode import (
+        ZIP_TABLE_PATH,
+        lookup_zips,
+        nominatim,
+        normalize_zipcode,
+    )
+    from scripts.schema import read_typed_csv, schema_dtypes
+except ImportError:  # run as `python scripts/convert.py`
+    from geocode import ZIP_TABLE_PATH, lookup_zips, nominatim, normalize_zipcode
+    from schema import read_typed_csv, schema_dtypes
 
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -80,6 +93,517 @@ STATE_ABBR = {
     "District of Columbia": "MD",
 }
 
+# columns of the raw USURDB data read by `create_tariff` and `generate_metadata`,
+# besides the rate structure tiers matched by `TIER_COLUMN_PATTERN`
+CONVERT_COLUMNS = [
+    "label",
+    "eiaid",
+    "name",
+    "utility",
+    "source",
+    "sourceparent",
+    "description",
+    "fixedchargefirstmeter",
+    "flatdemandunit",
+    *["flatDemandMonth_" + month for month in MONTHS],
+    "demandweekdayschedule",
+    "demandweekendschedule",
+    "energyweekdayschedule",
+    "energyweekendschedule",
+]
+
+# fields of each tier, in the order of the columns of `RateTensors.values`
+TIER_FIELDS = ["rate", "adj", "max"]
+# e.g., "energyratestructure/period2/tier0rate"
+TIER_COLUMN_PATTERN = re.compile(
+    r"^(flatdemandstructure|demandratestructure|energyratestructure)"
+    r"/period(\d+)/tier(\d+)(rate|adj|max)$"
+)
+
+
+def convert_columns(columns):
+    """
+    Selects the columns of the raw USURDB data that are needed for conversion
+
+    Parameters
+    ----------
+    columns : list
+        Column names of the raw USURDB data.
+
+    Returns
+    -------
+    list
+        The columns in `CONVERT_COLUMNS` plus the rate, adjustment, and maximum
+        of every period/tier present, in their original order.
+    """
+    return [
+        column
+        for column in columns
+        if column in CONVERT_COLUMNS or TIER_COLUMN_PATTERN.match(column)
+    ]
+
+
+class RateTensors:
+    """Sparse arrays of the tier rates, adjustments, and maximums of USURDB data.
+
+    Almost every tier column is NaN for almost every tariff, so each rate structure
+    (energy, demand, and flat demand) only keeps the (period, tier) slots that a
+    tariff has a value for, like a CSR matrix: the entries of the tariff at
+    `position` are `offsets[position]:offsets[position + 1]`, sorted by slot, with
+    the slot in `entries` and the rate, adjustment, and maximum (ordered as
+    `TIER_FIELDS`) in `values`. The slot of a (period, tier) is looked up in a
+    small integer array, so that the tiers of a tariff are found by integer
+    indexing instead of by building and looking up their column names.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        USURDB data with the tier columns matched by `TIER_COLUMN_PATTERN`.
+
+    Attributes
+    ----------
+    columns : frozenset
+        Names of the tier columns that were packed
+    offsets : dict
+        Array of the start of the entries of each tariff of each structure, with
+        the total number of entries at the end
+    entries : dict
+        Array of the slot of each entry of each structure
+    values : dict
+        Array of shape (entries, 3) of each structure, which is NaN where a
+        tariff has no value for one of the fields of a slot
+    slots : dict
+        Nested list of the slot of each [period][tier] of each structure, which is
+        -1 if there are no columns for it
+    has_rate : dict
+        List of whether the data has the rate column of each slot of each structure
+    """
+
+    def __init__(self, df):
+        found = {}
+        for column in df.columns:
+            match = TIER_COLUMN_PATTERN.match(column)
+            if match:
+                structure, period, tier, field = match.groups()
+                found.setdefault(structure, []).append(
+                    (int(period), int(tier), TIER_FIELDS.index(field), column)
+                )
+        self.columns = frozenset(
+            column for keys in found.values() for *_, column in keys
+        )
+
+        self.offsets = {}
+        self.entries = {}
+        self.values = {}
+        self.slots = {}
+        self.has_rate = {}
+        for structure, keys in found.items():
+            periods, tiers, fields, names = (np.array(x) for x in zip(*keys))
+            slots = np.full((periods.max() + 1, tiers.max() + 1), -1)
+            # number the (period, tier) pairs in the order of their columns
+            pairs, first = np.unique(
+                periods * slots.shape[1] + tiers, return_index=True
+            )
+            pairs = pairs[np.argsort(first, kind="stable")]
+            slots.flat[pairs] = np.arange(len(pairs))
+            positions = slots[periods, tiers]
+
+            # one slot at a time, so the dense tiers are never all copied at once
+            rows, entries, values = [], [], []
+            for slot in range(len(pairs)):
+                slot_values = np.full((len(df), len(TIER_FIELDS)), np.nan)
+                for field, name in zip(
+                    fields[positions == slot], names[positions == slot]
+                ):
+                    slot_values[:, field] = df[name].to_numpy(dtype=float)
+                present = np.flatnonzero(~np.isnan(slot_values).all(axis=1))
+                rows.append(present)
+                entries.append(np.full(len(present), slot, dtype=np.int32))
+                values.append(slot_values[present])
+            rows = np.concatenate(rows)
+            order = np.argsort(rows, kind="stable")
+            has_rate = np.zeros(len(pairs), dtype=bool)
+            has_rate[positions[fields == TIER_FIELDS.index("rate")]] = True
+            self.offsets[structure] = np.append(
+                0, np.cumsum(np.bincount(rows, minlength=len(df)))
+            )
+            self.entries[structure] = np.concatenate(entries)[order]
+            self.values[structure] = np.concatenate(values)[order]
+            # nested lists, since they are indexed one element at a time
+            self.slots[structure] = slots.tolist()
+            self.has_rate[structure] = has_rate.tolist()
+
+    def slot_values(self, position, structure, slot):
+        """Rate, adjustment, and maximum of one slot of one tariff, which are NaN
+        if the tariff has none"""
+        start = self.offsets[structure][position]
+        stop = self.offsets[structure][position + 1]
+        entries = self.entries[structure][start:stop]
+        i = np.searchsorted(entries, slot)
+        if i < len(entries) and entries[i] == slot:
+            return self.values[structure][start + i]
+        return np.full(len(TIER_FIELDS), np.nan)
+
+    def tier(self, position, structure, period, tier):
+        """Rate, adjustment, and maximum of one tier of one tariff
+
+        Parameters
+        ----------
+        position : int
+            Position of the tariff in the data.
+        structure : str
+            Name of the rate structure, e.g. "energyratestructure".
+        period : int
+            Index of the period.
+        tier : int
+            Index of the tier.
+
+        Raises
+        ------
+        KeyError
+            If the data has no rate column for the tier, like the full row
+
+        Returns
+        -------
+        numpy.ndarray
+            The rate, adjustment, and maximum, which are NaN if the tariff has none
+        """
+        slots = self.slots.get(structure)
+        slot = -1
+        if slots is not None and 0 <= period < len(slots) and 0 <= tier < len(slots[0]):
+            slot = slots[period][tier]
+        if slot < 0 or not self.has_rate[structure][slot]:
+            raise KeyError(f"{structure}/period{period}/tier{tier}rate")
+        return self.slot_values(position, structure, slot)
+
+    def row(self, openei_tariff_row, position):
+        """Wraps a row without the tier columns so that it can be passed to
+        `create_tariff` like the full row
+
+        Parameters
+        ----------
+        openei_tariff_row : pandas.Series or ColumnarRow
+            A row of the USURDB data, which does not need the tier columns.
+        position : int
+            Position of the row in the data.
+
+        Returns
+        -------
+        RateRow
+            The row with its tiers in these arrays
+        """
+        return RateRow(openei_tariff_row, self, position)
+
+
+class RateRow:
+    """A row of USURDB data whose tiers are in `RateTensors`.
+
+    Indexing it by a tier column name gives the same result as indexing the full
+    row, but `tier_rates` reads its tiers by integer index.
+
+    Parameters
+    ----------
+    openei_tariff_row : pandas.Series or ColumnarRow
+        The other columns of the row.
+    rates : RateTensors
+        The tiers of all the rows.
+    position : int
+        Position of the row in `rates`.
+    """
+
+    __slots__ = ("openei_tariff_row", "rates", "position")
+
+    def __init__(self, openei_tariff_row, rates, position):
+        self.openei_tariff_row = openei_tariff_row
+        self.rates = rates
+        self.position = position
+
+    def __getitem__(self, key):
+        if key in self.rates.columns:
+            structure, period, tier, field = TIER_COLUMN_PATTERN.match(key).groups()
+            slot = self.rates.slots[structure][int(period)][int(tier)]
+            return self.rates.slot_values(self.position, structure, slot)[
+                TIER_FIELDS.index(field)
+            ]
+        return self.openei_tariff_row[key]
+
+    def tier(self, structure, period, tier):
+        """Rate, adjustment, and maximum of one tier, see `RateTensors.tier`"""
+        return self.rates.tier(self.position, structure, period, tier)
+
+
+def tier_rates(openei_tariff_row, structure, period, tier):
+    """Rate, adjustment, and maximum of one tier of a tariff
+
+    Parameters
+    ----------
+    openei_tariff_row : pandas.Series or RateRow
+        A row of the USURDB data.
+    structure : str
+        Name of the rate structure, e.g. "energyratestructure".
+    period : int
+        Index of the period.
+    tier : int
+        Index of the tier.
+
+    Raises
+    ------
+    KeyError
+        If the data has no column for the tier
+
+    Returns
+    -------
+    tuple
+        The rate, adjustment, and maximum, which are NaN if the tariff has none
+    """
+    if isinstance(openei_tariff_row, RateRow):
+        return tuple(openei_tariff_row.tier(structure, period, tier))
+    tier_str = structure + "/period" + str(period) + "/tier" + str(tier)
+    return (
+        openei_tariff_row[tier_str + "rate"],
+        openei_tariff_row[tier_str + "adj"],
+        openei_tariff_row[tier_str + "max"],
+    )
+
+
+class TariffColumns:
+    """Columns of USURDB data as numpy arrays, extracted once, so that the rows
+    can be read without building a pandas Series for each one.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        USURDB data, e.g. without the tier columns kept in `RateTensors`.
+    """
+
+    def __init__(self, df):
+        self.columns = {column: df[column].to_numpy() for column in df.columns}
+        self.length = len(df)
+
+    def __len__(self):
+        return self.length
+
+    def row(self, position):
+        """The row at `position`, which can be indexed by column like `df.iloc[position]`"""
+        return ColumnarRow(self.columns, position)
+
+
+class ColumnarRow:
+    """A row of `TariffColumns`, which looks up each value in its column array.
+
+    Parameters
+    ----------
+    columns : dict
+        numpy array of each column.
+    position : int
+        Position of the row in the arrays.
+    """
+
+    __slots__ = ("columns", "position")
+
+    def __init__(self, columns, position):
+        self.columns = columns
+        self.position = position
+
+    def __getitem__(self, key):
+        return self.columns[key][self.position]
+
+
+# rate schedules stored as 12 x 24 (month x hour) nested lists of period indices
+SCHEDULE_COLUMNS = [
+    "demandweekdayschedule",
+    "demandweekendschedule",
+    "energyweekdayschedule",
+    "energyweekendschedule",
+]
+SCHEDULE_SHAPE = (12, 24)
+
+# deletes everything but the brackets and commas, or just the brackets
+SCHEDULE_VALUE_CHARS = str.maketrans("", "", "0123456789-+ \t\r\n")
+SCHEDULE_BRACKET_CHARS = str.maketrans("", "", "[]")
+
+
+def schedule_is_missing(schedule):
+    """Whether a schedule is missing (NaN) rather than a string or parsed array"""
+    return not isinstance(schedule, (str, list, np.ndarray)) and pd.isna(schedule)
+
+
+def parse_schedules(schedules, shape=SCHEDULE_SHAPE):
+    """Parses a column of schedule strings into int8 arrays without `ast.literal_eval`.
+
+    The strings that are nested lists of integers of the given shape are parsed
+    with a single `numpy.fromstring` call into one contiguous array, which each
+    result is a view of. Any other string is parsed with `ast.literal_eval`
+    instead and is returned as a list if it is not rectangular.
+
+    Parameters
+    ----------
+    schedules : array_like
+        Schedule strings, e.g. the `energyweekdayschedule` column. Missing
+        schedules and ones that are already parsed are returned as is.
+    shape : tuple of int
+        Shape of a regular schedule. Default is (12, 24), i.e. month by hour.
+
+    Returns
+    -------
+    numpy.ndarray
+        Object array with the parsed schedule of each string
+    """
+    schedules = list(schedules)
+    result = np.empty(len(schedules), dtype=object)
+    skeleton = "[" + ",".join(["[" + "," * (shape[1] - 1) + "]"] * shape[0]) + "]"
+    regular = []
+    for i, schedule in enumerate(schedules):
+        if not isinstance(schedule, str):
+            result[i] = schedule
+        elif schedule.translate(SCHEDULE_VALUE_CHARS) == skeleton:
+            regular.append(i)
+        else:
+            result[i] = parse_schedule_literal(schedule)
+    if not regular:
+        return result
+
+    text = ",".join(schedules[i].translate(SCHEDULE_BRACKET_CHARS) for i in regular)
+    values = np.fromstring(text, dtype=np.int64, sep=",")
+    size = shape[0] * shape[1]
+    if (
+        values.size != len(regular) * size
+        or values.min() < np.iinfo(np.int8).min
+        or values.max() > np.iinfo(np.int8).max
+    ):
+        # e.g., an empty value, so fall back to the exact parser for each string
+        for i in regular:
+            result[i] = parse_schedule_literal(schedules[i])
+        return result
+    values = values.astype(np.int8).reshape(len(regular), *shape)
+    for j, i in enumerate(regular):
+        result[i] = values[j]
+    return result
+
+
+def parse_schedule_literal(schedule):
+    """Parses a schedule string with `ast.literal_eval` into an int8 array if it
+    is rectangular and fits in int8, or a nested list otherwise"""
+    sched = ast.literal_eval(schedule)
+    try:
+        array = np.array(sched, dtype=np.int64)
+    except (ValueError, TypeError):
+        return sched
+    if (
+        array.ndim != 2
+        or array.size == 0
+        or array.min() < np.iinfo(np.int8).min
+        or array.max() > np.iinfo(np.int8).max
+    ):
+        return sched
+    return array.astype(np.int8)
+
+
+def parse_schedule(schedule):
+    """Parses one schedule string into an int8 array, see `parse_schedules`.
+
+    Parameters
+    ----------
+    schedule : str
+        Nested list of period indices, e.g. a value of `energyweekdayschedule`.
+        Already parsed schedules are returned as is.
+
+    Raises
+    ------
+    ValueError
+        If the schedule is missing or malformed, like `ast.literal_eval`
+
+    Returns
+    -------
+    numpy.ndarray
+        The schedule as a contiguous int8 array of shape (12, 24)
+    """
+    if isinstance(schedule, (np.ndarray, list)):
+        return schedule
+    if not isinstance(schedule, str):
+        return ast.literal_eval(schedule)
+    return parse_schedules([schedule])[0]
+
+
+class ScheduleCache:
+    """Interns schedules so that each distinct schedule string is only parsed and
+    split into consecutive months and hours once, however many tariffs share it.
+
+    Attributes
+    ----------
+    entries : dict
+        (schedule, month ranges, hour ranges of each month) of each schedule string
+    hits : int
+        Number of lookups of a schedule that was already in the cache
+    misses : int
+        Number of schedules that were parsed and split into ranges
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schedule):
+        """Looks up a schedule, parsing and decomposing it if it is new
+
+        Parameters
+        ----------
+        schedule : str
+            Nested list of period indices, e.g. a value of `energyweekdayschedule`.
+            Schedules that are already parsed are decomposed but not cached.
+
+        Raises
+        ------
+        ValueError
+            If the schedule is missing or malformed, see `parse_schedule`
+
+        Returns
+        -------
+        tuple
+            The parsed schedule, its consecutive month ranges, and the consecutive
+            hour ranges of each month
+        """
+        if isinstance(schedule, str):
+            entry = self.entries.get(schedule)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        sched = parse_schedule(schedule)
+        entry = (sched, *decompose_schedules([sched])[0])
+        if isinstance(schedule, str):
+            self.entries[schedule] = entry
+        return entry
+
+    def update(self, schedules):
+        """Adds every new schedule string in `schedules`, parsed together with
+        `parse_schedules` and split into ranges together with `decompose_schedules`
+
+        Parameters
+        ----------
+        schedules : array_like
+            Schedule strings, e.g. the `energyweekdayschedule` column. Missing
+            values are skipped.
+        """
+        new = [
+            schedule
+            for schedule in dict.fromkeys(schedules)
+            if isinstance(schedule, str) and schedule not in self.entries
+        ]
+        scheds = parse_schedules(new)
+        for schedule, sched, ranges in zip(new, scheds, decompose_schedules(scheds)):
+            self.misses += 1
+            self.entries[schedule] = (sched, *ranges)
+
+    def clear(self):
+        """Empties the cache and resets the counters"""
+        self.__init__()
+
+
+# schedules shared by all the tariffs that are converted
+SCHEDULE_CACHE = ScheduleCache()
+
 
 def make_dict():
     """
@@ -116,6 +640,416 @@ def make_dict():
     return data_dict
 
 
+# fields of `ChargeBuilder.add`, by the column of the tariff sheet that they fill,
+# where the imperial and metric columns are the same for electricity
+CHARGE_FIELDS = {
+    "label": "label",
+    "utility": "utility",
+    "type": "type",
+    "assessed": "assessed",
+    "period": "period",
+    "basic_charge_limit (imperial)": "charge_limit",
+    "basic_charge_limit (metric)": "charge_limit",
+    "month_start": "month_start",
+    "month_end": "month_end",
+    "hour_start": "hour_start",
+    "hour_end": "hour_end",
+    "weekday_start": "weekday_start",
+    "weekday_end": "weekday_end",
+    "charge (imperial)": "charge",
+    "charge (metric)": "charge",
+    "units": "units",
+    "Notes": "notes",
+}
+CHARGE_STRING_FIELDS = [
+    "label",
+    "utility",
+    "type",
+    "assessed",
+    "period",
+    "units",
+    "notes",
+]
+CHARGE_FLOAT_FIELDS = ["charge_limit", "charge"]
+# how each number of `CHARGE_FLOAT_FIELDS` was given, to write it back the same way
+MISSING_NUMBER, INT_NUMBER, FLOAT_NUMBER = 0, 1, 2
+# months, hours, and days of the week, which are -1 where they are missing
+CHARGE_INT_FIELDS = [
+    "month_start",
+    "month_end",
+    "hour_start",
+    "hour_end",
+    "weekday_start",
+    "weekday_end",
+]
+
+
+class ChargeList(list):
+    """Charges of a tariff as the dictionaries of `make_dict`, which is what
+    `create_tariff` returns when it is not given a `ChargeBuilder`
+    """
+
+    def add(
+        self,
+        label,
+        type,
+        charge,
+        units,
+        period="",
+        charge_limit="",
+        month_start="",
+        month_end="",
+        hour_start="",
+        hour_end="",
+        weekday_start="",
+        weekday_end="",
+        notes="",
+        utility="electric",
+        assessed="",
+    ):
+        """Appends a charge, see `ChargeBuilder.add`"""
+        data_dict = make_dict()
+        data_dict["label"] = label
+        data_dict["utility"] = utility
+        data_dict["type"] = type
+        data_dict["assessed"] = assessed
+        data_dict["period"] = period
+        data_dict["basic_charge_limit (imperial)"] = charge_limit
+        data_dict["basic_charge_limit (metric)"] = charge_limit
+        data_dict["month_start"] = month_start
+        data_dict["month_end"] = month_end
+        data_dict["hour_start"] = hour_start
+        data_dict["hour_end"] = hour_end
+        data_dict["weekday_start"] = weekday_start
+        data_dict["weekday_end"] = weekday_end
+        data_dict["charge (imperial)"] = charge
+        data_dict["charge (metric)"] = charge
+        data_dict["units"] = units
+        data_dict["Notes"] = notes
+        self.append(data_dict)
+
+    def truncate(self, length):
+        """Removes the charges after the first `length`"""
+        del self[length:]
+
+
+class ChargeBuilder:
+    """Charges of all the tariffs that are converted, appended into typed column
+    buffers that grow as needed, so that there is no dictionary per charge and
+    no DataFrame per tariff until the end of the run. Strings are dictionary
+    encoded, and the charges of a tariff are the run of rows with its label.
+
+    Attributes
+    ----------
+    length : int
+        Number of charges
+    capacity : int
+        Number of charges that the buffers have room for
+    buffers : dict
+        Array of each field of `ChargeBuilder.add`, where strings are codes
+    kinds : dict
+        Whether each number of `CHARGE_FLOAT_FIELDS` was missing, an int, or a float
+    values : dict
+        Distinct strings of each string field in the order of their codes
+    codes : dict
+        Code of each distinct string of each string field
+    """
+
+    def __init__(self, capacity=1024):
+        self.length = 0
+        self.capacity = capacity
+        self.buffers = {}
+        for field in CHARGE_STRING_FIELDS:
+            self.buffers[field] = np.empty(capacity, dtype=np.int32)
+        for field in CHARGE_FLOAT_FIELDS:
+            self.buffers[field] = np.empty(capacity, dtype=np.float64)
+        for field in CHARGE_INT_FIELDS:
+            self.buffers[field] = np.empty(capacity, dtype=np.int8)
+        self.kinds = {
+            field: np.empty(capacity, dtype=np.int8) for field in CHARGE_FLOAT_FIELDS
+        }
+        self.values = {field: [] for field in CHARGE_STRING_FIELDS}
+        self.codes = {field: {} for field in CHARGE_STRING_FIELDS}
+
+    def __len__(self):
+        return self.length
+
+    def encode(self, field, value):
+        """Looks up the code of a string, adding it if it is new"""
+        codes = self.codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.values[field].append(value)
+        return code
+
+    def add(
+        self,
+        label,
+        type,
+        charge,
+        units,
+        period="",
+        charge_limit="",
+        month_start="",
+        month_end="",
+        hour_start="",
+        hour_end="",
+        weekday_start="",
+        weekday_end="",
+        notes="",
+        utility="electric",
+        assessed="",
+    ):
+        """Appends a charge, where "" is a missing value like in `make_dict`
+
+        Parameters
+        ----------
+        label : str
+            Label of the tariff in USURDB.
+        type : str
+            "customer", "demand", or "energy".
+        charge : float
+            The charge in `units`.
+        units : str
+            Units of the charge, e.g. "$/kWh".
+        period : str
+            e.g. "flat" or "period0".
+        charge_limit : float
+            The charge applies above this much demand or energy.
+        month_start, month_end, hour_start, hour_end, weekday_start, weekday_end : int or str
+            When the charge applies, as numbers or numeric strings.
+        notes : str
+            Notes on the charge.
+        utility : str
+            Default is "electric".
+        assessed : str
+            Default is "".
+        """
+        i = self.length
+        if i == self.capacity:
+            self.grow()
+        buffers = self.buffers
+        for field, value in zip(
+            CHARGE_STRING_FIELDS,
+            (label, utility, type, assessed, period, units, notes),
+        ):
+            buffers[field][i] = self.encode(field, value)
+        for field, value in (("charge_limit", charge_limit), ("charge", charge)):
+            if isinstance(value, str):
+                buffers[field][i] = np.nan
+                self.kinds[field][i] = MISSING_NUMBER
+            else:
+                buffers[field][i] = value
+                self.kinds[field][i] = (
+                    INT_NUMBER if isinstance(value, (int, np.integer)) else FLOAT_NUMBER
+                )
+        for field, value in zip(
+            CHARGE_INT_FIELDS,
+            (month_start, month_end, hour_start, hour_end, weekday_start, weekday_end),
+        ):
+            buffers[field][i] = -1 if value == "" else int(value)
+        self.length = i + 1
+
+    def grow(self):
+        """Doubles the capacity of the buffers"""
+        self.capacity *= 2
+        for arrays in (self.buffers, self.kinds):
+            for field, buffer in arrays.items():
+                grown = np.empty(self.capacity, dtype=buffer.dtype)
+                grown[: self.length] = buffer[: self.length]
+                arrays[field] = grown
+
+    def truncate(self, length):
+        """Removes the charges after the first `length`"""
+        self.length = min(self.length, length)
+
+    def tariffs(self):
+        """Finds the charges of each tariff
+
+        Returns
+        -------
+        list
+            (label, start, stop) of each run of charges with the same label
+        """
+        runs = run_lengths(self.buffers["label"][: self.length])
+        labels = self.values["label"]
+        return [(labels[code], start, end + 1) for start, end, code in runs.tolist()]
+
+    def column(self, field, start, stop):
+        """Decodes a field of the charges from `start` to `stop`, with missing
+        values as NA
+        """
+        buffer = self.buffers[field][start:stop]
+        if field in self.values:
+            values = np.array(self.values[field], dtype=object)
+            values[values == ""] = None
+            return values[buffer]
+        if field in CHARGE_INT_FIELDS:
+            return pd.arrays.IntegerArray(buffer.copy(), buffer == -1)
+        return buffer.copy()
+
+    def to_frame(self, start=0, stop=None):
+        """Materializes the charges from `start` to `stop` as a tariff sheet
+
+        Parameters
+        ----------
+        start : int
+            First charge. Default is 0.
+        stop : int
+            Charge to stop before. Default is None, in which case it is the last.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The columns of `make_dict` with the dtypes of the "tariff" schema,
+            which is what reading the saved tariff sheet gives
+        """
+        stop = self.length if stop is None else min(stop, self.length)
+        fields = {}
+        for field in set(CHARGE_FIELDS.values()):
+            fields[field] = self.column(field, start, stop)
+        df = pd.DataFrame(
+            {column: fields[field] for column, field in CHARGE_FIELDS.items()}
+        )
+        return df.astype(schema_dtypes(df.columns, "tariff"))
+
+    def text(self, field, tariffs):
+        """Formats a field of all the charges as `pandas.DataFrame.to_csv` writes
+        the dictionaries of `make_dict`, one tariff sheet at a time
+
+        Parameters
+        ----------
+        field : str
+            Field of `ChargeBuilder.add`.
+        tariffs : list
+            (label, start, stop) of each tariff, see `tariffs`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The text of each charge
+        """
+        buffer = self.buffers[field][: self.length]
+        if field in self.values:
+            return np.array(self.values[field], dtype=object)[buffer]
+        if field in CHARGE_INT_FIELDS:
+            text = buffer.astype(str).astype(object)
+            text[buffer == -1] = ""
+            return text
+        if self.length == 0:
+            return np.empty(0, dtype=object)
+
+        # pandas makes the column of a tariff sheet float64 if it only has numbers,
+        # some of them floats, in which case its ints are written like floats
+        kinds = self.kinds[field][: self.length]
+        starts = np.array([start for _, start, _ in tariffs], dtype=np.int64)
+        lengths = np.array([stop - start for _, start, stop in tariffs])
+        lowest = np.minimum.reduceat(kinds, starts)
+        highest = np.maximum.reduceat(kinds, starts)
+        as_float = np.repeat(
+            (lowest != MISSING_NUMBER) & (highest == FLOAT_NUMBER), lengths
+        )
+        return np.array(
+            [
+                (
+                    ""
+                    if kind == MISSING_NUMBER or value != value
+                    else (
+                        str(int(value))
+                        if kind == INT_NUMBER and not is_float
+                        else repr(float(value))
+                    )
+                )
+                for value, kind, is_float in zip(
+                    buffer.tolist(), kinds.tolist(), as_float.tolist()
+                )
+            ],
+            dtype=object,
+        )
+
+    def save(self, savefolder, verbose=False):
+        """Saves the tariff sheet of each tariff as `savefolder` + label + ".csv"
+        with a single `to_csv` call for all of them, with the same text as
+        `pandas.DataFrame(create_tariff(row)).to_csv`
+
+        Parameters
+        ----------
+        savefolder : str
+            Folder to save to, ending with a separator.
+        verbose : bool
+            Whether to print each tariff that is saved. Default is False.
+        """
+        tariffs = self.tariffs()
+        texts = {}
+        for field in set(CHARGE_FIELDS.values()):
+            texts[field] = self.text(field, tariffs)
+        df = pd.DataFrame(
+            {column: texts[field] for column, field in CHARGE_FIELDS.items()}
+        )
+        header, *lines = df.to_csv(index=False, lineterminator="\n").split("\n")
+
+        # a quoted string with newlines takes up more than one line of the CSV
+        newlines = np.zeros(self.length, dtype=np.int64)
+        for field in CHARGE_STRING_FIELDS:
+            counts = [str(value).count("\n") for value in self.values[field]]
+            newlines += np.array(counts, dtype=np.int64)[
+                self.buffers[field][: self.length]
+            ]
+        line_offsets = np.concatenate([[0], np.cumsum(newlines + 1)])
+
+        for label, start, stop in tariffs:
+            body = lines[line_offsets[start] : line_offsets[stop]]
+            with open(
+                savefolder + f"{label}.csv", "w", encoding="utf-8", newline=""
+            ) as f:
+                f.write("\n".join([header, *body, ""]))
+            if verbose:
+                print(f"Saved {label} to {savefolder}")
+
+
+def run_lengths(values):
+    """Run-length encodes a 1-D array, or every row of a 2-D array in one pass.
+
+    A run ends wherever the next value is different, so each NaN is a run of its own.
+
+    Parameters
+    ----------
+    values : array_like
+        1-D or 2-D array of values, e.g. a parsed schedule.
+
+    Returns
+    -------
+    numpy.ndarray
+        (start, end, value) of each run as the rows of an array, where `end` is
+        inclusive. For a 2-D array, each row is (row, start, end, value) instead.
+    """
+    values = np.asarray(values)
+    if values.ndim == 1:
+        return run_lengths(values[np.newaxis])[:, 1:]
+    dtype = np.result_type(np.int64, values.dtype)
+    if values.size == 0:
+        return np.empty((0, 4), dtype=dtype)
+
+    # a run starts at the beginning of each row and wherever the value changes
+    is_start = np.empty(values.shape, dtype=bool)
+    is_start[:, 0] = True
+    np.not_equal(values[:, 1:], values[:, :-1], out=is_start[:, 1:])
+    flat_starts = np.flatnonzero(is_start)
+    # and ends just before the next run, since every row starts with a new run
+    flat_ends = np.empty_like(flat_starts)
+    flat_ends[:-1] = flat_starts[1:] - 1
+    flat_ends[-1] = values.size - 1
+    rows, starts = np.divmod(flat_starts, values.shape[1])
+
+    runs = np.empty((len(flat_starts), 4), dtype=dtype)
+    runs[:, 0] = rows
+    runs[:, 1] = starts
+    runs[:, 2] = flat_ends - rows * values.shape[1]
+    runs[:, 3] = values.reshape(-1)[flat_starts]
+    return runs
+
+
 def find_consecutive_ranges(lst):
     """
     Finds the consecutive ranges in a list of integers.
@@ -123,32 +1057,109 @@ def find_consecutive_ranges(lst):
     Parameters
     ----------
     lst : list
-        A list of integers.
+        A list of integers, or of lists/arrays of integers (e.g., a schedule),
+        in which case consecutive rows that are equal are one range.
 
     Returns
     -------
     list
         A list of tuples, where each tuple contains the start and end indices of a consecutive range.
     """
-    if not lst:
+    if len(lst) == 0:
         return []
 
-    ranges = []
-    start = 0
+    try:
+        values = np.asarray(lst)
+    except ValueError:
+        values = None
+    if values is None or values.ndim not in (1, 2) or values.dtype == object:
+        # e.g., a schedule whose rows have different lengths
+        ranges = []
+        start = 0
+        for i in range(1, len(lst)):
+            if np.any(lst[i] != lst[start]):
+                ranges.append((start, i - 1))
+                start = i
+        ranges.append((start, len(lst) - 1))
+        return ranges
+
+    # a range ends wherever the next value (or row) is different
+    changes = values[1:] != values[:-1]
+    if values.ndim == 2:
+        changes = changes.any(axis=1)
+    ends = np.flatnonzero(changes).tolist()
+    return list(zip([0] + [end + 1 for end in ends], ends + [len(values) - 1]))
+
+
+def group_runs(runs, n_rows):
+    """Groups the (row, start, end, value) runs of `run_lengths` by row
 
-    for i in range(1, len(lst)):
-        if lst[i] != lst[start]:
-            ranges.append((start, i - 1))
-            start = i
+    Parameters
+    ----------
+    runs : numpy.ndarray
+        Runs of a 2-D array from `run_lengths`, which are sorted by row.
+    n_rows : int
+        Number of rows in the array.
 
-    ranges.append((start, len(lst) - 1))
+    Returns
+    -------
+    list
+        The (start, end) tuples of the runs in each row, as in `find_consecutive_ranges`
+    """
+    ranges = list(zip(runs[:, 1].tolist(), runs[:, 2].tolist()))
+    ends = np.cumsum(np.bincount(runs[:, 0], minlength=n_rows)).tolist()
+    return [ranges[start:end] for start, end in zip([0] + ends[:-1], ends)]
 
-    return ranges
 
+def decompose_schedules(scheds):
+    """Splits parsed schedules into consecutive months and the consecutive hours
+    of each month, with one `run_lengths` call for all the regular schedules
 
-def process_demand_unit(charge, unit, charge_dict):
+    Parameters
+    ----------
+    scheds : list
+        Parsed schedules, e.g. from `parse_schedules`.
+
+    Returns
+    -------
+    list of tuple
+        The `find_consecutive_ranges` of the months of each schedule, and
+        of the hours of each of its months
     """
-    Processes the demand unit for the tariff file
+    result = [None] * len(scheds)
+    regular = []
+    for i, sched in enumerate(scheds):
+        if isinstance(sched, np.ndarray) and sched.shape == SCHEDULE_SHAPE:
+            regular.append(i)
+        else:
+            # e.g., a schedule whose rows have different lengths
+            result[i] = (
+                find_consecutive_ranges(sched),
+                [find_consecutive_ranges(hours) for hours in sched],
+            )
+    if not regular:
+        return result
+
+    n_months, n_hours = SCHEDULE_SHAPE
+    block = np.stack([scheds[i] for i in regular])
+    month_hour_ranges = group_runs(
+        run_lengths(block.reshape(-1, n_hours)), len(regular) * n_months
+    )
+    # consecutive months with the same hours get the same segment number
+    segments = np.zeros((len(regular), n_months), dtype=np.int64)
+    np.cumsum((block[:, 1:] != block[:, :-1]).any(axis=2), axis=1, out=segments[:, 1:])
+    month_ranges = group_runs(run_lengths(segments), len(regular))
+    for j, i in enumerate(regular):
+        result[i] = (
+            month_ranges[j],
+            month_hour_ranges[j * n_months : (j + 1) * n_months],
+        )
+    return result
+
+
+def demand_unit(charge, unit):
+    """
+    Converts a demand charge to $/kW
 
     Parameters
     ----------
@@ -158,43 +1169,64 @@ def process_demand_unit(charge, unit, charge_dict):
     unit : str
         The demand unit for the tariff file.
 
-    charge_dict : dict
-        The dictionary for the tariff file.
-
     Returns
     -------
-    dict
-        The dictionary for the tariff file with the processed demand unit.
+    tuple
+        The charge in $/kW, its units, and a note on how demand is measured. The
+        charge and units are "" if the unit is unknown, and the note is None if
+        there is nothing to note.
     """
     if isinstance(unit, float) and math.isnan(unit):
-        charge_dict["units"] = "$/kW"
-        charge_dict["charge (imperial)"] = charge
-        charge_dict["charge (metric)"] = charge
-        return charge_dict
+        return charge, "$/kW", None
 
     unit_arr = unit.split(" ")
     unit_name = unit_arr[0]
 
+    notes = None
     if len(unit_arr) > 1:
         unit_daily = unit_arr[1]
         if unit_daily == "daily":
-            charge_dict["Notes"] = "demand measured daily "
+            notes = "demand measured daily "
     if unit_name == "kW":
-        charge_dict["units"] = "$/kW"
-        charge_dict["charge (imperial)"] = charge
-        charge_dict["charge (metric)"] = charge
+        return charge, "$/kW", notes
     elif unit_name == "kVA":  # Converted from $/kVA to $/kW using PF=0.95
-        charge_dict["units"] = "$/kW"
-        charge_dict["charge (imperial)"] = charge / POWER_FACTOR
-        charge_dict["charge (metric)"] = charge / POWER_FACTOR
+        return charge / POWER_FACTOR, "$/kW", notes
     elif unit_name == "hp":  # Converted from $/hp to $/kW using factor of 0.7457
-        charge_dict["units"] = "$/kW"
-        charge_dict["charge (imperial)"] = charge * HP_TO_KW_CONVERSION
-        charge_dict["charge (metric)"] = charge * HP_TO_KW_CONVERSION
+        return charge * HP_TO_KW_CONVERSION, "$/kW", notes
+    return "", "", notes
+
+
+def process_demand_unit(charge, unit, charge_dict):
+    """
+    Processes the demand unit for the tariff file
+
+    Parameters
+    ----------
+    charge : float
+        The demand charge in the given units.
+
+    unit : str
+        The demand unit for the tariff file.
+
+    charge_dict : dict
+        The dictionary for the tariff file.
+
+    Returns
+    -------
+    dict
+        The dictionary for the tariff file with the processed demand unit.
+    """
+    charge, units, notes = demand_unit(charge, unit)
+    if notes is not None:
+        charge_dict["Notes"] = notes
+    if units:
+        charge_dict["units"] = units
+        charge_dict["charge (imperial)"] = charge
+        charge_dict["charge (metric)"] = charge
     return charge_dict
 
 
-def process_customer(openei_tariff_row):
+def process_customer(openei_tariff_row, charges=None):
     """
     Processes the customer monthly rate for the tariff file
 
@@ -202,45 +1234,39 @@ def process_customer(openei_tariff_row):
     ----------
     openei_tariff_row : pandas.DataFrame
         A row of the original data from OpenEI's utility rate database.
+    charges : ChargeBuilder
+        Where to add the charges. Default is None, in which case a new `ChargeList` is used.
 
     Returns
     -------
     list
-        The list of dictionaries for the tariff file with the processed customer monthly rate.
+        The list of dictionaries for the tariff file with the processed customer
+        monthly rate, or `charges` if it is given.
     """
+    charges = ChargeList() if charges is None else charges
     if pd.isna(openei_tariff_row["fixedchargefirstmeter"]):
         customer_charge = 0
     else:
         customer_charge = openei_tariff_row["fixedchargefirstmeter"]
-    data_dict = make_dict()
-    data_dict["label"] = openei_tariff_row["label"]
-    data_dict["utility"] = "electric"
-    data_dict["type"] = "customer"
-    data_dict["assessed"] = ""
-    data_dict["period"] = ""
-    data_dict["basic_charge_limit (imperial)"] = ""
-    data_dict["basic_charge_limit (metric)"] = ""
-    data_dict["month_start"] = ""
-    data_dict["month_end"] = ""
-    data_dict["hour_start"] = ""
-    data_dict["hour_end"] = ""
-    data_dict["weekday_start"] = ""
-    data_dict["weekday_end"] = ""
-    data_dict["charge (imperial)"] = customer_charge
-    data_dict["charge (metric)"] = customer_charge
-    data_dict["units"] = "$/month"
-    data_dict["Notes"] = str(openei_tariff_row["source"]) + (
-        "\t" + str(openei_tariff_row["sourceparent"])
-        if not (
-            openei_tariff_row["sourceparent"] == ""
-            or pd.isna(openei_tariff_row["sourceparent"])
-        )
-        else ""
+    charges.add(
+        openei_tariff_row["label"],
+        "customer",
+        customer_charge,
+        "$/month",
+        notes=str(openei_tariff_row["source"])
+        + (
+            "\t" + str(openei_tariff_row["sourceparent"])
+            if not (
+                openei_tariff_row["sourceparent"] == ""
+                or pd.isna(openei_tariff_row["sourceparent"])
+            )
+            else ""
+        ),
     )
-    return [data_dict]
+    return charges
 
 
-def process_flat_demand(openei_tariff_row):
+def process_flat_demand(openei_tariff_row, charges=None):
     """
     Processes the demand rate for the tariff file
 
@@ -248,6 +1274,8 @@ def process_flat_demand(openei_tariff_row):
     -------
     openei_tariff_row : pandas.DataFrame
         A row from the original data from OpenEI's utility rate database.
+    charges : ChargeBuilder
+        Where to add the charges. Default is None, in which case a new `ChargeList` is used.
 
     Raises
     -------
@@ -257,8 +1285,10 @@ def process_flat_demand(openei_tariff_row):
     Returns
     -------
     list
-        The list of dictionaries for the tariff file with the processed demand rate.
+        The list of dictionaries for the tariff file with the processed demand
+        rate, or `charges` if it is given.
     """
+    charges = ChargeList() if charges is None else charges
 
     # all the possible month arrays
     MONTH_ARRAY = [
@@ -288,69 +1318,63 @@ def process_flat_demand(openei_tariff_row):
     time_index = 0
     tier_index = 0
     charge_limit = 0
-
-    dict_list = []
+    # a flat demand structure is added entirely or not at all
+    length = len(charges)
 
     while time_index < len(ranges):
         try:
-            # tier_str first to catch ValueErrors from null values in the dataframe
-            tier_str = (
-                "flatdemandstructure/period"
-                + str(int(sched[ranges[time_index][0]]))
-                + "/tier"
-                + str(tier_index)
+            # period first to catch ValueErrors from null values in the dataframe
+            period = int(sched[ranges[time_index][0]])
+            charge, adj, charge_max = tier_rates(
+                openei_tariff_row, "flatdemandstructure", period, tier_index
             )
-            charge = openei_tariff_row[tier_str + "rate"]
         except (ValueError, KeyError):
-            return []
-
-        data_dict = make_dict()
-        data_dict["label"] = openei_tariff_row["label"]
-        # Add one to all month temporal data in order to convert 0-index months to 1-index
-        data_dict["month_start"] = str(ranges[time_index][0] + 1)
-        data_dict["month_end"] = str(ranges[time_index][1] + 1)
-        data_dict["utility"] = "electric"
-        data_dict["type"] = "demand"
-        data_dict["assessed"] = ""
-        data_dict["period"] = "flat"
-        data_dict["basic_charge_limit (imperial)"] = charge_limit
-        data_dict["basic_charge_limit (metric)"] = charge_limit
-        data_dict["hour_start"] = "0"
-        data_dict["hour_end"] = "24"
-        data_dict["weekday_start"] = "0"
-        data_dict["weekday_end"] = "6"
-        if not np.isnan(openei_tariff_row[tier_str + "adj"]):
-            charge += openei_tariff_row[tier_str + "adj"]
-            data_dict[
-                "Notes"
-            ] += f'adjustment factor of {openei_tariff_row[tier_str + "adj"]}'
-        else:
-            data_dict["Notes"] += ""
-        data_dict = process_demand_unit(
-            charge, openei_tariff_row["flatdemandunit"], data_dict
+            charges.truncate(length)
+            return charges
+
+        notes = ""
+        if not np.isnan(adj):
+            charge += adj
+            notes = f"adjustment factor of {adj}"
+        charge, units, daily = demand_unit(charge, openei_tariff_row["flatdemandunit"])
+        charges.add(
+            openei_tariff_row["label"],
+            "demand",
+            charge,
+            units,
+            period="flat",
+            charge_limit=charge_limit,
+            # Add one to all month temporal data in order to convert 0-index months to 1-index
+            month_start=str(ranges[time_index][0] + 1),
+            month_end=str(ranges[time_index][1] + 1),
+            hour_start="0",
+            hour_end="24",
+            weekday_start="0",
+            weekday_end="6",
+            notes=notes if daily is None else daily,
         )
 
-        dict_list.append(data_dict)
-
-        max_str = (
-            "flatdemandstructure/period"
-            + str(int(sched[ranges[time_index][0]]))
-            + "/tier"
-            + str(tier_index)
-            + "max"
-        )
-        if not np.isnan(openei_tariff_row[max_str]):
-            charge_limit = openei_tariff_row[max_str]
+        if not np.isnan(charge_max):
+            charge_limit = charge_max
             tier_index += 1
         else:
             time_index += 1
             tier_index = 0
 
-    return dict_list
+    return charges
 
 
 def unpack_array(
-    lst, sched, string, units, tariff_type, week_start, week_end, openei_tariff_row
+    lst,
+    sched,
+    string,
+    units,
+    tariff_type,
+    week_start,
+    week_end,
+    openei_tariff_row,
+    month_hour_ranges=None,
+    charges=None,
 ):
     """Produces tariff rates for rates where temporal data is stored in nested lists
 
@@ -372,6 +1396,11 @@ def unpack_array(
         The numeric value for the end day of the week where the tariff is in effect.
     openei : pandas.DataFrame
         The original data from OpenEI's utility rate database.
+    month_hour_ranges : list
+        The consecutive ranges of hours in each month of `sched`, e.g. from
+        `ScheduleCache`. Default is None, in which case they are computed here.
+    charges : ChargeBuilder
+        Where to add the charges. Default is None, in which case a new `ChargeList` is used.
 
     Raises
     -------
@@ -381,72 +1410,57 @@ def unpack_array(
     Returns
     -------
     list
-        The list of dictionaries for the tariff file with the processed rate added.
+        The list of dictionaries for the tariff file with the processed rate
+        added, or `charges` if it is given.
     """
+    charges = ChargeList() if charges is None else charges
     day_index = 0
     hour_index = 0
     charge_limit = 0
     tier_index_dict = {}
 
+    if month_hour_ranges is None:
+        month_hour_ranges = decompose_schedules([sched])[0][1]
+
     hour_list = sched[lst[day_index][0]]  # month_lst is the current month looked at
-    hour_ranges = find_consecutive_ranges(hour_list)  # processed month_lst
+    hour_ranges = month_hour_ranges[lst[day_index][0]]  # processed month_lst
     hour = hour_ranges[hour_index][0]
 
-    dict_list = []
-
     while day_index < len(lst) and hour_index < len(hour_ranges):
         if hour_list[hour] not in tier_index_dict:
             tier_index_dict[hour_list[hour]] = 0
-        data_dict = make_dict()
         try:
-            # tier_str first to catch ValueErrors from null values in the dataframe
-            tier_str = (
-                string
-                + "/period"
-                + str(hour_list[hour])
-                + "/tier"
-                + str(tier_index_dict[hour_list[hour]])
+            rate, adj, rate_max = tier_rates(
+                openei_tariff_row,
+                string,
+                int(hour_list[hour]),
+                tier_index_dict[hour_list[hour]],
             )
-            rate = openei_tariff_row[tier_str + "rate"]
         except (IndexError, ValueError, KeyError):
-            return dict_list
-
-        data_dict["label"] = openei_tariff_row["label"]
-        # Add one to all month temporal data in order to convert 0-index months to 1-index
-        data_dict["month_start"] = str(lst[day_index][0] + 1)
-        data_dict["month_end"] = str(lst[day_index][1] + 1)
-        data_dict["utility"] = "electric"
-        data_dict["type"] = tariff_type
-        data_dict["assessed"] = ""
-        data_dict["period"] = "period" + str(hour_list[hour])
-        data_dict["basic_charge_limit (imperial)"] = charge_limit
-        data_dict["basic_charge_limit (metric)"] = charge_limit
-        data_dict["hour_start"] = hour_ranges[hour_index][0]
-        data_dict["hour_end"] = hour_ranges[hour_index][1] + 1
-        # Not the case for all structures
-        data_dict["weekday_start"] = week_start
-        data_dict["weekday_end"] = week_end
-        if not np.isnan(openei_tariff_row[tier_str + "adj"]):
-            rate += openei_tariff_row[tier_str + "adj"]
-        data_dict["charge (imperial)"] = float(rate)
-        data_dict["charge (metric)"] = float(rate)
-
-        data_dict["units"] = units
-        data_dict["Notes"] = ""
-
-        # append to list of dictionaries - each dict is a charge
-        dict_list.append(data_dict)
-
-        max_str = (
-            string
-            + "/period"
-            + str(hour_list[hour])
-            + "/tier"
-            + str(tier_index_dict[hour_list[hour]])
-            + "max"
+            return charges
+
+        if not np.isnan(adj):
+            rate += adj
+        # each charge is a row of the tariff file
+        charges.add(
+            openei_tariff_row["label"],
+            tariff_type,
+            float(rate),
+            units,
+            period="period" + str(hour_list[hour]),
+            charge_limit=charge_limit,
+            # Add one to all month temporal data in order to convert 0-index months to 1-index
+            month_start=str(lst[day_index][0] + 1),
+            month_end=str(lst[day_index][1] + 1),
+            hour_start=hour_ranges[hour_index][0],
+            hour_end=hour_ranges[hour_index][1] + 1,
+            # Not the case for all structures
+            weekday_start=week_start,
+            weekday_end=week_end,
         )
-        if not np.isnan(openei_tariff_row[max_str]):
-            charge_limit = openei_tariff_row[max_str]
+
+        if not np.isnan(rate_max):
+            charge_limit = rate_max
             tier_index_dict[hour_list[hour]] += 1
         elif hour_index < len(hour_ranges) - 1:
             hour_index += 1
@@ -459,44 +1473,45 @@ def unpack_array(
             hour_list = sched[
                 lst[day_index][0]
             ]  # month_lst is the current month looked at
-            hour_ranges = find_consecutive_ranges(hour_list)  # processed month_lst
+            hour_ranges = month_hour_ranges[lst[day_index][0]]  # processed month_lst
             hour = hour_ranges[hour_index][0]
         except IndexError:
-            return dict_list
+            return charges
 
-    return dict_list
+    return charges
 
 
-def process_tou_demand(openei_tariff_row):
+def process_tou_demand(openei_tariff_row, charges=None):
     """
     Processes TOU tariff rates for the tariff file
 
     Parameters
     ----------
-    i : int
-        The index of the row in the openei dataframe.
-    tariff : list
-        The list of dictionaries for the tariff file.
-    openei : pandas.DataFrame
-        The original data from OpenEI's utility rate database.
+    openei_tariff_row : pandas.DataFrame
+        A row of the original data from OpenEI's utility rate database.
+    charges : ChargeBuilder
+        Where to add the charges. Default is None, in which case a new `ChargeList` is used.
 
     Returns
     -------
     list
-        The list of dictionaries for the tariff file with the processed TOU rates.
+        The list of dictionaries for the tariff file with the processed TOU
+        rates, or `charges` if it is given.
     """
-    if pd.isna(openei_tariff_row["demandweekdayschedule"]) and pd.isna(
+    charges = ChargeList() if charges is None else charges
+    if schedule_is_missing(
+        openei_tariff_row["demandweekdayschedule"]
+    ) and schedule_is_missing(openei_tariff_row["demandweekendschedule"]):
+        return charges
+
+    weekday_sched, weekday_ranges, weekday_hour_ranges = SCHEDULE_CACHE.get(
+        openei_tariff_row["demandweekdayschedule"]
+    )
+    weekend_sched, weekend_ranges, weekend_hour_ranges = SCHEDULE_CACHE.get(
         openei_tariff_row["demandweekendschedule"]
-    ):
-        return []
-
-    weekday_sched = ast.literal_eval(openei_tariff_row["demandweekdayschedule"])
-    weekend_sched = ast.literal_eval(openei_tariff_row["demandweekendschedule"])
-
-    weekday_ranges = find_consecutive_ranges(weekday_sched)
-    weekend_ranges = find_consecutive_ranges(weekend_sched)
+    )
 
-    dict_list_weekday = unpack_array(
+    unpack_array(
         weekday_ranges,
         weekday_sched,
         "demandratestructure",
@@ -505,9 +1520,10 @@ def process_tou_demand(openei_tariff_row):
         0,
         4,
         openei_tariff_row,
+        month_hour_ranges=weekday_hour_ranges,
+        charges=charges,
     )
-
-    dict_list_weekend = unpack_array(
+    unpack_array(
         weekend_ranges,
         weekend_sched,
         "demandratestructure",
@@ -516,42 +1532,44 @@ def process_tou_demand(openei_tariff_row):
         5,
         6,
         openei_tariff_row,
+        month_hour_ranges=weekend_hour_ranges,
+        charges=charges,
     )
-    dict_list_weekday.extend(dict_list_weekend)
 
-    return dict_list_weekday
+    return charges
 
 
-def process_energy(openei_tariff_row):
+def process_energy(openei_tariff_row, charges=None):
     """
     Processes energy structure tariff rates for the tariff file
 
     Parameters
     ----------
-    i : int
-        The index of the row in the openei dataframe.
-    tariff : list
-        The list of dictionaries for the tariff file.
-    openei : pandas.DataFrame
-        The original data from OpenEI's utility rate database.
+    openei_tariff_row : pandas.DataFrame
+        A row of the original data from OpenEI's utility rate database.
+    charges : ChargeBuilder
+        Where to add the charges. Default is None, in which case a new `ChargeList` is used.
 
     Returns
     -------
     list
-        The list of dictionaries for the tariff file with the processed energy structure rates.
+        The list of dictionaries for the tariff file with the processed energy
+        structure rates, or `charges` if it is given.
     """
-    if pd.isna(openei_tariff_row["energyweekdayschedule"]) and pd.isna(
+    charges = ChargeList() if charges is None else charges
+    if schedule_is_missing(
+        openei_tariff_row["energyweekdayschedule"]
+    ) and schedule_is_missing(openei_tariff_row["energyweekendschedule"]):
+        return charges
+
+    weekday_sched, weekday_ranges, weekday_hour_ranges = SCHEDULE_CACHE.get(
+        openei_tariff_row["energyweekdayschedule"]
+    )
+    weekend_sched, weekend_ranges, weekend_hour_ranges = SCHEDULE_CACHE.get(
         openei_tariff_row["energyweekendschedule"]
-    ):
-        return []
-
-    weekday_sched = ast.literal_eval(openei_tariff_row["energyweekdayschedule"])
-    weekend_sched = ast.literal_eval(openei_tariff_row["energyweekendschedule"])
-
-    weekday_ranges = find_consecutive_ranges(weekday_sched)
-    weekend_ranges = find_consecutive_ranges(weekend_sched)
+    )
 
-    dict_list_weekday = unpack_array(
+    unpack_array(
         weekday_ranges,
         weekday_sched,
         "energyratestructure",
@@ -560,8 +1578,10 @@ def process_energy(openei_tariff_row):
         0,
         4,
         openei_tariff_row,
+        month_hour_ranges=weekday_hour_ranges,
+        charges=charges,
     )
-    dict_list_weekend = unpack_array(
+    unpack_array(
         weekend_ranges,
         weekend_sched,
         "energyratestructure",
@@ -570,11 +1590,157 @@ def process_energy(openei_tariff_row):
         5,
         6,
         openei_tariff_row,
+        month_hour_ranges=weekend_hour_ranges,
+        charges=charges,
     )
 
-    dict_list_weekday.extend(dict_list_weekend)
+    return charges
+
+
+class ZipcodeIndex:
+    """Index of the EIA zipcode table by EIA ID, built once per run.
 
-    return dict_list_weekday
+    The table is stably sorted by `eiaid`, so that the zipcodes of each utility
+    are a contiguous slice given by `offsets` (like a CSR matrix), and the first
+    zipcode of each utility in the original table is at the start of its slice.
+
+    Parameters
+    ----------
+    eia_zipcode_database : pandas.DataFrame
+        The dataframe of zipcodes mapping to EIA IDs, with `eiaid`, `zip`, and
+        `state` columns.
+    """
+
+    def __init__(self, eia_zipcode_database):
+        table = eia_zipcode_database[eia_zipcode_database["eiaid"].notna()]
+        eiaids = table["eiaid"].to_numpy(dtype=np.int64)
+        order = np.argsort(eiaids, kind="stable")
+        self.eiaids, starts = np.unique(eiaids[order], return_index=True)
+        self.offsets = np.append(starts, len(order))
+        self.zips = table["zip"].to_numpy(dtype=float, na_value=np.nan)[order]
+        self.states = table["state"].to_numpy(dtype=object, na_value=np.nan)[order]
+
+    def find(self, eiaids):
+        """Positions of `eiaids` in the index
+
+        Parameters
+        ----------
+        eiaids : array_like
+            EIA IDs to look up.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            The position of each EIA ID in `self.eiaids` and whether it was found
+        """
+        eiaids = np.asarray(eiaids, dtype=float)
+        positions = np.searchsorted(self.eiaids, eiaids)
+        positions = np.minimum(positions, len(self.eiaids) - 1)
+        found = (len(self.eiaids) > 0) & (self.eiaids[positions] == eiaids)
+        return positions, found
+
+    def first(self, eiaids):
+        """The first zipcode and state of each utility, as in the original table
+
+        Parameters
+        ----------
+        eiaids : array_like
+            EIA IDs to look up.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            The zipcode (NaN if the utility is not in the table) and state of
+            each EIA ID
+        """
+        positions, found = self.find(eiaids)
+        starts = self.offsets[positions]
+        zips = np.where(found, self.zips[starts], np.nan)
+        states = np.where(found, self.states[starts], np.nan)
+        return zips, states
+
+    def all_zips(self, eiaid):
+        """All the zipcodes of one utility, in the order of the original table"""
+        positions, found = self.find([eiaid])
+        if not found[0]:
+            return self.zips[:0]
+        return self.zips[self.offsets[positions[0]] : self.offsets[positions[0] + 1]]
+
+
+def named_states(columns, state_abbr=STATE_ABBR):
+    """Finds the first state in `state_abbr` whose name appears in any of `columns`
+
+    Parameters
+    ----------
+    columns : list of pandas.Series
+        Text to search for state names in (e.g., utility and source), aligned
+        on the same index.
+    state_abbr : dict
+        State abbreviation of each state name, searched in order.
+
+    Returns
+    -------
+    pandas.Series
+        The abbreviation of the state named in each row, or NaN if there is none
+    """
+    state = pd.Series(np.nan, index=columns[0].index, dtype=object)
+    texts = [column.astype(str) for column in columns]
+    for name, abbr in state_abbr.items():
+        missing = state.isna().to_numpy()
+        if not missing.any():
+            break
+        named = np.zeros(missing.sum(), dtype=bool)
+        for text in texts:
+            named |= text[missing].str.contains(name, regex=False, na=False).to_numpy()
+        state[state.index[missing][named]] = abbr
+    return state
+
+
+def generate_metadata_table(openei_df, zipcode_index, state_abbr=STATE_ABBR):
+    """Generates the metadata of every tariff at once (see `generate_metadata`).
+
+    Parameters
+    ----------
+    openei_df : pandas.DataFrame
+        The original data from OpenEI's utility rate database.
+    zipcode_index : ZipcodeIndex
+        The zipcodes mapping to EIA IDs.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row of metadata per tariff with the following columns:
+        eiaid, label, name, utility, source, zipcode, state, notes
+    """
+    metadata = pd.DataFrame(index=openei_df.index)
+    metadata["eiaid"] = openei_df["eiaid"].astype("int64").astype(str).astype(object)
+    for key in ["label", "name", "utility", "source"]:
+        metadata[key] = openei_df[key].astype(object)
+
+    # just take the first zipcode of the utility - TODO: do something better/more sophisticated with more info
+    zips, states = zipcode_index.first(openei_df["eiaid"])
+    found = ~np.isnan(zips)
+    # check if the zip code is 5 digits otherwise add leading zeros
+    metadata["zipcode"] = [
+        (
+            (normalize_zipcode(zip_val) if zip_val < 10000 else int(zip_val))
+            if ok
+            else np.nan
+        )
+        for zip_val, ok in zip(zips, found)
+    ]
+    metadata["state"] = np.where(found, states, np.nan)
+
+    # otherwise look for the name of the state in the utility or source
+    missing = ~found
+    if missing.any():
+        metadata.loc[missing, "state"] = named_states(
+            [openei_df.loc[missing, "utility"], openei_df.loc[missing, "source"]],
+            state_abbr=state_abbr,
+        )
+
+    metadata["notes"] = openei_df["description"].astype(object)
+    return metadata
 
 
 def generate_metadata(openei_tariff_row, eia_zipcode_database, state_abbr=STATE_ABBR):
@@ -584,8 +1750,8 @@ def generate_metadata(openei_tariff_row, eia_zipcode_database, state_abbr=STATE_
     ----------
     openei_tariff_row : pandas.DataFrame
         A row of the original data from OpenEI's utility rate database.
-    eia_zipcode_database : pandas.DataFrame
-        The dataframe of zipcodes mapping to EIA IDs.
+    eia_zipcode_database : pandas.DataFrame or ZipcodeIndex
+        The dataframe of zipcodes mapping to EIA IDs, or its index to reuse.
 
     Returns
     -------
@@ -593,148 +1759,220 @@ def generate_metadata(openei_tariff_row, eia_zipcode_database, state_abbr=STATE_
         A dictionary of metadata for the tariff sheet with the following keys:
         eiaid, name, label, utility, source, zipcode, state, city, county, notes
     """
-    metadata = {}
-    metadata["eiaid"] = str(int(openei_tariff_row["eiaid"]))
-
-    for key in ["label", "name", "utility", "source"]:
-        metadata[key] = openei_tariff_row[key]
-
-    try:
-        # subset the list of zipcodes that match the eiaid
-        valid_zips = eia_zipcode_database[
-            eia_zipcode_database["eiaid"] == openei_tariff_row["eiaid"]
-        ]
-        # just take the first one - TODO: do something better/more sophisticated with more info
-        zip_val = int(valid_zips["zip"].iloc[0])
-        # check if the zip code is 5 digits otherwise add a leading 0
-        if len(str(zip_val)) < 5:
-            zip_val = "0" + str(zip_val)
-        metadata["zipcode"] = zip_val
-        metadata["state"] = valid_zips["state"].iloc[
-            0
-        ]  # likely all the states are the same
-    except:
-        metadata["zipcode"] = np.nan
-        metadata["state"] = np.nan
-        for key, val in state_abbr.items():
-            if key in str(openei_tariff_row["utility"]) or key in str(
-                openei_tariff_row["source"]
-            ):
-                metadata["state"] = val
-                break
-
-    metadata["notes"] = openei_tariff_row["description"]
-
-    return metadata
+    if not isinstance(eia_zipcode_database, ZipcodeIndex):
+        eia_zipcode_database = ZipcodeIndex(eia_zipcode_database)
+    columns = ["eiaid", "label", "name", "utility", "source", "description"]
+    openei_df = pd.DataFrame({key: [openei_tariff_row[key]] for key in columns}).astype(
+        {key: object for key in columns if key != "eiaid"}
+    )
+    metadata = generate_metadata_table(
+        openei_df, eia_zipcode_database, state_abbr=state_abbr
+    )
+    return metadata.iloc[0].to_dict()
 
 
-def create_tariff(openei_tariff_row):
+def create_tariff(openei_tariff_row, charges=None):
     """
     Create entire tariff sheet
 
     Parameters
     ----------
-    zipcodes : pandas.DataFrame
-        The dataframe of zipcodes mapping to EIA IDs.
+    openei_tariff_row : pandas.DataFrame
+        A row of the original data from OpenEI's utility rate database.
+    charges : ChargeBuilder
+        Where to add the charges. Default is None, in which case a new `ChargeList` is used.
 
     Returns
     -------
     list
-        The list of tariff sheets with a new list added for the index just added.
+        The list of dictionaries of the tariff sheet, or `charges` if it is given.
     """
-    tariff = []
+    charges = ChargeList() if charges is None else charges
+
+    process_customer(openei_tariff_row, charges)
+    process_flat_demand(openei_tariff_row, charges)
+    process_tou_demand(openei_tariff_row, charges)
+    process_energy(openei_tariff_row, charges)
+    return charges
 
-    tariff.extend(process_customer(openei_tariff_row))
-    tariff.extend(process_flat_demand(openei_tariff_row))
-    tariff.extend(process_tou_demand(openei_tariff_row))
-    tariff.extend(process_energy(openei_tariff_row))
-    return tariff
 
+# latitude and longitude of each normalized zipcode that has been geocoded
+LAT_LONG_CACHE = {}
 
-def get_lat_long(zipcode):
+
+def get_lat_longs(zipcodes, verbose=True, allow_pgeocode=False):
+    """Get the latitude and longitude of many postal codes at once.
+
+    Zipcodes are normalized to 5 digits (see `normalize_zipcode`) before they
+    are looked up, so the table of `build_zip_table` and pgeocode are given the
+    same strings. Zipcodes that have not been geocoded yet are looked up in the
+    table and remembered in `LAT_LONG_CACHE`.
+
+    Parameters
+    ----------
+    zipcodes : list
+        ZIP codes as strings or integers
+    verbose : bool
+        Whether to print the zipcodes that were not found. Default is True.
+    allow_pgeocode : bool
+        Whether to look up the zipcodes that are not in the table (or all of them
+        if there is no table) with a single pgeocode query, which downloads its
+        database the first time. Default is False.
+
+    Raises
+    ------
+    FileNotFoundError
+        If there is no table at `ZIP_TABLE_PATH` and `allow_pgeocode` is False
+
+    Returns
+    -------
+    list of tuple
+        Latitude and longitude of each zipcode, or (None, None) if it was not found
+    """
+    keys = [normalize_zipcode(zipcode) for zipcode in zipcodes]
+    new_keys = [
+        key
+        for key in dict.fromkeys(keys)
+        if key is not None and key not in LAT_LONG_CACHE
+    ]
+    if new_keys:
+        if os.path.exists(ZIP_TABLE_PATH):
+            latitude, longitude, _ = lookup_zips(new_keys)
+        elif allow_pgeocode:
+            latitude = np.full(len(new_keys), np.nan)
+            longitude = np.full(len(new_keys), np.nan)
+        else:
+            raise FileNotFoundError(
+                f"{ZIP_TABLE_PATH} does not exist, run `python scripts/download.py` "
+                "to build it or pass allow_pgeocode=True"
+            )
+        missing = np.isnan(latitude) | np.isnan(longitude)
+        if allow_pgeocode and missing.any():
+            result = nominatim().query_postal_code(
+                [key for key, miss in zip(new_keys, missing) if miss]
+            )
+            latitude[missing] = result["latitude"].to_numpy(float)
+            longitude[missing] = result["longitude"].to_numpy(float)
+            missing = np.isnan(latitude) | np.isnan(longitude)
+        for key, lat, long, miss in zip(new_keys, latitude, longitude, missing):
+            if miss and verbose:
+                print(f"Error with zipcode {key}")
+            # zipcodes not in the table may still be found by pgeocode later
+            if not miss:
+                LAT_LONG_CACHE[key] = (lat, long)
+            elif allow_pgeocode:
+                LAT_LONG_CACHE[key] = (None, None)
+    return [LAT_LONG_CACHE.get(key, (None, None)) for key in keys]
+
+
+def get_lat_long(zipcode, allow_pgeocode=False):
     """Get the latitude and longitude of the postal code and add it as a column
 
     Parameters
     ----------
     zipcode : str
         ZIP code as a string
-
-    nomi :
+    allow_pgeocode : bool
+        Whether to fall back to pgeocode, see `get_lat_longs`. Default is False.
 
     Returns
     -------
     float, float
         Latitude and longitude as a tuple
     """
-    nomi = pg.Nominatim("us")
+    return get_lat_longs([zipcode], allow_pgeocode=allow_pgeocode)[0]
 
-    # check if zipcode is a 5 digit number
-    if pd.isna(zipcode):
-        zipcode = "NaN"
-    else:
-        zipcode = str(int(zipcode))
-        if len(zipcode) != 5:
-            # add a zero to the end of the zipcode
-            zipcode = "0" + zipcode
-
-    obj = nomi.query_postal_code(zipcode)
-    if obj.latitude is None or np.isnan(obj.latitude):
-        print(f"Error with zipcode {zipcode}")
-        return None, None
-    elif obj.longitude is None or np.isnan(obj.longitude):
-        print(f"Error with zipcode {zipcode}")
-        return None, None
-    else:
-        pass
-    return obj.latitude, obj.longitude
 
+def convert_tariffs(openei_df, savefolder, verbose=False):
+    """Saves the tariff sheet of each row of `openei_df` as `savefolder` + label + ".csv"
 
-def main(savefolder="data/converted/", suffix="", verbose=False):
+    Parameters
+    ----------
+    openei_df : pandas.DataFrame
+        Rows of the filtered data from OpenEI's utility rate database.
+    savefolder : str
+        Folder to save to, ending with a separator.
+    verbose : bool
+        Whether to print each tariff that is saved. Default is False.
+
+    Returns
+    -------
+    tuple
+        The number of distinct schedules that were parsed and the number of
+        times that they were reused
+    """
+    misses, hits = SCHEDULE_CACHE.misses, SCHEDULE_CACHE.hits
+    # keep only the tiers each tariff has, indexed by period and tier, instead of
+    # the mostly empty tier columns
+    rates = RateTensors(openei_df)
+    openei_df = openei_df.drop(columns=list(rates.columns))
+    # parse every distinct schedule once instead of once per tariff
+    for column in SCHEDULE_COLUMNS:
+        SCHEDULE_CACHE.update(openei_df[column])
+
+    # build the tariff sheet of each row of openei_df into the same buffers
+    rows = TariffColumns(openei_df)
+    charges = ChargeBuilder()
+    for i in range(len(rows)):
+        create_tariff(rates.row(rows.row(i), i), charges)
+    charges.save(savefolder, verbose=verbose)
+    return SCHEDULE_CACHE.misses - misses, SCHEDULE_CACHE.hits - hits
+
+
+def main(
+    savefolder="data/converted/",
+    suffix="",
+    verbose=False,
+    engine=None,
+    allow_pgeocode=False,
+    workers=1,
+):
     zipcodes_path = "data/filtered/merged_zipcodes.csv"
-    zipcodes = pd.read_csv(zipcodes_path, low_memory=False)
+    zipcodes = read_typed_csv(
+        zipcodes_path, "zipcodes", engine=engine, low_memory=False
+    )
 
     openei_path = "data/filtered/usurdb" + suffix + ".csv"
-    openei_df = pd.read_csv(openei_path, low_memory=False)
+    openei_df = read_typed_csv(openei_path, "usurdb", engine=engine, low_memory=False)
     openei_df["sourceparent"] = openei_df["sourceparent"].fillna("")
 
     if not os.path.exists(savefolder):
         os.mkdir(savefolder)
 
-    metadata_list = []
-
-    # for each row of openei_df
-    # (1) build the tariff sheet
-    # (2) find the metadata and produce a metadata row
-    for i in range(len(openei_df)):
-        openei_tariff_row = openei_df.iloc[i]
-
-        # process the tariff
-        tariff = create_tariff(openei_tariff_row)
-        tariff_df = pd.DataFrame(tariff)
-        label = tariff_df["label"][0]
-        tariff_df.to_csv(savefolder + f"{label}.csv", index=False)
-
-        # create a row for the metadata
-        metadata_row = generate_metadata(openei_tariff_row, zipcodes)
-        metadata_row["latitude"], metadata_row["longitude"] = get_lat_long(
-            metadata_row["zipcode"]
-        )
-        if pd.isna(metadata_row["state"]):
-            print(f"'state' is NaN for {label}")
-            for key in STATE_ABBR.keys():
-                if key in metadata_row["utility"]:
-                    metadata_row["state"] = STATE_ABBR[key]
-                    print(
-                        f"Found 'state'={STATE_ABBR[key]} in 'utility'={metadata_row['utility']}"
-                    )
-                    break
-        metadata_list.append(metadata_row)
-
-        if verbose:
-            print(f"Saved {label} to {savefolder}")
-
-    # save the metadata
-    metadata_df = pd.DataFrame(metadata_list)
+    # find the metadata of every tariff with one lookup in the zipcode table
+    metadata_df = generate_metadata_table(openei_df, ZipcodeIndex(zipcodes))
+    metadata_df["latitude"], metadata_df["longitude"] = zip(
+        *get_lat_longs(metadata_df["zipcode"], allow_pgeocode=allow_pgeocode)
+    )
+    missing = metadata_df["state"].isna()
+    for label in metadata_df.loc[missing, "label"]:
+        print(f"'state' is NaN for {label}")
+    states = named_states([metadata_df.loc[missing, "utility"]]).dropna()
+    for i, state in states.items():
+        metadata_df.loc[i, "state"] = state
+        print(f"Found 'state'={state} in 'utility'={metadata_df.loc[i, 'utility']}")
+
+    # each tariff is saved to its own file, so contiguous chunks of rows can be
+    # converted in separate processes without changing the output
+    if workers > 1 and len(openei_df) > 1:
+        chunks = [
+            openei_df.iloc[positions]
+            for positions in np.array_split(np.arange(len(openei_df)), workers)
+        ]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            stats = list(
+                executor.map(
+                    convert_tariffs,
+                    chunks,
+                    [savefolder] * len(chunks),
+                    [verbose] * len(chunks),
+                )
+            )
+    else:
+        stats = [convert_tariffs(openei_df, savefolder, verbose=verbose)]
+    if verbose:
+        misses, hits = np.sum(stats, axis=0)
+        print(f"Parsed {misses} distinct schedules, reused {hits} times")
 
     # order the columns
     metadata_df = metadata_df[
@@ -755,5 +1993,11 @@ def main(savefolder="data/converted/", suffix="", verbose=False):
 
 
 if __name__ == "__main__":
-    main(savefolder="data/converted/bundled/", suffix="_bundled")
-    main(savefolder="data/converted/delivery_only/", suffix="_delivery_only")
+    main(
+        savefolder="data/converted/bundled/", suffix="_bundled", workers=os.cpu_count()
+    )
+    main(
+        savefolder="data/converted/delivery_only/",
+        suffix="_delivery_only",
+        workers=os.cpu_count(),
+    )
@@ -1,39 +1,592 @@
 import os
-import gzip
-import shutil
-from urllib.request import urlretrieve
+import json
+import time
+import zlib
+import hashlib
+import importlib.util
+import pandas as pd
+from http.client import HTTPException
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+try:
+    from scripts.geocode import ZIP_TABLE_PATH, build_zip_table
+    from scripts.schema import read_typed_csv
+except ImportError:  # run as `python scripts/download.py`
+    from geocode import ZIP_TABLE_PATH, build_zip_table
+    from schema import read_typed_csv
 
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# read the response 1 MiB at a time so memory use is independent of the file size
+CHUNK_SIZE = 1 << 20
+# print a progress line roughly every 25 MiB of compressed data
+PROGRESS_INTERVAL = 25 << 20
+
+# seconds to wait on a stalled connection before the attempt is retried
+TIMEOUT = 60
+# HTTP status codes that indicate a transient failure worth retrying
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+# rows per Parquet row group; small enough that filters can skip most of the file
+PARQUET_ROW_GROUP_SIZE = 5000
+
+MANIFEST_FILENAME = "manifest.json"
 
-def main():
+# every file the pipeline needs, keyed by the filename it is saved under in `data/raw`
+SOURCES = {
     # This file is too large to be included on GitHub but can be found at
     # https://openei.org/wiki/Utility_Rate_Database
-    url = "https://openei.org/apps/USURDB/download/usurdb.csv.gz"
-    filename = os.path.join("data", "raw", "usurdb_raw.csv.gz")
-    outpath = os.path.join("data", "raw", "usurdb_raw.csv")
-    urlretrieve(url, filename)
+    "usurdb_raw.csv.gz": {
+        "url": "https://openei.org/apps/USURDB/download/usurdb.csv.gz",
+        "decompress_to": "usurdb_raw.csv",
+        # columnar copy of the decompressed CSV read by `filter.py`
+        "parquet": "usurdb_raw.parquet",
+    },
+    "iou_zipcodes_2020.csv": {
+        "url": "https://data.openei.org/files/5650/iou_zipcodes_2020.csv",
+    },
+    "non_iou_zipcodes_2020.csv": {
+        "url": "https://data.openei.org/files/5650/non_iou_zipcodes_2020.csv",
+    },
+    # GeoNames postal codes (the same data pgeocode downloads) for offline geocoding
+    "US.zip": {
+        "url": "https://download.geonames.org/export/zip/US.zip",
+        # sorted ZIP code centroids read by `convert.get_lat_longs`
+        "zip_table": os.path.basename(ZIP_TABLE_PATH),
+    },
+    # Incorporate tariffs from https://github.com/we3lab/wwtp-energy-tariffs
+    "WWTP_Billing.xlsx": {
+        "url": "https://raw.githubusercontent.com/we3lab/wwtp-energy-tariffs/main/data/WWTP_Billing.xlsx",
+    },
+    "metadata.csv": {
+        "url": "https://raw.githubusercontent.com/we3lab/wwtp-energy-tariffs/main/data/metadata.csv",
+    },
+}
 
-    # From https://stackoverflow.com/questions/31028815/how-to-unzip-gz-file-using-python
-    with gzip.open(filename, "rb") as f_in:
-        with open(outpath, "wb") as f_out:
-            shutil.copyfileobj(f_in, f_out)
 
-    iou_url = "https://data.openei.org/files/5650/iou_zipcodes_2020.csv"
-    iou_filename = os.path.join("data", "raw", "iou_zipcodes_2020.csv")
-    urlretrieve(iou_url, iou_filename)
+def report_progress(filename, nbytes, total, start_time, done=False):
+    """Prints the number of bytes transferred so far and the throughput
 
-    non_iou_url = "https://data.openei.org/files/5650/non_iou_zipcodes_2020.csv"
-    non_iou_filename = os.path.join("data", "raw", "non_iou_zipcodes_2020.csv")
-    urlretrieve(non_iou_url, non_iou_filename)
+    Parameters
+    ----------
+    filename : str
+        Name of the file being downloaded.
+    nbytes : int
+        Number of bytes transferred so far.
+    total : int or None
+        Expected number of bytes, if known from the `Content-Length` header.
+    start_time : float
+        Value of `time.perf_counter()` when the transfer started.
+    done : bool
+        Whether the transfer has finished. Default is False.
+    """
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    rate = nbytes / elapsed / (1 << 20)
+    progress = f"{nbytes / (1 << 20):.1f} MiB"
+    if total:
+        progress += f" / {total / (1 << 20):.1f} MiB ({100 * nbytes / total:.0f}%)"
+    status = "Downloaded" if done else "Downloading"
+    print(f"{status} {filename}: {progress} in {elapsed:.1f} s ({rate:.2f} MiB/s)")
 
-    # Incorporate tariffs from https://github.com/we3lab/wwtp-energy-tariffs
-    xls_url = "https://raw.githubusercontent.com/we3lab/wwtp-energy-tariffs/main/data/WWTP_Billing.xlsx"
-    xls_filename = os.path.join("data", "raw", "WWTP_Billing.xlsx")
-    urlretrieve(xls_url, xls_filename)
-    metadata_url = "https://raw.githubusercontent.com/we3lab/wwtp-energy-tariffs/main/data/metadata.csv"
-    metadata_filename = os.path.join("data", "raw", "metadata.csv")
-    urlretrieve(metadata_url, metadata_filename)
+
+def stream_response(
+    response,
+    outpath=None,
+    decompress_path=None,
+    chunk_size=CHUNK_SIZE,
+    verbose=True,
+    resume=False,
+    total=None,
+):
+    """Copies an HTTP (or file://) response to disk chunk by chunk,
+    hashing it and optionally gunzipping it on the fly.
+
+    Parameters
+    ----------
+    response : http.client.HTTPResponse
+        Open response returned by `urlopen`.
+    outpath : str
+        Where to write the data exactly as received. Default is None,
+        in which case it is only hashed and/or decompressed.
+    decompress_path : str
+        Where to write the gunzipped data. Default is None,
+        in which case the data is not decompressed.
+    chunk_size : int
+        Number of bytes to read per iteration.
+    verbose : bool
+        Whether to print progress and throughput. Default is True.
+    resume : bool
+        Whether `response` continues the partial data already in `outpath`
+        (i.e., it answers a `Range` request). The existing bytes are hashed and
+        decompressed before the response is appended. Default is False.
+    total : int
+        Expected size of the complete file. Default is None, in which case
+        the `Content-Length` header is used for the progress readout.
+
+    Raises
+    ------
+    EOFError
+        If `decompress_path` is given and the gzip stream is truncated.
+
+    Returns
+    -------
+    int, int, str
+        Number of bytes in `outpath` (including any resumed bytes),
+        number of bytes decompressed, and the SHA-256 hex digest of `outpath`
+    """
+    sha256 = hashlib.sha256()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    nbytes_in = 0
+    nbytes_out = 0
+    next_report = PROGRESS_INTERVAL
+    start_time = time.perf_counter()
+    filename = os.path.basename(decompress_path or outpath or response.geturl())
+    if total is None:
+        total = response.headers.get("Content-Length")
+        total = int(total) if total else None
+
+    def read_chunks():
+        if resume:
+            # replay the partial file so the hash and decompressor catch up with it
+            with open(outpath, "rb") as f_part:
+                yield from iter(lambda: f_part.read(chunk_size), b"")
+        # marks the start of the response
+        yield None
+        yield from iter(lambda: response.read(chunk_size), b"")
+
+    f_raw = None
+    f_out = open(decompress_path, "wb") if decompress_path is not None else None
+    try:
+        for chunk in read_chunks():
+            if chunk is None:
+                if outpath is not None:
+                    f_raw = open(outpath, "ab" if resume else "wb")
+                continue
+            sha256.update(chunk)
+            nbytes_in += len(chunk)
+            if f_raw is not None:
+                f_raw.write(chunk)
+
+            if f_out is not None:
+                data = decompressor.decompress(chunk)
+                # a gzip file may be several concatenated members
+                while decompressor.eof and decompressor.unused_data:
+                    unused_data = decompressor.unused_data
+                    data += decompressor.flush()
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    data += decompressor.decompress(unused_data)
+                f_out.write(data)
+                nbytes_out += len(data)
+
+            if verbose and nbytes_in >= next_report:
+                report_progress(filename, nbytes_in, total, start_time)
+                next_report += PROGRESS_INTERVAL
+
+        if f_out is not None:
+            data = decompressor.flush()
+            f_out.write(data)
+            nbytes_out += len(data)
+            if not decompressor.eof:
+                raise EOFError(
+                    f"Compressed file ended before the end of the stream: {filename}"
+                )
+    finally:
+        if f_raw is not None:
+            f_raw.close()
+        if f_out is not None:
+            f_out.close()
+
+    if verbose:
+        report_progress(filename, nbytes_in, total, start_time, done=True)
+    return nbytes_in, nbytes_out, sha256.hexdigest()
+
+
+def load_manifest(cache_dir):
+    """Loads the download manifest from `cache_dir`, or an empty one if none exists"""
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, cache_dir):
+    """Writes the download manifest to `cache_dir`"""
+    with open(os.path.join(cache_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def load_part_info(part_path):
+    """Loads the validators saved alongside a partial download, if any"""
+    info_path = part_path + ".json"
+    if not (os.path.exists(part_path) and os.path.exists(info_path)):
+        return None
+    with open(info_path) as f:
+        return json.load(f)
+
+
+def remove_part(part_path):
+    """Deletes a partial download and its validators"""
+    for path in [part_path, part_path + ".json"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def fetch_source(filename, source, cache_dir, entry=None, verbose=True):
+    """Downloads one of `SOURCES` unless the cached copy is still current.
+
+    A conditional request (`If-None-Match` / `If-Modified-Since`) is sent when
+    the manifest has an entry for the file, and a download whose SHA-256 matches
+    the cached copy is discarded without touching the existing files.
+
+    The data is written to `<filename>.part` first. If a previous attempt was
+    interrupted, the transfer resumes from the end of the `.part` file with an
+    HTTP `Range` request (guarded by `If-Range`, so a file that changed upstream
+    is downloaded from scratch). The `.part` file is only promoted once its
+    length matches the size announced by the server and, if the source lists
+    a `sha256`, its hash matches too.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the file in `cache_dir`.
+    source : dict
+        Entry of `SOURCES` with the `url` and optionally `decompress_to` and `sha256`.
+    cache_dir : str
+        Directory where the files and manifest are stored.
+    entry : dict
+        The manifest entry from the previous download. Default is None,
+        in which case the file is downloaded unconditionally.
+    verbose : bool
+        Whether to print progress and throughput. Default is True.
+
+    Raises
+    ------
+    EOFError
+        If the connection closed before the whole file arrived.
+        The `.part` file is kept so the next attempt can resume.
+    OSError
+        If the completed file does not match the expected hash or is not valid gzip.
+        The `.part` file is deleted so the next attempt starts over.
+
+    Returns
+    -------
+    dict
+        New manifest entry with the following keys:
+        url, etag, last_modified, size, sha256, changed
+    """
+    outpath = os.path.join(cache_dir, filename)
+    part_path = outpath + ".part"
+    outpaths = [outpath]
+    decompress_path = None
+    if source.get("decompress_to") is not None:
+        decompress_path = os.path.join(cache_dir, source["decompress_to"])
+        outpaths.append(decompress_path)
+
+    cached = (
+        entry is not None
+        and entry.get("url") == source["url"]
+        and all(os.path.exists(path) for path in outpaths)
+    )
+    headers = {}
+    if cached:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    part_info = load_part_info(part_path)
+    resume_from = 0
+    if part_info is not None and part_info["url"] == source["url"]:
+        resume_from = os.path.getsize(part_path)
+        headers["Range"] = f"bytes={resume_from}-"
+        validator = part_info.get("etag") or part_info.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+    else:
+        remove_part(part_path)
+
+    try:
+        with urlopen(
+            Request(source["url"], headers=headers), timeout=TIMEOUT
+        ) as response:
+            response_headers = response.headers
+            # servers that ignore `Range` (or `If-Range` failed) send the whole file
+            resume = getattr(response, "status", None) == 206
+            if resume:
+                content_range = response_headers.get("Content-Range", "")
+                start, _, total = content_range.removeprefix("bytes ").partition("/")
+                if int(start.partition("-")[0]) != resume_from:
+                    raise EOFError(f"Unexpected Content-Range for {filename}")
+                total = int(total) if total.isdigit() else None
+                if verbose:
+                    print(f"Resuming {filename} from byte {resume_from}")
+            else:
+                total = response_headers.get("Content-Length")
+                total = int(total) if total else None
+            with open(part_path + ".json", "w") as f:
+                json.dump(
+                    {
+                        "url": source["url"],
+                        "etag": response_headers.get("ETag"),
+                        "last_modified": response_headers.get("Last-Modified"),
+                        "total": total,
+                    },
+                    f,
+                )
+
+            try:
+                nbytes, _, sha256 = stream_response(
+                    response,
+                    outpath=part_path,
+                    decompress_path=(
+                        decompress_path + ".tmp"
+                        if decompress_path is not None
+                        else None
+                    ),
+                    verbose=verbose,
+                    resume=resume,
+                    total=total,
+                )
+            except zlib.error as e:
+                remove_part(part_path)
+                raise OSError(f"{filename} is not a valid gzip file: {e}") from e
+    except HTTPError as e:
+        if e.code == 304 and cached:
+            remove_part(part_path)
+            if verbose:
+                print(f"{filename} is not modified upstream, using cached copy")
+            return dict(entry, changed=False)
+        if e.code == 416 and resume_from:
+            # the partial file is no longer a prefix of the upstream file
+            remove_part(part_path)
+            return fetch_source(filename, source, cache_dir, entry, verbose)
+        raise
+
+    if total is not None and nbytes != total:
+        raise EOFError(
+            f"Connection closed after {nbytes} of {total} bytes of {filename}"
+        )
+    if source.get("sha256") is not None and source["sha256"] != sha256:
+        remove_part(part_path)
+        raise OSError(f"SHA-256 of {filename} does not match {source['sha256']}")
+
+    changed = not (cached and entry.get("sha256") == sha256)
+    if changed:
+        os.replace(part_path, outpath)
+        if decompress_path is not None:
+            os.replace(decompress_path + ".tmp", decompress_path)
+    else:
+        os.remove(part_path)
+        if decompress_path is not None:
+            os.remove(decompress_path + ".tmp")
+        if verbose:
+            print(f"{filename} matches the cached copy (sha256 {sha256[:12]})")
+    os.remove(part_path + ".json")
+
+    return {
+        "url": source["url"],
+        "etag": response_headers.get("ETag"),
+        "last_modified": response_headers.get("Last-Modified"),
+        "size": nbytes,
+        "sha256": sha256,
+        "changed": changed,
+    }
+
+
+def cache_parquet(csv_path, parquet_path, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """Saves a typed, columnar copy of the raw USURDB CSV so it only has to be parsed once.
+
+    Rows are sorted by sector, service type and start date so that the Parquet
+    row-group statistics let readers skip the row groups that cannot match a filter.
+    The row number in the original CSV is kept as the index.
+
+    Parameters
+    ----------
+    csv_path : str
+        Path to the raw USURDB CSV.
+    parquet_path : str
+        Where to write the Parquet file.
+    row_group_size : int
+        Maximum number of rows per row group.
+    """
+    start_time = time.perf_counter()
+    df = read_typed_csv(csv_path, "usurdb", low_memory=False)
+    df["startdate"] = pd.to_datetime(df["startdate"], errors="coerce")
+    df["enddate"] = pd.to_datetime(df["enddate"], errors="coerce")
+    df = df.sort_values(["sector", "servicetype", "startdate"], kind="stable")
+    df.to_parquet(parquet_path + ".tmp", index=True, row_group_size=row_group_size)
+    os.replace(parquet_path + ".tmp", parquet_path)
+    print(
+        f"Cached {len(df)} rows of {os.path.basename(csv_path)} as "
+        f"{os.path.basename(parquet_path)} in {time.perf_counter() - start_time:.1f} s"
+    )
+
+
+def fetch_with_retries(
+    filename, source, cache_dir, entry=None, retries=3, backoff=1.0, verbose=True
+):
+    """Calls `fetch_source`, retrying transient failures with exponential backoff.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the file in `cache_dir`.
+    source : dict
+        Entry of `SOURCES` with the `url` and optionally `decompress_to`.
+    cache_dir : str
+        Directory where the files and manifest are stored.
+    entry : dict
+        The manifest entry from the previous download. Default is None.
+    retries : int
+        Number of times to retry after the first attempt fails. Default is 3.
+    backoff : float
+        Seconds to wait before the first retry, doubled for every retry after that.
+        Default is 1.0.
+    verbose : bool
+        Whether to print progress, latency and throughput. Default is True.
+
+    Raises
+    ------
+    urllib.error.HTTPError
+        Immediately if the server returns a non-transient error (e.g. 404),
+        or once all retries are used up.
+    OSError, EOFError, http.client.HTTPException
+        If the connection keeps failing after all retries.
+
+    Returns
+    -------
+    dict
+        New manifest entry for the file
+    """
+    for attempt in range(retries + 1):
+        start_time = time.perf_counter()
+        try:
+            new_entry = fetch_source(
+                filename, source, cache_dir, entry=entry, verbose=verbose
+            )
+        except (OSError, EOFError, HTTPException) as e:
+            # urllib.error.URLError and HTTPError are both subclasses of OSError
+            if isinstance(e, HTTPError) and e.code not in RETRY_STATUS_CODES:
+                raise
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            print(
+                f"Attempt {attempt + 1} to download {filename} failed ({e}), "
+                f"retrying in {delay:.1f} s"
+            )
+            time.sleep(delay)
+            continue
+
+        if verbose:
+            elapsed = max(time.perf_counter() - start_time, 1e-9)
+            nbytes = new_entry["size"] if new_entry["changed"] else 0
+            print(
+                f"Fetched {filename} in {elapsed:.2f} s "
+                f"({nbytes / elapsed / (1 << 20):.2f} MiB/s)"
+            )
+        return new_entry
+
+
+def main(
+    cache_dir=os.path.join("data", "raw"),
+    use_cache=True,
+    sources=SOURCES,
+    workers=len(SOURCES),
+    retries=3,
+    backoff=1.0,
+):
+    """Downloads all the raw data in parallel, skipping files that have not
+    changed upstream.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory where the raw files and `manifest.json` are stored.
+    use_cache : bool
+        Whether to send conditional requests based on the manifest.
+        Default is True. If False, every file is downloaded and replaced.
+    sources : dict
+        Files to download. Default is `SOURCES`.
+    workers : int
+        Number of files to download at the same time.
+        Default is one thread per file in `SOURCES`.
+    retries : int
+        Number of times to retry each file after a transient failure. Default is 3.
+    backoff : float
+        Seconds to wait before the first retry of a file, doubled for every
+        retry after that. Default is 1.0.
+
+    Raises
+    ------
+    RuntimeError
+        If any file could not be downloaded. The manifest is still updated
+        for the files that succeeded, and the files that failed are marked as
+        not changed.
+
+    Returns
+    -------
+    dict
+        The updated manifest, where `changed` marks each file that was replaced
+    """
+    manifest = load_manifest(cache_dir)
+    errors = {}
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                fetch_with_retries,
+                filename,
+                source,
+                cache_dir,
+                entry=manifest.get(filename) if use_cache else None,
+                retries=retries,
+                backoff=backoff,
+            ): filename
+            for filename, source in sources.items()
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                manifest[filename] = future.result()
+            except Exception as e:
+                print(f"Failed to download {filename}: {e}")
+                errors[filename] = e
+                # the cached copy (if any) was not replaced by this run
+                if filename in manifest:
+                    manifest[filename] = dict(manifest[filename], changed=False)
+    save_manifest(manifest, cache_dir)
+    print(f"Downloaded raw data in {time.perf_counter() - start_time:.1f} s")
+
+    for filename, source in sources.items():
+        if source.get("parquet") is None or filename not in manifest:
+            continue
+        parquet_path = os.path.join(cache_dir, source["parquet"])
+        if manifest[filename]["changed"] or not os.path.exists(parquet_path):
+            if importlib.util.find_spec("pyarrow") is None:
+                print(
+                    f"pyarrow is not installed, so {source['parquet']} was not created"
+                )
+                continue
+            cache_parquet(
+                os.path.join(cache_dir, source["decompress_to"]), parquet_path
+            )
+
+    for filename, source in sources.items():
+        if source.get("zip_table") is None or filename not in manifest:
+            continue
+        zip_table_path = os.path.join(cache_dir, source["zip_table"])
+        if manifest[filename]["changed"] or not os.path.exists(zip_table_path):
+            build_zip_table(zip_table_path, os.path.join(cache_dir, filename))
+
+    if errors:
+        raise RuntimeError(f"Failed to download {', '.join(sorted(errors))}") from next(
+            iter(errors.values())
+        )
+    return manifest
 
 
 if __name__ == "__main__":
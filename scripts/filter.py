@@ -1,72 +1,800 @@
 import os
 import datetime
+import importlib.util
+import numpy as np
 import pandas as pd
 
+try:
+    from scripts.convert import convert_columns, get_lat_longs, named_states
+    from scripts.schema import read_typed_csv
+except ImportError:  # run as `python scripts/filter.py`
+    from convert import convert_columns, get_lat_longs, named_states
+    from schema import read_typed_csv
+
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+RAW_CSV_PATH = os.path.join("data", "raw", "usurdb_raw.csv")
+RAW_PARQUET_PATH = os.path.join("data", "raw", "usurdb_raw.parquet")
+ZIPCODES_PATH = os.path.join("data", "filtered", "merged_zipcodes.csv")
+
+# columns needed to decide whether a tariff passes the filters
+FILTER_COLUMNS = [
+    "sector",
+    "servicetype",
+    "startdate",
+    "enddate",
+    "peakkwcapacitymin",
+    "peakkwcapacitymax",
+    "eiaid",
+    "name",
+    "utility",
+    "source",
+]
+
+# versions of the same tariff share these and differ in their start date
+DEDUP_COLUMNS = ["eiaid", "name", "sector", "servicetype"]
+
+# default filters for each of the `variants` passed to `filter_tariff_variants`
+VARIANT_DEFAULTS = {
+    "allowed_sectors": ["Industrial", "Commercial"],
+    "allowed_service_types": ["Bundled", "Delivery with Standard Offer"],
+    "outpath": "data/filtered/usurdb_filtered.csv",
+    "date_cutoff": datetime.datetime.today(),
+    "capacity_kw": 1000,
+    "latest_only": False,
+    "states": None,
+    "bbox": None,
+}
+
+
+def use_parquet(inpath=RAW_CSV_PATH, parquet_path=RAW_PARQUET_PATH):
+    """Whether the Parquet copy of the raw data exists, is up to date, and can be read"""
+    if parquet_path is None or not os.path.exists(parquet_path):
+        return False
+    if importlib.util.find_spec("pyarrow") is None:
+        return False
+    return not os.path.exists(inpath) or os.path.getmtime(
+        parquet_path
+    ) >= os.path.getmtime(inpath)
+
+
+def print_filter_counts(counts, allowed_service_types, capacity_kw):
+    """Prints the number of tariffs left after each filter in `tariff_mask`
+
+    Parameters
+    ----------
+    counts : list of int
+        Number of tariffs before filtering and after filtering by sector,
+        service type, capacity, date, and (if there is a sixth count) region,
+        in that order.
+    allowed_service_types : list
+        Service types that were kept.
+    capacity_kw : float or list of float
+        Peak demand(s) (kW) that were filtered on.
+    """
+    print(f"Number of tariffs before filtering: {counts[0]}")
+    print(
+        f"Number of tariffs after filtering by sector (Industrial, Commercial): {counts[1]}"
+    )
+    print(
+        f"Number of tariffs after filtering by service type {allowed_service_types}: {counts[2]}"
+    )
+    print(
+        f"Number of tariffs after filtering by capacity ({capacity_kw} kW): {counts[3]}"
+    )
+    print(f"Number of tariffs after filtering by start and end date: {counts[4]}")
+    if len(counts) > 5:
+        print(f"Number of tariffs after filtering by region: {counts[5]}")
+
+
+class CapacityIndex:
+    """Index of the capacity range of each tariff, built once to find the tariffs
+    available at any peak demand.
+
+    The rows are sorted by `peakkwcapacitymin`, so that the tariffs whose minimum
+    is at or below a peak demand are a prefix found by binary search, and only
+    those are checked against `peakkwcapacitymax`. A missing minimum or maximum
+    is treated as unbounded.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Tariffs with the `peakkwcapacitymin` and `peakkwcapacitymax` columns,
+        and optionally `label`, which `labels` requires.
+    """
+
+    def __init__(self, df):
+        minimum = df["peakkwcapacitymin"].to_numpy(dtype=float, na_value=-np.inf)
+        maximum = df["peakkwcapacitymax"].to_numpy(dtype=float, na_value=np.inf)
+        self.order = np.argsort(minimum, kind="stable")
+        self.sorted_min = minimum[self.order]
+        self.sorted_max = maximum[self.order]
+        self.label_values = df["label"].to_numpy() if "label" in df else None
+
+    def _available(self, capacity_kw):
+        n_below = np.searchsorted(self.sorted_min, capacity_kw, side="right")
+        return self.order[:n_below][self.sorted_max[:n_below] >= capacity_kw]
+
+    def rows(self, capacity_kw):
+        """Ascending positions of the tariffs available for `capacity_kw`"""
+        return np.sort(self._available(capacity_kw))
+
+    def mask(self, capacity_kw):
+        """Boolean array of the tariffs available for `capacity_kw`, or for any
+        of the peak demands if it is a list"""
+        mask = np.zeros(len(self.order), dtype=bool)
+        for kw in np.atleast_1d(capacity_kw):
+            mask[self._available(kw)] = True
+        return mask
+
+    def labels(self, capacity_kw):
+        """Labels of the tariffs available for `capacity_kw` (or any of them if it
+        is a list), in the order of the rows
+
+        Raises
+        ------
+        ValueError
+            If the index was built from tariffs without a `label` column.
+        """
+        if self.label_values is None:
+            raise ValueError(
+                "CapacityIndex has no labels, build it from tariffs with a 'label' column"
+            )
+        return self.label_values[self.mask(capacity_kw)]
+
+
+def capacity_mask(df, capacity_kw, index=None):
+    """Which tariffs are available for a peak demand of `capacity_kw` (or any of
+    them if it is a list), treating a missing `peakkwcapacitymin` or
+    `peakkwcapacitymax` as unbounded. `index` is a `CapacityIndex` of `df` to reuse."""
+    if index is None:
+        index = CapacityIndex(df)
+    return pd.Series(index.mask(capacity_kw), index=df.index)
+
+
+def utility_locations(zipcodes, geocode=False):
+    """Finds the location of each utility the way `convert.generate_metadata` does,
+    i.e. from the first row of `zipcodes` with its EIA ID.
+
+    Parameters
+    ----------
+    zipcodes : pandas.DataFrame
+        Merged IOU and non-IOU zipcode tables, with `eiaid`, `zip`, and `state`
+        columns and optionally `latitude` and `longitude`.
+    geocode : bool
+        Whether to look up the latitude and longitude of each utility's zipcode
+        with `convert.get_lat_longs`, if `zipcodes` does not already have them.
+        Default is False.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per EIA ID with its zipcode, state and, if geocoded, latitude and longitude
+    """
+    locations = zipcodes.drop_duplicates("eiaid").set_index("eiaid")
+    if geocode and not {"latitude", "longitude"} <= set(locations.columns):
+        # one batch query instead of one per utility
+        lat_longs = get_lat_longs(locations["zip"], verbose=False)
+        locations["latitude"] = [latitude for latitude, _ in lat_longs]
+        locations["longitude"] = [longitude for _, longitude in lat_longs]
+        locations = locations.astype({"latitude": float, "longitude": float})
+    return locations
+
+
+def region_mask(df, locations, states=None, bbox=None):
+    """Which tariffs are in the given states and/or bounding box
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Raw USURDB data with the `eiaid`, `utility`, and `source` columns.
+    locations : pandas.DataFrame
+        Location of each utility from `utility_locations`.
+    states : list
+        State abbreviations to keep, e.g. ["CA", "NY"]. Tariffs of utilities that
+        are not in `locations` (or have no state) use the first state in
+        `STATE_ABBR` named in their `utility` or `source`, like `convert.py`.
+        Default is None, in which case tariffs are not filtered by state.
+    bbox : tuple of float
+        (south, west, north, east) latitude and longitude bounds to keep.
+        Tariffs whose utility has no coordinates are dropped.
+        Default is None, in which case tariffs are not filtered by location.
+
+    Returns
+    -------
+    pandas.Series
+        Boolean mask aligned with `df`
+    """
+    mask = pd.Series(True, index=df.index)
+    if states is not None:
+        state = df["eiaid"].map(locations["state"]).astype(object)
+        missing = state.isna()
+        if missing.any():
+            state[missing] = named_states(
+                [df.loc[missing, "utility"], df.loc[missing, "source"]]
+            )
+        mask &= state.isin(states)
+    if bbox is not None:
+        south, west, north, east = bbox
+        latitude = df["eiaid"].map(locations["latitude"])
+        longitude = df["eiaid"].map(locations["longitude"])
+        mask &= latitude.between(south, north) & longitude.between(west, east)
+    return mask
+
+
+def active_rows(startdate, enddate, cutoff_dates):
+    """Finds the tariffs in effect on each of several cutoff dates.
+
+    The rows are sorted by start date once, so that the tariffs that started on or
+    before a cutoff date are a prefix found by binary search, and only those are
+    checked against their end date.
+
+    Parameters
+    ----------
+    startdate : pandas.Series
+        Parsed start date of each tariff. A missing start date is treated as
+        having always been in effect.
+    enddate : pandas.Series
+        Parsed end date of each tariff. A missing end date is treated as
+        never expiring.
+    cutoff_dates : list of datetime.datetime
+        Dates to find the tariffs in effect on.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        For each cutoff date, the ascending positions of the rows with
+        `startdate <= cutoff_date` and `enddate >= cutoff_date`
+    """
+    start = startdate.to_numpy(dtype="datetime64[ns]")
+    end = enddate.to_numpy(dtype="datetime64[ns]")
+    # NaT is the smallest int64, so a missing start date already sorts first,
+    # while a missing end date has to be made the largest
+    start = start.view("i8")
+    end = np.where(np.isnat(end), np.iinfo(np.int64).max, end.view("i8"))
+    order = np.argsort(start, kind="stable")
+    sorted_start = start[order]
+    sorted_end = end[order]
+
+    cutoffs = pd.DatetimeIndex(cutoff_dates).to_numpy(dtype="datetime64[ns]")
+    rows = []
+    for cutoff in cutoffs.view("i8"):
+        n_started = np.searchsorted(sorted_start, cutoff, side="right")
+        in_effect = sorted_end[:n_started] >= cutoff
+        rows.append(np.sort(order[:n_started][in_effect]))
+    return rows
+
+
+def latest_versions(df, startdate):
+    """Finds the latest version of each tariff, i.e. the one with the latest
+    start date among the rows with the same `DEDUP_COLUMNS`.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Tariffs to deduplicate, with the columns in `DEDUP_COLUMNS`.
+    startdate : pandas.Series
+        Parsed start date of each tariff in `df`. A missing start date counts as
+        the earliest, and ties are broken by keeping the first row.
+
+    Returns
+    -------
+    pandas.Index
+        Index of the rows of `df` to keep
+    """
+    start = startdate.fillna(pd.Timestamp.min)
+    groups = [df[column] for column in DEDUP_COLUMNS]
+    return pd.Index(start.groupby(groups, dropna=False, sort=False).idxmax())
+
+
+def print_latest_count(count):
+    """Prints the number of tariffs left after `latest_versions`"""
+    print(f"Number of tariffs after keeping only the latest version: {count}")
+
+
+def tariff_mask(
+    df,
+    allowed_sectors,
+    allowed_service_types,
+    date_cutoff,
+    capacity_kw=1000,
+    verbose=True,
+    cache=None,
+    counts=None,
+    states=None,
+    bbox=None,
+    locations=None,
+):
+    """Computes which tariffs pass every filter, printing the count after each one
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Raw USURDB data. Only the columns in `FILTER_COLUMNS` are used.
+    allowed_sectors : list
+        Sectors to keep, e.g. ["Industrial", "Commercial"].
+    allowed_service_types : list
+        Service types to keep, e.g. ["Bundled", "Delivery with Standard Offer"].
+    date_cutoff : datetime.datetime
+        Tariffs must start on or before and end on or after this date.
+    capacity_kw : float or list of float
+        Peak demand (kW) that the tariff must be available for, or a list of peak
+        demands to keep the tariffs available for any of. Default is 1000.
+    verbose : bool
+        Whether to print the number of tariffs left after each filter. Default is True.
+    cache : dict
+        Masks and parsed dates from previous calls on the same `df`, which are reused
+        and added to. Default is None, in which case nothing is shared between calls.
+    counts : list of int
+        Running totals of the number of tariffs left after each filter
+        (see `print_filter_counts`), which are added to in place.
+        Default is None.
+    states : list
+        State abbreviations to keep, see `region_mask`. Default is None.
+    bbox : tuple of float
+        (south, west, north, east) bounds to keep, see `region_mask`. Default is None.
+    locations : pandas.DataFrame
+        Location of each utility from `utility_locations`, which is required
+        if `states` or `bbox` is given. Default is None.
+
+    Returns
+    -------
+    pandas.Series
+        Boolean mask aligned with `df`
+    """
+    if cache is None:
+        cache = {}
+
+    def cached(key, compute):
+        if key not in cache:
+            cache[key] = compute()
+        return cache[key]
+
+    stage_counts = [len(df)]
+
+    # filter by sector
+    mask = cached(
+        ("sector", tuple(allowed_sectors)),
+        lambda: df["sector"].isin(allowed_sectors),
+    ).copy()
+    stage_counts.append(int(mask.sum()))
+
+    # filter by service type
+    mask &= cached(
+        ("servicetype", tuple(allowed_service_types)),
+        lambda: df["servicetype"].isin(allowed_service_types),
+    )
+    stage_counts.append(int(mask.sum()))
+
+    # filter by peakkwcapacitymin and peakkwcapacitymax
+    capacity_index = cached("capacity_index", lambda: CapacityIndex(df))
+    mask &= cached(
+        ("capacity", tuple(np.atleast_1d(capacity_kw))),
+        lambda: capacity_mask(df, capacity_kw, index=capacity_index),
+    )
+    stage_counts.append(int(mask.sum()))
+
+    # filter by startdate and enddate
+    startdate = cached(
+        "startdate", lambda: pd.to_datetime(df["startdate"], errors="coerce")
+    )
+    enddate = cached("enddate", lambda: pd.to_datetime(df["enddate"], errors="coerce"))
+    mask &= cached(
+        ("date", date_cutoff),
+        lambda: ((startdate <= date_cutoff) | startdate.isna())
+        & ((enddate >= date_cutoff) | enddate.isna()),
+    )
+    stage_counts.append(int(mask.sum()))
+
+    # filter by the location of the utility
+    if states is not None or bbox is not None:
+        mask &= cached(
+            (
+                "region",
+                None if states is None else tuple(states),
+                None if bbox is None else tuple(bbox),
+            ),
+            lambda: region_mask(df, locations, states=states, bbox=bbox),
+        )
+        stage_counts.append(int(mask.sum()))
+
+    if counts is not None:
+        for i, count in enumerate(stage_counts):
+            counts[i] += count
+    if verbose:
+        print_filter_counts(stage_counts, allowed_service_types, capacity_kw)
+
+    return mask
+
+
+def stream_filter_variants(variants, inpath, chunksize, mask_for, columns=None):
+    """Filters the raw USURDB CSV `chunksize` rows at a time, so that memory use
+    does not grow with the size of the file.
+
+    The CSV is read twice. The first pass finds the matching rows, counts the
+    tariffs left after each filter, and notes which columns pandas would infer
+    as int in some chunks and float in others. The second pass reads the file
+    with those columns fixed to one dtype and appends the matching rows of each
+    chunk to the outputs, which are then identical to filtering the whole file at once.
+
+    Parameters
+    ----------
+    variants : list of dict
+        Filters and outpath for each output file, with every key filled in.
+    inpath : str
+        Path to the raw USURDB CSV.
+    chunksize : int
+        Number of rows to read at a time.
+    mask_for : function
+        Computes the mask of one variant for a chunk, see `filter_tariff_variants`.
+    columns : list
+        Columns to write. Default is None, in which case all columns are written.
+    """
+    usecols = None
+    if columns is not None:
+        usecols = set(columns) | set(FILTER_COLUMNS)
+    # first pass: find matching rows and the dtypes of each column across chunks
+    kinds = {}
+    indexes = []
+    masks = [[] for _ in variants]
+    selected = [[] for _ in variants]
+    counts = [
+        [0] * (5 if variant["states"] is None and variant["bbox"] is None else 6)
+        for variant in variants
+    ]
+    for chunk in read_typed_csv(inpath, "usurdb", chunksize=chunksize, usecols=usecols):
+        for column, dtype in chunk.dtypes.items():
+            kinds.setdefault(column, set()).add(dtype.kind)
+        indexes.append(chunk.index)
+        cache = {}
+        for i, variant in enumerate(variants):
+            mask = mask_for(chunk, variant, cache=cache, counts=counts[i])
+            masks[i].append(mask.to_numpy())
+            rows = chunk.loc[mask, DEDUP_COLUMNS]
+            rows["startdate"] = cache["startdate"][mask]
+            rows["enddate"] = cache["enddate"][mask]
+            selected[i].append(rows)
+
+    has_times = []
+    for i, variant in enumerate(variants):
+        print_filter_counts(
+            counts[i], variant["allowed_service_types"], variant["capacity_kw"]
+        )
+        rows = pd.concat(selected[i])
+        # versions of a tariff can be in different chunks, so the
+        # deduplication is done on the matching rows of the whole file
+        if variant["latest_only"]:
+            rows = rows.loc[latest_versions(rows, rows["startdate"])]
+            masks[i] = [
+                mask & index.isin(rows.index) for mask, index in zip(masks[i], indexes)
+            ]
+            print_latest_count(len(rows))
+        dates = pd.concat([rows["startdate"], rows["enddate"]]).dropna()
+        has_times.append(bool((dates != dates.dt.normalize()).any()))
+
+    # a column that is int in one chunk and float in another (because of missing
+    # values) is float when the whole file is read, and anything else mixed is object
+    dtype = {
+        column: "float64" if column_kinds == {"i", "f"} else object
+        for column, column_kinds in kinds.items()
+        if len(column_kinds) > 1
+    }
+
+    # second pass: append the matching rows of each chunk to the outputs
+    for j, chunk in enumerate(
+        read_typed_csv(
+            inpath, "usurdb", chunksize=chunksize, dtype=dtype, usecols=usecols
+        )
+    ):
+        for i, variant in enumerate(variants):
+            # pandas only writes the time if any date in the whole column has one
+            date_format = "%Y-%m-%d %H:%M:%S" if has_times[i] else "%Y-%m-%d"
+            filtered = chunk[masks[i][j]].copy()
+            for column in ["startdate", "enddate"]:
+                dates = pd.to_datetime(chunk[column], errors="coerce")[masks[i][j]]
+                filtered[column] = dates.dt.strftime(date_format)
+            if columns is not None:
+                filtered = filtered[columns]
+            filtered.to_csv(
+                variant["outpath"],
+                mode="w" if j == 0 else "a",
+                header=j == 0,
+                index=False,
+            )
+
+
+def filter_tariff_variants(
+    variants,
+    inpath=RAW_CSV_PATH,
+    parquet_path=RAW_PARQUET_PATH,
+    chunksize=None,
+    project=False,
+    zipcodes_path=ZIPCODES_PATH,
+    engine=None,
+):
+    """Filters the raw USURDB data into several files while reading it only once.
+
+    The raw data is parsed once, and masks that are shared between variants
+    (e.g., the same sectors, capacity or cutoff date) are only computed once.
+
+    Parameters
+    ----------
+    variants : list of dict
+        One dictionary per output file with any of the keyword arguments of
+        `filter_tariffs`: allowed_sectors, allowed_service_types, outpath,
+        date_cutoff, capacity_kw, latest_only, states, bbox. Missing keys take
+        the `filter_tariffs` defaults.
+    inpath : str
+        Path to the raw USURDB CSV.
+    parquet_path : str
+        Path to the Parquet copy of `inpath`, which is read instead if it is up to date.
+        Set to None to always read the CSV.
+    chunksize : int
+        If given, the CSV is streamed this many rows at a time instead of being
+        loaded all at once (see `stream_filter_variants`), and `parquet_path` is
+        not used. Default is None.
+    project : bool
+        Whether to write only the columns that `convert.py` reads (see
+        `convert.convert_columns`) instead of every raw column. Default is False.
+    zipcodes_path : str
+        Path to the merged zipcode table that `states` and `bbox` are looked up in.
+    engine : str
+        "pyarrow" to parse the CSV on all cores, see `schema.read_typed_csv`.
+        Default is None, in which case the default pandas engine is used.
+    """
+    variants = [dict(VARIANT_DEFAULTS, **variant) for variant in variants]
+    cache = {}
+    locations = None
+    if any(v["states"] is not None or v["bbox"] is not None for v in variants):
+        locations = utility_locations(
+            read_typed_csv(zipcodes_path, "zipcodes", engine=engine, low_memory=False),
+            geocode=any(v["bbox"] is not None for v in variants),
+        )
+
+    def mask_for(df, variant, cache=cache, counts=None):
+        mask = tariff_mask(
+            df,
+            variant["allowed_sectors"],
+            variant["allowed_service_types"],
+            variant["date_cutoff"],
+            capacity_kw=variant["capacity_kw"],
+            verbose=counts is None,
+            cache=cache,
+            counts=counts,
+            states=variant["states"],
+            bbox=variant["bbox"],
+            locations=locations,
+        )
+        # when streaming, `stream_filter_variants` deduplicates across chunks
+        if variant["latest_only"] and counts is None:
+            latest = latest_versions(df[mask], cache["startdate"][mask])
+            mask &= df.index.isin(latest)
+            print_latest_count(int(mask.sum()))
+        return mask
+
+    parquet = chunksize is None and use_parquet(inpath, parquet_path)
+    columns = None
+    if project:
+        if parquet:
+            import pyarrow.parquet as pq
+
+            columns = convert_columns(pq.read_schema(parquet_path).names)
+        else:
+            columns = convert_columns(pd.read_csv(inpath, nrows=0).columns)
+
+    if chunksize is not None:
+        stream_filter_variants(variants, inpath, chunksize, mask_for, columns=columns)
+    elif parquet:
+        # only the filter columns are needed to find the matching tariffs, and then
+        # only the row groups containing the allowed sectors/service types are read in full
+        predicates = pd.read_parquet(parquet_path, columns=FILTER_COLUMNS)
+        masks = [mask_for(predicates, variant) for variant in variants]
+        sectors = set().union(*(v["allowed_sectors"] for v in variants))
+        service_types = set().union(*(v["allowed_service_types"] for v in variants))
+        df = pd.read_parquet(
+            parquet_path,
+            columns=columns,
+            filters=[
+                ("sector", "in", sorted(sectors)),
+                ("servicetype", "in", sorted(service_types)),
+            ],
+        )
+        # the index holds each tariff's row number in the raw CSV
+        df = df.sort_index()
+        for variant, mask in zip(variants, masks):
+            filtered = df[df.index.isin(mask.index[mask])]
+            # save filtered data to csv
+            filtered.to_csv(variant["outpath"], index=False)
+    else:
+        usecols = None
+        if columns is not None:
+            usecols = set(columns) | set(FILTER_COLUMNS)
+        raw_tariff_list = read_typed_csv(
+            inpath, "usurdb", engine=engine, usecols=usecols
+        )
+        for variant in variants:
+            mask = mask_for(raw_tariff_list, variant)
+            filtered = raw_tariff_list[mask].copy()
+            filtered["startdate"] = cache["startdate"][mask]
+            filtered["enddate"] = cache["enddate"][mask]
+            if columns is not None:
+                filtered = filtered[columns]
+            # save filtered data to csv
+            filtered.to_csv(variant["outpath"], index=False)
+
 
 def filter_tariffs(
     allowed_sectors=["Industrial", "Commercial"],
     allowed_service_types=["Bundled", "Delivery with Standard Offer"],
     outpath="data/filtered/usurdb_filtered.csv",
     date_cutoff=datetime.datetime.today(),
+    inpath=RAW_CSV_PATH,
+    parquet_path=RAW_PARQUET_PATH,
+    capacity_kw=1000,
+    chunksize=None,
+    project=False,
+    latest_only=False,
+    states=None,
+    bbox=None,
+    zipcodes_path=ZIPCODES_PATH,
+    engine=None,
 ):
-    raw_tariff_list = pd.read_csv(
-        "data/raw/usurdb_raw.csv",
+    filter_tariff_variants(
+        [
+            {
+                "allowed_sectors": allowed_sectors,
+                "allowed_service_types": allowed_service_types,
+                "outpath": outpath,
+                "date_cutoff": date_cutoff,
+                "capacity_kw": capacity_kw,
+                "latest_only": latest_only,
+                "states": states,
+                "bbox": bbox,
+            }
+        ],
+        inpath=inpath,
+        parquet_path=parquet_path,
+        chunksize=chunksize,
+        project=project,
+        zipcodes_path=zipcodes_path,
+        engine=engine,
     )
-    num_tariffs = len(raw_tariff_list)
-    print(f"Number of tariffs before filtering: {num_tariffs}")
 
-    # filter by sector
-    df = raw_tariff_list[raw_tariff_list["sector"].isin(allowed_sectors)]
-    num_tariffs = len(df)
-    print(
-        f"Number of tariffs after filtering by sector (Industrial, Commercial): {num_tariffs}"
-    )
 
-    # filter by service type
-    df = df[df["servicetype"].isin(allowed_service_types)]
-    num_tariffs = len(df)
-    print(
-        f"Number of tariffs after filtering by service type {allowed_service_types}: {num_tariffs}"
-    )
+def filter_tariff_panel(
+    cutoff_dates,
+    allowed_sectors=["Industrial", "Commercial"],
+    allowed_service_types=["Bundled", "Delivery with Standard Offer"],
+    capacity_kw=1000,
+    outpath="data/filtered/usurdb_panel.csv",
+    outpath_template=None,
+    inpath=RAW_CSV_PATH,
+    parquet_path=RAW_PARQUET_PATH,
+    project=False,
+    verbose=True,
+    engine=None,
+):
+    """Finds the tariffs in effect on each of many cutoff dates from one read of
+    the raw USURDB data (e.g., every first of the month for backtesting).
 
-    # filter by peakkwcapacitymin
-    df = df[(df["peakkwcapacitymin"] <= 1000) | (df["peakkwcapacitymin"].isna())]
-    df = df[(df["peakkwcapacitymax"] >= 1000) | (df["peakkwcapacitymax"].isna())]
-    num_tariffs = len(df)
-    print(f"Number of tariffs after filtering by capacity (1000 kW): {num_tariffs}")
+    The start and end dates are parsed once, and the tariffs in effect on each
+    date are looked up with `active_rows` instead of filtering the whole table again.
 
-    # filter by startdate and enddate
-    df["startdate"] = pd.to_datetime(df["startdate"], errors="coerce")
-    df["enddate"] = pd.to_datetime(df["enddate"], errors="coerce")
-    df = df[(df["startdate"] <= date_cutoff) | (df["startdate"].isna())]
-    df = df[(df["enddate"] >= date_cutoff) | (df["enddate"].isna())]
-    num_tariffs = len(df)
-    print(f"Number of tariffs after filtering by start and end date: {num_tariffs}")
+    Parameters
+    ----------
+    cutoff_dates : list of datetime.datetime
+        Dates to find the tariffs in effect on, e.g.
+        `pd.date_range("2018-01-01", "2023-01-01", freq="MS")`.
+    allowed_sectors : list
+        Sectors to keep. Default is ["Industrial", "Commercial"].
+    allowed_service_types : list
+        Service types to keep. Default is ["Bundled", "Delivery with Standard Offer"].
+    capacity_kw : float or list of float
+        Peak demand (kW) that the tariff must be available for, or a list of peak
+        demands to keep the tariffs available for any of. Default is 1000.
+    outpath : str
+        Where to save the panel as a CSV with one row per cutoff date and label.
+        Set to None to only return it.
+    outpath_template : str
+        If given, the filtered tariffs for each cutoff date are also saved to
+        `outpath_template.format(date=cutoff_date)`, in the same format as
+        `filter_tariffs`, e.g. "data/filtered/usurdb_{date:%Y-%m-%d}.csv".
+        Default is None.
+    inpath : str
+        Path to the raw USURDB CSV.
+    parquet_path : str
+        Path to the Parquet copy of `inpath`, which is read instead if it is up to date.
+        Set to None to always read the CSV.
+    project : bool
+        Whether the per-date files only have the columns that `convert.py` reads.
+        Default is False.
+    verbose : bool
+        Whether to print the number of tariffs in effect on each date. Default is True.
+    engine : str
+        "pyarrow" to parse the CSV on all cores, see `schema.read_typed_csv`.
+        Default is None, in which case the default pandas engine is used.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The `date_cutoff` and `label` of every tariff in effect on each cutoff date
+    """
+    parquet = use_parquet(inpath, parquet_path)
+    usecols = None
+    if outpath_template is None:
+        usecols = FILTER_COLUMNS + ["label"]
+    elif project:
+        if parquet:
+            import pyarrow.parquet as pq
 
-    # save filtered data to csv
-    df.to_csv(outpath, index=False)
+            names = pq.read_schema(parquet_path).names
+        else:
+            names = pd.read_csv(inpath, nrows=0).columns
+        usecols = list(dict.fromkeys(convert_columns(names) + FILTER_COLUMNS))
+
+    if parquet:
+        # the index holds each tariff's row number in the raw CSV
+        df = pd.read_parquet(parquet_path, columns=usecols).sort_index()
+    else:
+        df = read_typed_csv(inpath, "usurdb", engine=engine, usecols=usecols)
+        df["startdate"] = pd.to_datetime(df["startdate"], errors="coerce")
+        df["enddate"] = pd.to_datetime(df["enddate"], errors="coerce")
+
+    mask = (
+        df["sector"].isin(allowed_sectors)
+        & df["servicetype"].isin(allowed_service_types)
+        & capacity_mask(df, capacity_kw)
+    ).to_numpy()
+    candidates = np.flatnonzero(mask)
+    candidate_rows = active_rows(
+        df["startdate"].iloc[candidates],
+        df["enddate"].iloc[candidates],
+        cutoff_dates,
+    )
+
+    columns = convert_columns(df.columns) if project else df.columns
+    labels = df["label"].to_numpy()
+    panel = []
+    for cutoff_date, rows in zip(cutoff_dates, candidate_rows):
+        rows = candidates[rows]
+        if verbose:
+            print(f"Number of tariffs in effect on {cutoff_date}: {len(rows)}")
+        panel.append(pd.DataFrame({"date_cutoff": cutoff_date, "label": labels[rows]}))
+        if outpath_template is not None:
+            df.iloc[rows][columns].to_csv(
+                outpath_template.format(date=cutoff_date), index=False
+            )
+
+    panel = pd.concat(panel, ignore_index=True)
+    if outpath is not None:
+        panel.to_csv(outpath, index=False)
+    return panel
 
 
 def main():
     iou_filename = os.path.join("data", "raw", "iou_zipcodes_2020.csv")
     non_iou_filename = os.path.join("data", "raw", "non_iou_zipcodes_2020.csv")
-    iou_zips = pd.read_csv(iou_filename)
-    non_iou_zips = pd.read_csv(non_iou_filename)
+    iou_zips = read_typed_csv(iou_filename, "zipcodes")
+    non_iou_zips = read_typed_csv(non_iou_filename, "zipcodes")
     merged_outpath = os.path.join("data", "filtered", "merged_zipcodes.csv")
     pd.concat([iou_zips, non_iou_zips]).to_csv(merged_outpath, index=False)
-    filter_tariffs(
-        allowed_sectors=["Industrial", "Commercial"],
-        allowed_service_types=["Bundled", "Delivery with Standard Offer"],
-        outpath="data/filtered/usurdb_bundled.csv",
-        # date_cutoff=datetime.datetime(2023, 6, 1)
-    )
-    filter_tariffs(
-        allowed_sectors=["Industrial", "Commercial"],
-        allowed_service_types=["Delivery"],
-        outpath="data/filtered/usurdb_delivery_only.csv",
-        # date_cutoff=datetime.datetime(2023, 6, 1)
+    filter_tariff_variants(
+        [
+            {
+                "allowed_sectors": ["Industrial", "Commercial"],
+                "allowed_service_types": ["Bundled", "Delivery with Standard Offer"],
+                "outpath": "data/filtered/usurdb_bundled.csv",
+                # "date_cutoff": datetime.datetime(2023, 6, 1),
+            },
+            {
+                "allowed_sectors": ["Industrial", "Commercial"],
+                "allowed_service_types": ["Delivery"],
+                "outpath": "data/filtered/usurdb_delivery_only.csv",
+                # "date_cutoff": datetime.datetime(2023, 6, 1),
+            },
+        ],
+        # only keep the columns that convert.py needs
+        project=True,
     )
 
 
@@ -0,0 +1,236 @@
+import os
+import zipfile
+import functools
+import numpy as np
+import pandas as pd
+
+# sorted ZIP code centroids built by `build_zip_table`, so geocoding needs no network
+ZIP_TABLE_PATH = os.path.join("data", "raw", "zip_centroids.npy")
+# GeoNames US postal codes fetched by `download.py`, which the table is built from
+POSTAL_CODES_PATH = os.path.join("data", "raw", "US.zip")
+# state of each ZIP code in the table is stored as its position in this list,
+# i.e. the states of `convert.STATE_ABBR` followed by the other USPS codes
+ZIP_TABLE_STATES = [
+    "AK",
+    "AL",
+    "AR",
+    "AZ",
+    "CA",
+    "CO",
+    "CT",
+    "DE",
+    "FL",
+    "GA",
+    "HI",
+    "IA",
+    "ID",
+    "IL",
+    "IN",
+    "KS",
+    "KY",
+    "LA",
+    "MA",
+    "MD",
+    "ME",
+    "MI",
+    "MN",
+    "MO",
+    "MS",
+    "MT",
+    "NC",
+    "ND",
+    "NE",
+    "NH",
+    "NJ",
+    "NM",
+    "NV",
+    "NY",
+    "OH",
+    "OK",
+    "OR",
+    "PA",
+    "RI",
+    "SC",
+    "SD",
+    "TN",
+    "TX",
+    "UT",
+    "VA",
+    "VT",
+    "WA",
+    "WI",
+    "WV",
+    "WY",
+    "AA",
+    "AE",
+    "AP",
+    "AS",
+    "DC",
+    "FM",
+    "GU",
+    "MH",
+    "MP",
+    "PR",
+    "PW",
+    "VI",
+]
+# columns of the GeoNames postal code files, the same as `pgeocode.DATA_FIELDS`
+GEONAMES_FIELDS = [
+    "country_code",
+    "postal_code",
+    "place_name",
+    "state_name",
+    "state_code",
+    "county_name",
+    "county_code",
+    "community_name",
+    "community_code",
+    "latitude",
+    "longitude",
+    "accuracy",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def nominatim():
+    """The US postal code database of pgeocode, loaded once and shared"""
+    import pgeocode as pg
+
+    return pg.Nominatim("us")
+
+
+def normalize_zipcode(zipcode):
+    """Formats a ZIP code as the 5 digit string that GeoNames and pgeocode use
+
+    ZIP codes lose their leading zeros when the EIA tables are read as numbers,
+    so e.g. 601 and "0601" are both "00601".
+
+    Parameters
+    ----------
+    zipcode : str, int or float
+        ZIP code as a string or number, or NaN.
+
+    Returns
+    -------
+    str
+        The 5 digit ZIP code, or None if it is missing or not a number of
+        up to 5 digits
+    """
+    if isinstance(zipcode, str):
+        zipcode = zipcode.strip()
+        if not (zipcode.isdigit() and len(zipcode) <= 5):
+            return None
+        return zipcode.zfill(5)
+    if pd.isna(zipcode) or zipcode != int(zipcode) or not 0 <= zipcode < 100000:
+        return None
+    return str(int(zipcode)).zfill(5)
+
+
+def read_postal_codes(path, country="US"):
+    """Reads a GeoNames postal code file
+
+    Parameters
+    ----------
+    path : str
+        Path to the tab-separated postal codes, e.g. `US.txt`, or to the zip
+        archive of a country, e.g. `US.zip`, which also has a `readme.txt`.
+    country : str
+        Country code of the postal codes to read from a zip archive. Default is "US".
+
+    Returns
+    -------
+    pandas.DataFrame
+        The postal codes with the `GEONAMES_FIELDS` columns
+    """
+    kwargs = {
+        "sep": "\t",
+        "header": None,
+        "names": GEONAMES_FIELDS,
+        "dtype": {"postal_code": str},
+        "keep_default_na": False,
+        "na_values": [""],
+    }
+    if not zipfile.is_zipfile(path):
+        return pd.read_csv(path, **kwargs)
+    # the archive has the postal codes and a readme, like pgeocode expects
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(country.upper() + ".txt") as f:
+            return pd.read_csv(f, **kwargs)
+
+
+def build_zip_table(outpath=ZIP_TABLE_PATH, postal_codes_path=POSTAL_CODES_PATH):
+    """Saves the centroid and state of every US ZIP code as a sorted numeric array.
+
+    The array has one row each for the ZIP code, latitude, longitude, and
+    index of the state in `ZIP_TABLE_STATES` (-1 if unknown), with the ZIP codes
+    in ascending order so that `lookup_zips` can binary search a memory-mapped copy.
+    Like pgeocode, the centroid of a ZIP code with several places is their mean.
+
+    Parameters
+    ----------
+    outpath : str
+        Where to save the table as a `.npy` file.
+    postal_codes_path : str
+        Path to the GeoNames US postal codes (`US.zip` or `US.txt`).
+        Default is `POSTAL_CODES_PATH`, which `download.py` fetches.
+    """
+    postal_codes = read_postal_codes(postal_codes_path)
+    postal_codes = postal_codes.groupby("postal_code", sort=False).agg(
+        latitude=("latitude", "mean"),
+        longitude=("longitude", "mean"),
+        state_code=("state_code", "first"),
+    )
+    zips = pd.to_numeric(postal_codes.index, errors="coerce").to_numpy(float)
+    states = pd.Categorical(
+        postal_codes["state_code"], categories=ZIP_TABLE_STATES
+    ).codes
+    table = np.vstack(
+        [
+            zips,
+            postal_codes["latitude"].to_numpy(float),
+            postal_codes["longitude"].to_numpy(float),
+            states,
+        ]
+    )
+    table = table[:, ~np.isnan(zips)]
+    table = table[:, np.argsort(table[0], kind="stable")]
+    np.save(outpath + ".tmp.npy", np.ascontiguousarray(table))
+    os.replace(outpath + ".tmp.npy", outpath)
+    zip_table.cache_clear()
+    print(f"Saved {table.shape[1]} ZIP code centroids to {outpath}")
+
+
+@functools.lru_cache(maxsize=None)
+def zip_table(path=ZIP_TABLE_PATH):
+    """The table of `build_zip_table`, memory-mapped once and shared"""
+    return np.load(path, mmap_mode="r")
+
+
+def lookup_zips(zipcodes, path=ZIP_TABLE_PATH):
+    """Looks up the centroid and state of ZIP codes in the table of `build_zip_table`
+
+    Parameters
+    ----------
+    zipcodes : list
+        5 digit ZIP codes as strings (see `normalize_zipcode`). Like pgeocode,
+        anything else (e.g. "601" or None) is not found.
+    path : str
+        Path to the table. Default is `ZIP_TABLE_PATH`.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray, numpy.ndarray
+        Latitude and longitude (NaN if not found), and index of the state in
+        `ZIP_TABLE_STATES` (-1 if not found) of each ZIP code
+    """
+    table = zip_table(path)
+    zipcodes = pd.Series(zipcodes, dtype=object)
+    exact = zipcodes.map(lambda zipcode: isinstance(zipcode, str))
+    exact &= zipcodes.astype(str).str.fullmatch(r"\d{5}")
+    zips = pd.to_numeric(zipcodes.where(exact), errors="coerce").to_numpy(float)
+    positions = np.minimum(np.searchsorted(table[0], zips), table.shape[1] - 1)
+    found = table[0, positions] == zips
+    latitude = np.where(found, table[1, positions], np.nan)
+    longitude = np.where(found, table[2, positions], np.nan)
+    states = np.where(found, table[3, positions], -1).astype(int)
+    return latitude, longitude, states
@@ -3,6 +3,11 @@ import glob
 import shutil
 import pandas as pd
 
+try:
+    from scripts.schema import read_typed_csv
+except ImportError:  # run as `python scripts/merge.py`
+    from schema import read_typed_csv
+
 
 def lat_str_to_float(lat_str):
     return float(lat_str[:-1])
@@ -18,7 +23,9 @@ def main(savefolder="data/merged", suffix=""):
         os.mkdir(savefolder)
 
     # copy wttp-energy-tariffs to merged folder
-    metadata_df = pd.read_csv(os.path.join("data", "raw", "metadata.csv"))
+    metadata_df = read_typed_csv(
+        os.path.join("data", "raw", "metadata.csv"), "wwtp_metadata"
+    )
     new_metadata = []
     for cwns_no in metadata_df["CWNS_No"]:
         row = metadata_df[metadata_df["CWNS_No"] == cwns_no].iloc[0]
@@ -43,8 +50,8 @@ def main(savefolder="data/merged", suffix=""):
         shutil.copyfile(tariff_file, os.path.join(savefolder, tariff_id))
 
     # merge metadata
-    old_metadata_df = pd.read_csv(
-        os.path.join("data", "converted", "metadata" + suffix + ".csv")
+    old_metadata_df = read_typed_csv(
+        os.path.join("data", "converted", "metadata" + suffix + ".csv"), "metadata"
     )
     new_metadata_df = pd.DataFrame(new_metadata)
     new_metadata_df = pd.concat([old_metadata_df, new_metadata_df])
@@ -0,0 +1,285 @@
+import re
+import csv
+import importlib.util
+import pandas as pd
+
+# Dtypes of the raw USURDB columns that the pipeline reads or writes.
+# Numeric columns are float64 (not nullable) because they have missing values
+# and `convert.py` checks them with `np.isnan`, except for the EIA ID, which is
+# a nullable integer so that it is written back as e.g. "1" rather than "1.0".
+# Columns with only a handful of distinct values (sectors, units) are categorical.
+USURDB_DTYPES = {
+    "label": "str",
+    "eiaid": "Int64",
+    "name": "str",
+    "startdate": "str",
+    "enddate": "str",
+    "latest_update": "str",
+    "utility": "str",
+    "sector": "category",
+    "description": "str",
+    "servicetype": "category",
+    "source": "str",
+    "sourceparent": "str",
+    "peakkwcapacitymin": "float64",
+    "peakkwcapacitymax": "float64",
+    "peakkwcapacityhistory": "float64",
+    "peakkwhusagemin": "float64",
+    "peakkwhusagemax": "float64",
+    "peakkwhusagehistory": "float64",
+    "voltageminimum": "float64",
+    "voltagemaximum": "float64",
+    "fixedchargefirstmeter": "float64",
+    "fixedchargeeaaddl": "float64",
+    "fixedchargeunits": "category",
+    "mincharge": "float64",
+    "flatdemandunit": "category",
+    "demandrateunit": "category",
+    **{
+        "flatDemandMonth_" + month: "float64"
+        for month in [
+            "jan",
+            "feb",
+            "mar",
+            "apr",
+            "may",
+            "jun",
+            "jul",
+            "aug",
+            "sep",
+            "oct",
+            "nov",
+            "dec",
+        ]
+    },
+    "demandweekdayschedule": "str",
+    "demandweekendschedule": "str",
+    "energyweekdayschedule": "str",
+    "energyweekendschedule": "str",
+}
+
+# e.g., "energyratestructure/period2/tier0rate" or "demandratestructure/period0/tier1unit"
+USURDB_PATTERNS = [
+    (
+        re.compile(
+            r"^(flatdemand|demandrate|energyrate|coincidentrate)structure"
+            r"/period\d+/tier\d+(rate|adj|max|sell)$"
+        ),
+        "float64",
+    ),
+    (
+        re.compile(
+            r"^(flatdemand|demandrate|energyrate|coincidentrate)structure"
+            r"/period\d+/tier\d+unit$"
+        ),
+        "category",
+    ),
+]
+
+# EIA IOU and non-IOU zipcode tables and their merge in data/filtered
+ZIPCODE_DTYPES = {
+    "zip": "Int32",
+    "eiaid": "Int64",
+    "utility_name": "str",
+    "state": "category",
+    "service_type": "category",
+    "ownership": "category",
+    "comm_rate": "float64",
+    "ind_rate": "float64",
+    "res_rate": "float64",
+}
+
+# converted tariff sheets (see `convert.make_dict`), where the months and weekdays
+# are float64 like the hours, so that an empty one fails the start <= end checks
+# of `validate.py` rather than being skipped as a nullable integer's NA
+TARIFF_DTYPES = {
+    "label": "str",
+    "utility": "category",
+    "type": "category",
+    "assessed": "category",
+    "period": "str",
+    "basic_charge_limit (imperial)": "float64",
+    "basic_charge_limit (metric)": "float64",
+    "month_start": "float64",
+    "month_end": "float64",
+    "hour_start": "float64",
+    "hour_end": "float64",
+    "weekday_start": "float64",
+    "weekday_end": "float64",
+    "charge (imperial)": "float64",
+    "charge (metric)": "float64",
+    "units": "category",
+    "Notes": "str",
+}
+
+# metadata of the converted, merged, and validated tariffs, where the EIA ID and
+# ZIP code are read as strings so that merge.py and validate.py write them back
+# as converted (e.g. "02134"), not as floats (e.g. "2134.0") like before
+METADATA_DTYPES = {
+    "label": "str",
+    "eiaid": "str",
+    "name": "str",
+    "utility": "str",
+    "source": "str",
+    "zipcode": "str",
+    "state": "category",
+    "latitude": "float64",
+    "longitude": "float64",
+    "notes": "str",
+}
+
+# metadata of the wastewater treatment plant tariffs
+WWTP_METADATA_DTYPES = {
+    "CWNS_No": "int64",
+    "State": "str",
+    "Electricity Utility": "str",
+    "Latitude": "str",
+    "Longitude": "str",
+}
+
+SCHEMAS = {
+    "usurdb": (USURDB_DTYPES, USURDB_PATTERNS),
+    "zipcodes": (ZIPCODE_DTYPES, []),
+    "tariff": (TARIFF_DTYPES, []),
+    "metadata": (METADATA_DTYPES, []),
+    "wwtp_metadata": (WWTP_METADATA_DTYPES, []),
+}
+
+
+def schema_dtypes(columns, schema):
+    """Looks up the dtype of each column in a schema
+
+    Parameters
+    ----------
+    columns : list
+        Column names, e.g. from the header of the CSV.
+    schema : str
+        Name of the schema in `SCHEMAS`.
+
+    Returns
+    -------
+    dict
+        Dtype of each column that the schema declares, by name or by pattern.
+        Columns that it does not declare are left out so pandas infers them.
+    """
+    dtypes, patterns = SCHEMAS[schema]
+    result = {}
+    for column in columns:
+        if column in dtypes:
+            result[column] = dtypes[column]
+            continue
+        for pattern, dtype in patterns:
+            if pattern.match(column):
+                result[column] = dtype
+                break
+    return result
+
+
+def read_arrow_csv(path, columns, dtype, usecols=None):
+    """Reads a CSV with pyarrow's multithreaded reader into the same DataFrame
+    as `pandas.read_csv` with the default engine.
+
+    pandas' own `engine="pyarrow"` cannot be used because it does not allow
+    newlines inside quoted values, which USURDB descriptions have.
+
+    Parameters
+    ----------
+    path : str
+        Path to the CSV.
+    columns : list
+        Column names in the header of the CSV.
+    dtype : dict
+        Dtype of each declared column, see `schema_dtypes`.
+    usecols : list
+        Columns to read. Default is None, in which case all columns are read.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The CSV, where undeclared columns have the dtypes pyarrow infers
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    # categories are built by pandas afterwards so they are sorted like read_csv's,
+    # and nullable integers are cast from floats, since read_csv reads "1.0" as 1
+    arrow_types = {
+        "float64": pa.float64(),
+        "int64": pa.int64(),
+        "Int64": pa.float64(),
+        "Int32": pa.float64(),
+        "Int8": pa.float64(),
+        "str": pa.string(),
+        "category": pa.string(),
+    }
+    if usecols is not None:
+        columns = [column for column in columns if column in set(usecols)]
+    table = pv.read_csv(
+        path,
+        parse_options=pv.ParseOptions(newlines_in_values=True),
+        convert_options=pv.ConvertOptions(
+            column_types={
+                column: arrow_types[dtype[column]]
+                for column in columns
+                if dtype.get(column) in arrow_types
+            },
+            include_columns=columns,
+            strings_can_be_null=True,
+        ),
+    )
+    df = table.to_pandas()
+    converted = {}
+    for field in table.schema:
+        column = field.name
+        if pa.types.is_null(field.type):
+            # a column that is empty in every row is float64 in pandas
+            converted[column] = df[column].astype("float64")
+        if dtype.get(column) == "category":
+            if df[column].isna().all():
+                # same categories dtype as read_csv for an empty column
+                converted[column] = df[column].astype(object).astype("category")
+            else:
+                converted[column] = df[column].astype("category")
+        elif column in dtype and df[column].dtype != dtype[column]:
+            converted[column] = df[column].astype(dtype[column])
+    return df.assign(**converted)
+
+
+def read_typed_csv(path, schema, engine=None, **kwargs):
+    """Reads a CSV with the dtypes of `schema`, so that pandas only has to infer
+    the dtypes of columns that the schema does not declare.
+
+    Parameters
+    ----------
+    path : str
+        Path to the CSV.
+    schema : str
+        Name of the schema in `SCHEMAS`.
+    engine : str
+        "pyarrow" to parse the CSV on all cores with `read_arrow_csv`. It falls
+        back to the default pandas engine if pyarrow is not installed or `kwargs`
+        has options other than `usecols` (e.g., `chunksize`). Default is None,
+        in which case the default pandas engine is used.
+    **kwargs
+        Passed on to `pandas.read_csv`. Any `dtype` given takes precedence over the schema.
+
+    Returns
+    -------
+    pandas.DataFrame or pandas.io.parsers.TextFileReader
+        What `pandas.read_csv` returns
+    """
+    # only the header is needed to match the column names
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        columns = next(csv.reader(f), [])
+    dtype = schema_dtypes(columns, schema)
+    dtype.update(kwargs.pop("dtype", None) or {})
+    if engine == "pyarrow":
+        # `low_memory` only applies to the default engine
+        options = set(kwargs) - {"usecols", "low_memory"}
+        if importlib.util.find_spec("pyarrow") is None or options:
+            print(f"Reading {path} with the default engine instead of pyarrow")
+        else:
+            return read_arrow_csv(path, columns, dtype, usecols=kwargs.get("usecols"))
+    elif engine is not None:
+        raise ValueError(f"Unknown CSV engine {engine!r}, expected None or 'pyarrow'")
+    return pd.read_csv(path, dtype=dtype, **kwargs)
@@ -2,6 +2,11 @@ import os
 import shutil
 import pandas as pd
 
+try:
+    from scripts.schema import read_typed_csv
+except ImportError:  # run as `python scripts/validate.py`
+    from schema import read_typed_csv
+
 # change to repo parent directory
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -64,7 +69,9 @@ def validate_tariff(tariff_df, tariff_id, max_charges=MAX_CHARGES):
                 try:
                     assert check_continuity(slice, charge_type)
                 except AssertionError:
-                    raise ValueError("Tariff does not cover all hours/days of the year.")
+                    raise ValueError(
+                        "Tariff does not cover all hours/days of the year."
+                    )
 
                 # Check prices are positive and below a threshold
                 try:
@@ -209,7 +216,7 @@ def validate_tariffs(
     metadatapath = (
         os.path.dirname(os.path.dirname(datafolder)) + "/metadata" + suffix + ".csv"
     )
-    metadata_df = pd.read_csv(metadatapath)
+    metadata_df = read_typed_csv(metadatapath, "metadata")
     metadata_df.set_index("label", inplace=True)
 
     if not os.path.exists(savefolder):
@@ -221,8 +228,15 @@ def validate_tariffs(
 
     for tariff_id in metadata_df.index:
         sourcepath = datafolder + tariff_id + ".csv"
-        tariff_df = pd.read_csv(sourcepath)
-        validation_result = validate_tariff(tariff_df, tariff_id)
+        try:
+            tariff_df = read_typed_csv(sourcepath, "tariff")
+        except ValueError as e:
+            # e.g. a non-numeric value in a numeric column rejects only this tariff
+            error_str = f"Error with {tariff_id}: {e}"
+            print(error_str)
+            validation_result = (False, error_str)
+        else:
+            validation_result = validate_tariff(tariff_df, tariff_id)
         # copy valid_tariffs to data/validated folder with suffix
         if validation_result[0]:
             outpath = os.path.join(savefolder, tariff_id + ".csv")
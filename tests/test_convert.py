@@ -1,8 +1,10 @@
 import os
+import ast
 import math
 import pytest
 import subprocess
 from scripts.convert import *
+from scripts.geocode import build_zip_table
 
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 data_folder_path = os.path.join("tests", "data")
@@ -706,6 +708,8 @@ def test_make_dict():
             ],
             [(0, 3), (4, 9), (10, 11)],
         ),
+        ([1.0, 1.0, math.nan, math.nan, 2.0], [(0, 1), (2, 2), (3, 3), (4, 4)]),
+        ([], []),
     ],
 )
 def test_find_consecutive_ranges(lst, expected):
@@ -713,6 +717,127 @@ def test_find_consecutive_ranges(lst, expected):
     assert result == expected
 
 
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "values, expected",
+    [
+        ([0, 0, 1, 1, 1, 0], [[0, 1, 0], [2, 4, 1], [5, 5, 0]]),
+        ([3], [[0, 0, 3]]),
+        ([], []),
+        (
+            [[0, 0, 1], [2, 2, 2]],
+            [[0, 0, 1, 0], [0, 2, 2, 1], [1, 0, 2, 2]],
+        ),
+    ],
+)
+def test_run_lengths(values, expected):
+    result = run_lengths(np.array(values, dtype=np.int8))
+    assert result.tolist() == expected
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_decompose_schedules(tariff_row_path):
+    tariff_row = pd.read_csv(os.path.join(data_folder_path, tariff_row_path))
+    schedules = tariff_row[SCHEDULE_COLUMNS].iloc[0].dropna().tolist()
+    # a schedule with rows of different lengths is decomposed one row at a time
+    scheds = list(parse_schedules(schedules)) + [[[1, 1], [2]]]
+    result = decompose_schedules(scheds)
+    for sched, (month_ranges, hour_ranges) in zip(scheds, result):
+        lists = sched if isinstance(sched, list) else sched.tolist()
+        # same ranges as the loop over lists, as plain ints
+        assert month_ranges == find_consecutive_ranges(lists)
+        assert hour_ranges == [find_consecutive_ranges(hours) for hours in lists]
+        assert all(type(start) is int for start, _ in month_ranges)
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_parse_schedules(tariff_row_path):
+    tariff_row = pd.read_csv(os.path.join(data_folder_path, tariff_row_path))
+    schedules = tariff_row[SCHEDULE_COLUMNS].iloc[0]
+    result = parse_schedules(schedules)
+    for schedule, parsed in zip(schedules, result):
+        if pd.isna(schedule):
+            assert pd.isna(parsed)
+            continue
+        # same values as `ast.literal_eval` in a contiguous int8 array
+        assert parsed.dtype == np.int8 and parsed.shape == (12, 24)
+        assert parsed.flags["C_CONTIGUOUS"]
+        assert parsed.tolist() == ast.literal_eval(schedule)
+        assert parse_schedule(schedule).tolist() == parsed.tolist()
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_schedule_cache(tariff_row_path):
+    tariff_row = pd.read_csv(os.path.join(data_folder_path, tariff_row_path))
+    schedules = tariff_row[SCHEDULE_COLUMNS].iloc[0].dropna().tolist()
+    cache = ScheduleCache()
+    cache.update(schedules + schedules)
+
+    # each distinct schedule is parsed once and then only looked up
+    assert cache.misses == len(set(schedules))
+    for schedule in schedules:
+        sched, month_ranges, hour_ranges = cache.get(schedule)
+        assert cache.get(schedule)[0] is sched
+        assert sched.tolist() == ast.literal_eval(schedule)
+        assert month_ranges == find_consecutive_ranges(ast.literal_eval(schedule))
+        assert hour_ranges == [
+            find_consecutive_ranges(hours) for hours in ast.literal_eval(schedule)
+        ]
+    assert cache.hits == 2 * len(schedules)
+    assert cache.misses == len(set(schedules))
+
+    cache.clear()
+    assert cache.entries == {} and cache.hits == cache.misses == 0
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "schedule, expected",
+    [
+        ("[[1, 2], [3, 4]]", np.array([[1, 2], [3, 4]], dtype=np.int8)),
+        ("[[1, 2], [3]]", [[1, 2], [3]]),
+        ("[[300, 2]]", [[300, 2]]),
+        (math.nan, ValueError),
+        ("[[1, 2]", SyntaxError),
+    ],
+)
+def test_parse_schedule(schedule, expected):
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            parse_schedule(schedule)
+    else:
+        result = parse_schedule(schedule)
+        assert type(result) == type(expected)
+        if isinstance(expected, list):
+            assert result == expected
+        else:
+            assert np.array_equal(result, expected)
+
+
 @pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
 @pytest.mark.parametrize(
     "charge, unit, charge_dict, expected",
@@ -3120,6 +3245,257 @@ def test_create_tariff(tariff_row_path, expected):
     assert result == expected
 
 
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_convert_columns(tariff_row_path):
+    tariff_row = pd.read_csv(os.path.join(data_folder_path, tariff_row_path))
+    columns = convert_columns(tariff_row.columns)
+    assert "sector" not in columns
+    assert "fixedchargefirstmeter" in columns
+    assert "energyratestructure/period0/tier0rate" in columns
+    # the tariff converts the same with only the projected columns
+    assert create_tariff(tariff_row[columns].iloc[0]) == create_tariff(
+        tariff_row.iloc[0]
+    )
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_rate_tensors(tariff_row_path):
+    tariff_row = pd.read_csv(os.path.join(data_folder_path, tariff_row_path))
+    rates = RateTensors(tariff_row)
+    row = rates.row(tariff_row.drop(columns=list(rates.columns)).iloc[0], 0)
+
+    # check that only the tiers with a value are kept
+    entries = sum(len(values) for values in rates.values.values())
+    assert 0 < entries < len(rates.columns) / len(TIER_FIELDS)
+    for structure, offsets in rates.offsets.items():
+        assert list(offsets) == [0, len(rates.entries[structure])]
+
+    # the tiers convert the same and have the same values by name or by index
+    assert create_tariff(row) == create_tariff(tariff_row.iloc[0])
+    for column in rates.columns:
+        expected = tariff_row[column].iloc[0]
+        assert row[column] == expected or (np.isnan(row[column]) and np.isnan(expected))
+        structure, period, tier, field = TIER_COLUMN_PATTERN.match(column).groups()
+        result = tier_rates(row, structure, int(period), int(tier))
+        assert result[TIER_FIELDS.index(field)] == expected or (
+            np.isnan(result[TIER_FIELDS.index(field)]) and np.isnan(expected)
+        )
+        assert tier_rates(tariff_row.iloc[0], structure, int(period), int(tier))[
+            TIER_FIELDS.index(field)
+        ] == expected or np.isnan(expected)
+    with pytest.raises(KeyError):
+        tier_rates(row, "energyratestructure", 99, 0)
+    with pytest.raises(KeyError):
+        tier_rates(row, "energyratestructure", -1, 0)
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_tariff_columns(tariff_row_path):
+    tariff_row = pd.read_csv(os.path.join(data_folder_path, tariff_row_path))
+    rows = TariffColumns(tariff_row)
+    assert len(rows) == 1
+
+    # each value is the same as in the pandas row, and the tariff converts the same
+    row = rows.row(0)
+    for column in tariff_row.columns:
+        expected = tariff_row.iloc[0][column]
+        assert row[column] == expected or (pd.isna(row[column]) and pd.isna(expected))
+    assert create_tariff(row) == create_tariff(tariff_row.iloc[0])
+    rates = RateTensors(tariff_row)
+    rows = TariffColumns(tariff_row.drop(columns=list(rates.columns)))
+    assert create_tariff(rates.row(rows.row(0), 0)) == create_tariff(tariff_row.iloc[0])
+    with pytest.raises(KeyError):
+        row["not a column"]
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_charge_builder(tariff_row_path, tmp_path):
+    tariff_row = pd.read_csv(os.path.join(data_folder_path, tariff_row_path))
+    expected = create_tariff(tariff_row.iloc[0])
+    pd.DataFrame(expected).to_csv(tmp_path / "expected.csv", index=False)
+
+    # buffers that have to grow give the same tariff sheet as the dictionaries
+    charges = ChargeBuilder(capacity=1)
+    assert create_tariff(tariff_row.iloc[0], charges) is charges
+    assert len(charges) == len(expected)
+    label = tariff_row["label"].iloc[0]
+    assert charges.tariffs() == [(label, 0, len(expected))]
+    charges.save(str(tmp_path) + os.sep)
+    result = read_typed_csv(str(tmp_path / f"{label}.csv"), "tariff")
+    assert (tmp_path / f"{label}.csv").read_text() == (
+        tmp_path / "expected.csv"
+    ).read_text()
+    pd.testing.assert_frame_equal(charges.to_frame(), result)
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "notes",
+    [
+        (""),
+        ("source, with a comma"),
+        ('a "quoted"\nsource\n'),
+    ],
+)
+def test_charge_builder_tariffs(notes, tmp_path):
+    charges = ChargeBuilder(capacity=2)
+    expected = {label: ChargeList() for label in ["a", "b", "c", "d"]}
+    for sink in [charges, expected["a"]]:
+        sink.add("a", "customer", 10.0, "$/month", notes=notes)
+    # an integer charge is written as a float if the sheet has other floats
+    for sink in [charges, expected["b"]]:
+        sink.add("b", "customer", 0, "$/month", notes=notes)
+        sink.add("b", "energy", 0.1, "$/kWh", period="period0", month_start="1")
+        sink.add("b", "energy", 0.2, "$/kWh", period="period1", month_start="2")
+        sink.truncate(len(sink) - 1)
+    for sink in [charges, expected["c"]]:
+        sink.add("c", "customer", 1, "$/month", notes=notes)
+    # and as an integer if the sheet has missing charges
+    for sink in [charges, expected["d"]]:
+        sink.add("d", "customer", 0, "$/month", charge_limit=0, notes=notes)
+        sink.add("d", "demand", "", "$/kW", charge_limit=1.5)
+    assert charges.tariffs() == [("a", 0, 1), ("b", 1, 3), ("c", 3, 4), ("d", 4, 6)]
+
+    df = charges.to_frame(1, 3)
+    assert df["label"].tolist() == ["b", "b"]
+    assert df["charge (metric)"].tolist() == [0.0, 0.1]
+    assert df["month_start"].isna().tolist() == [True, False]
+    assert df["Notes"].isna().tolist() == [notes == "", True]
+
+    # each tariff is saved on its own, even if a note takes up more than one line
+    charges.save(str(tmp_path) + os.sep)
+    for label, start, stop in charges.tariffs():
+        path = tmp_path / f"{label}.csv"
+        assert path.read_text() == pd.DataFrame(expected[label]).to_csv(
+            index=False, lineterminator="\n"
+        )
+        result = read_typed_csv(str(path), "tariff")
+        pd.testing.assert_frame_equal(result, charges.to_frame(start, stop))
+        assert result["Notes"].iloc[0] == notes or (
+            notes == "" and pd.isna(result["Notes"].iloc[0])
+        )
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "eiaid, expected_zip, expected_state, expected_zips",
+    [
+        (14328, 95242, "CA", [95242, 95240, 95241]),
+        (1, 1001, "MA", [1001]),
+        (7, np.nan, np.nan, []),
+    ],
+)
+def test_zipcode_index(eiaid, expected_zip, expected_state, expected_zips):
+    zipcodes = pd.DataFrame(
+        {
+            "zip": pd.array([95242, 1001, 95240, 12345, 95241], dtype="Int32"),
+            "eiaid": pd.array([14328, 1, 14328, pd.NA, 14328], dtype="Int64"),
+            "state": ["CA", "MA", "CA", "NY", "CA"],
+        }
+    )
+    index = ZipcodeIndex(zipcodes)
+    zips, states = index.first([eiaid])
+    assert zips[0] == expected_zip or (np.isnan(zips[0]) and np.isnan(expected_zip))
+    assert states[0] == expected_state or (
+        pd.isna(states[0]) and pd.isna(expected_state)
+    )
+    assert list(index.all_zips(eiaid)) == expected_zips
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_paths",
+    [
+        (
+            [
+                "row_539f6a0aec4f024411ec8af3.csv",
+                "row_539f6b35ec4f024411ec9a0f.csv",
+                "row_539f6ba0ec4f024411ec9f97.csv",
+            ]
+        ),
+    ],
+)
+def test_generate_metadata_table(tariff_row_paths, tmp_path):
+    # a zipcode without a utility, and utilities with several zipcodes
+    pd.DataFrame(
+        {
+            "zip": [92501, 95242, 95240, 19530, 3901, 601],
+            "eiaid": [None, 11124, 11124, 10494, 17609, 2],
+            "utility_name": [None, "Lodi", "Lodi", "Kutztown", "Unitil", "PREPA"],
+            "state": ["CA", "CA", "CA", "PA", "NH", "PR"],
+        }
+    ).to_csv(tmp_path / "merged_zipcodes.csv", index=False)
+    zipcodes = pd.read_csv(tmp_path / "merged_zipcodes.csv")
+    openei_df = pd.concat(
+        [
+            pd.read_csv(os.path.join(data_folder_path, path))
+            for path in tariff_row_paths
+        ],
+        ignore_index=True,
+    )
+    # utilities with zipcodes below 10000, and one named only in its source
+    extra = openei_df.iloc[[0, 0, 0]].copy()
+    extra["label"] = ["unitil", "prepa", "unknown"]
+    extra["eiaid"] = [17609, 2, 1]
+    extra["utility"] = ["Unitil Energy Systems", "PREPA", "Unknown Utility"]
+    extra["source"] = ["", "", "Oregon Public Utility Commission"]
+    openei_df = pd.concat([openei_df, extra], ignore_index=True)
+    result = generate_metadata_table(openei_df, ZipcodeIndex(zipcodes))
+
+    # the first zipcode of a utility in the table is used, with leading zeros if
+    # it has fewer than 5 digits, and otherwise the state is found in the utility
+    # or source
+    expected = [
+        ("539f6a0aec4f024411ec8af3", "11124", 95242, "CA"),
+        ("539f6b35ec4f024411ec9a0f", "10494", 19530, "PA"),
+        ("539f6ba0ec4f024411ec9f97", "16088", np.nan, "CA"),
+        ("unitil", "17609", "03901", "NH"),
+        ("prepa", "2", "00601", "PR"),
+        ("unknown", "1", np.nan, "OR"),
+    ]
+    assert len(result) == len(expected)
+    for i, (label, eiaid, zipcode, state) in enumerate(expected):
+        row = result.iloc[i]
+        assert (row["label"], row["eiaid"], row["state"]) == (label, eiaid, state)
+        assert row["zipcode"] == zipcode or (
+            pd.isna(row["zipcode"]) and pd.isna(zipcode)
+        )
+    assert result["name"].tolist() == openei_df["name"].tolist()
+    assert result["notes"].isna().tolist() == openei_df["description"].isna().tolist()
+
+
 @pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
 @pytest.mark.parametrize(
     "zipcode, expected",
@@ -3130,15 +3506,92 @@ def test_create_tariff(tariff_row_path, expected):
     ],
 )
 def test_get_lat_long(zipcode, expected):
+    # build the ZIP code table the first time, like `download.py` does
+    if not os.path.exists(ZIP_TABLE_PATH):
+        build_zip_table()
     result = get_lat_long(zipcode)
     assert result == expected
 
 
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "zipcodes, expected",
+    [
+        (
+            ["94103", 3901, math.nan, "94103"],
+            [
+                (37.7725, -122.4147),
+                (43.2899, -70.855),
+                (None, None),
+                (37.7725, -122.4147),
+            ],
+        ),
+    ],
+)
+def test_get_lat_longs(zipcodes, expected):
+    if not os.path.exists(ZIP_TABLE_PATH):
+        build_zip_table()
+    result = get_lat_longs(zipcodes)
+    assert result == expected
+    # each zipcode is only geocoded once
+    assert {"94103", "03901"} <= set(LAT_LONG_CACHE)
+    assert get_lat_long(zipcodes[0]) == expected[0]
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_get_lat_longs_normalized():
+    if not os.path.exists(ZIP_TABLE_PATH):
+        build_zip_table()
+    # the ZIP code table and pgeocode are given the same 5 digit zipcodes
+    result = get_lat_longs(["00601", "0601", 601, 601.0])
+    assert result[0] != (None, None)
+    assert result == [result[0]] * 4
+    assert get_lat_longs(["00601"], allow_pgeocode=True) == [result[0]]
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_paths",
+    [
+        (["row_539f6a0aec4f024411ec8af3.csv"]),
+        (
+            [
+                "row_539f6a0aec4f024411ec8af3.csv",
+                "row_539f6b35ec4f024411ec9a0f.csv",
+                "row_539f6ba0ec4f024411ec9f97.csv",
+            ]
+        ),
+    ],
+)
+def test_convert_tariffs(tariff_row_paths, tmp_path):
+    openei_df = pd.concat(
+        [
+            read_typed_csv(os.path.join(data_folder_path, path), "usurdb")
+            for path in tariff_row_paths
+        ],
+        ignore_index=True,
+    )
+    misses, hits = convert_tariffs(openei_df, str(tmp_path) + os.sep)
+    assert misses >= 0 and hits >= 0
+
+    # each row is saved as its own tariff sheet, the same as create_tariff's
+    assert len(os.listdir(tmp_path)) == len(openei_df)
+    for i in range(len(openei_df)):
+        label = openei_df["label"].iloc[i]
+        expected = pd.DataFrame(create_tariff(openei_df.iloc[i]))
+        expected.to_csv(tmp_path / "expected.txt", index=False)
+        assert (tmp_path / f"{label}.csv").read_text() == (
+            tmp_path / "expected.txt"
+        ).read_text()
+
+
 @pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
 @pytest.mark.parametrize("suffix", [("_bundled"), ("_delivery_only")])
 def test_main(suffix):
     # ensure that previous steps have been run so that `main` can be tested
-    if not os.path.exists("data/raw/usurdb_raw.csv"):
+    if not os.path.exists("data/raw/usurdb_raw.csv") or not os.path.exists(
+        ZIP_TABLE_PATH
+    ):
         command = ["python", "scripts/download.py"]
         subprocess.run(command, check=True)
     if not os.path.exists("data/filtered/bundled"):
@@ -3156,3 +3609,34 @@ def test_main(suffix):
     assert "longitude" in metadata_df.columns
     assert "latitude" in metadata_df.columns
     assert "longitude" in metadata_df.columns
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("suffix, workers", [("_bundled", 2), ("_delivery_only", 3)])
+def test_main_workers(suffix, workers, tmp_path):
+    if not os.path.exists("data/raw/usurdb_raw.csv") or not os.path.exists(
+        ZIP_TABLE_PATH
+    ):
+        command = ["python", "scripts/download.py"]
+        subprocess.run(command, check=True)
+    if not os.path.exists("data/filtered/bundled"):
+        command = ["python", "scripts/filter.py"]
+        subprocess.run(command, check=True)
+    metadata_path = os.path.join("data", "converted", "metadata" + suffix + ".csv")
+
+    # convert the same tariffs in one process and in several
+    outputs = {}
+    for mode, mode_workers in [("serial", 1), ("parallel", workers)]:
+        savefolder = tmp_path / mode
+        main(savefolder=str(savefolder) + os.sep, suffix=suffix, workers=mode_workers)
+        outputs[mode] = {
+            path.name: path.read_bytes() for path in sorted(savefolder.iterdir())
+        }
+        with open(metadata_path, "rb") as f:
+            outputs[mode][metadata_path] = f.read()
+
+    # check that every tariff sheet and the metadata are byte-identical
+    assert len(outputs["serial"]) > 1
+    assert list(outputs["parallel"]) == list(outputs["serial"])
+    for name, data in outputs["serial"].items():
+        assert outputs["parallel"][name] == data, name
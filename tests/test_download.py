@@ -1,13 +1,108 @@
 import os
+import gzip
 import pytest
+import zipfile
+import threading
+import functools
 import subprocess
-from scripts.download import main
+from urllib.error import HTTPError
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+    SimpleHTTPRequestHandler,
+)
+from urllib.request import urlopen
+from scripts.download import (
+    main,
+    fetch_source,
+    stream_response,
+    fetch_with_retries,
+    load_manifest,
+)
+from scripts.geocode import lookup_zips
 
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 data_folder_path = os.path.join("data", "raw")
 skip_all_tests = False
 
 
+class FlakyHandler(SimpleHTTPRequestHandler):
+    # number of requests to answer with 503 before serving files normally
+    failures = 0
+
+    def do_GET(self):
+        if FlakyHandler.failures > 0:
+            FlakyHandler.failures -= 1
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # serves `payload` with Range support, dropping the first `drop_after` responses
+    # after `drop_after` bytes to simulate a flaky connection
+    payload = b""
+    etag = '"v1"'
+    drop_after = None
+    requests = []
+
+    def do_GET(self):
+        RangeHandler.requests.append(dict(self.headers))
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", self.etag) == self.etag:
+            start = int(range_header.removeprefix("bytes=").rstrip("-"))
+        body = self.payload[start:]
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        if start:
+            self.send_header(
+                "Content-Range",
+                f"bytes {start}-{len(self.payload) - 1}/{len(self.payload)}",
+            )
+        self.end_headers()
+        if RangeHandler.drop_after is not None:
+            self.wfile.write(body[: RangeHandler.drop_after])
+            RangeHandler.drop_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def range_server():
+    RangeHandler.requests = []
+    RangeHandler.drop_after = None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    # serve `tmp_path / "upstream"` over HTTP as a stand-in for the real sources
+    upstream = tmp_path / "upstream"
+    upstream.mkdir()
+    FlakyHandler.failures = 0
+    handler = functools.partial(FlakyHandler, directory=str(upstream))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield upstream, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
 def test_download():
     # check that the script runs without error
@@ -27,3 +122,235 @@ def test_download():
 
     # check that the file was unzipped properly
     assert os.path.exists(os.path.join(data_folder_path, "usurdb_raw.csv"))
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("num_members", [1, 3])
+@pytest.mark.parametrize("chunk_size", [7, 1 << 20])
+def test_stream_response(tmp_path, num_members, chunk_size):
+    content = b"label,eiaid,name\n" + b"abc,123,Rate A\n" * 1000
+    compressed = b"".join(gzip.compress(content) for _ in range(num_members))
+    source = tmp_path / "source.csv.gz"
+    source.write_bytes(compressed)
+    outpath = tmp_path / "out.csv"
+    gz_path = tmp_path / "out.csv.gz"
+
+    with urlopen(source.as_uri()) as response:
+        result = stream_response(
+            response,
+            outpath=str(gz_path),
+            decompress_path=str(outpath),
+            chunk_size=chunk_size,
+        )
+
+    # check that the data was decompressed and the archive was kept as-is
+    assert outpath.read_bytes() == content * num_members
+    assert gz_path.read_bytes() == compressed
+    assert result[:2] == (len(compressed), len(content) * num_members)
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_fetch_source_truncated(tmp_path):
+    compressed = gzip.compress(b"label,eiaid,name\n" * 1000)
+    upstream = tmp_path / "usurdb.csv.gz"
+    upstream.write_bytes(compressed[: len(compressed) // 2])
+    source = {"url": upstream.as_uri(), "decompress_to": "usurdb_raw.csv"}
+    cache_dir = tmp_path / "raw"
+    cache_dir.mkdir()
+
+    # a gzip stream that ends early is not promoted over the cached files
+    with pytest.raises(EOFError):
+        fetch_source("usurdb_raw.csv.gz", source, str(cache_dir))
+    assert not (cache_dir / "usurdb_raw.csv.gz").exists()
+    assert not (cache_dir / "usurdb_raw.csv").exists()
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_main_cache(tmp_path):
+    upstream = tmp_path / "upstream"
+    upstream.mkdir()
+    (upstream / "usurdb.csv.gz").write_bytes(gzip.compress(b"label,eiaid\nabc,123\n"))
+    (upstream / "zipcodes.csv").write_bytes(b"zip,eiaid\n94103,123\n")
+    sources = {
+        "usurdb_raw.csv.gz": {
+            "url": (upstream / "usurdb.csv.gz").as_uri(),
+            "decompress_to": "usurdb_raw.csv",
+        },
+        "zipcodes.csv": {"url": (upstream / "zipcodes.csv").as_uri()},
+    }
+    cache_dir = tmp_path / "raw"
+    cache_dir.mkdir()
+
+    # first run downloads everything
+    manifest = main(cache_dir=str(cache_dir), sources=sources)
+    assert all(entry["changed"] for entry in manifest.values())
+    assert (cache_dir / "usurdb_raw.csv").read_bytes() == b"label,eiaid\nabc,123\n"
+    assert load_manifest(str(cache_dir)) == manifest
+
+    # second run finds identical content and leaves the files alone
+    mtime = os.path.getmtime(cache_dir / "usurdb_raw.csv")
+    manifest = main(cache_dir=str(cache_dir), sources=sources)
+    assert not any(entry["changed"] for entry in manifest.values())
+    assert os.path.getmtime(cache_dir / "usurdb_raw.csv") == mtime
+
+    # only the file that changed upstream is replaced
+    (upstream / "zipcodes.csv").write_bytes(b"zip,eiaid\n03901,456\n")
+    manifest = main(cache_dir=str(cache_dir), sources=sources)
+    assert manifest["zipcodes.csv"]["changed"]
+    assert not manifest["usurdb_raw.csv.gz"]["changed"]
+    assert (cache_dir / "zipcodes.csv").read_bytes() == b"zip,eiaid\n03901,456\n"
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_fetch_source_not_modified(tmp_path, http_server):
+    upstream, base_url = http_server
+    (upstream / "metadata.csv").write_bytes(b"CWNS_No,State\n1,CA\n")
+    source = {"url": base_url + "/metadata.csv"}
+    cache_dir = tmp_path / "raw"
+    cache_dir.mkdir()
+
+    entry = fetch_source("metadata.csv", source, str(cache_dir))
+    assert entry["changed"]
+    assert entry["last_modified"] is not None
+    assert entry["size"] == len(b"CWNS_No,State\n1,CA\n")
+
+    # the server answers the conditional request with 304 Not Modified
+    new_entry = fetch_source("metadata.csv", source, str(cache_dir), entry=entry)
+    assert not new_entry["changed"]
+    assert new_entry["sha256"] == entry["sha256"]
+    assert not (cache_dir / "metadata.csv.part").exists()
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("failures, retries, succeeds", [(2, 3, True), (2, 1, False)])
+def test_fetch_with_retries(tmp_path, http_server, failures, retries, succeeds):
+    upstream, base_url = http_server
+    (upstream / "metadata.csv").write_bytes(b"CWNS_No,State\n1,CA\n")
+    source = {"url": base_url + "/metadata.csv"}
+    FlakyHandler.failures = failures
+
+    if succeeds:
+        entry = fetch_with_retries(
+            "metadata.csv", source, str(tmp_path), retries=retries, backoff=0
+        )
+        assert entry["changed"]
+        assert (tmp_path / "metadata.csv").read_bytes() == b"CWNS_No,State\n1,CA\n"
+    else:
+        with pytest.raises(HTTPError):
+            fetch_with_retries(
+                "metadata.csv", source, str(tmp_path), retries=retries, backoff=0
+            )
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_main_parallel(tmp_path, http_server):
+    upstream, base_url = http_server
+    sources = {}
+    for i in range(5):
+        (upstream / f"file{i}.csv").write_bytes(f"col\n{i}\n".encode())
+        sources[f"file{i}.csv"] = {"url": f"{base_url}/file{i}.csv"}
+    sources["missing.csv"] = {"url": f"{base_url}/missing.csv"}
+    cache_dir = tmp_path / "raw"
+    cache_dir.mkdir()
+
+    # a missing file fails the run, but the other downloads still complete
+    with pytest.raises(RuntimeError, match="missing.csv"):
+        main(cache_dir=str(cache_dir), sources=sources, workers=3, backoff=0)
+    manifest = load_manifest(str(cache_dir))
+    assert sorted(manifest) == [f"file{i}.csv" for i in range(5)]
+    for i in range(5):
+        assert (cache_dir / f"file{i}.csv").read_bytes() == f"col\n{i}\n".encode()
+
+    # a file that fails on the next run keeps its cached copy, which has not changed
+    (upstream / "file0.csv").unlink()
+    with pytest.raises(RuntimeError, match="file0.csv"):
+        main(cache_dir=str(cache_dir), sources=sources, workers=3, backoff=0)
+    manifest = load_manifest(str(cache_dir))
+    assert not manifest["file0.csv"]["changed"]
+    assert (cache_dir / "file0.csv").read_bytes() == b"col\n0\n"
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_main_zip_table(tmp_path, http_server):
+    upstream, base_url = http_server
+    # GeoNames' archive has the postal codes and a readme
+    with zipfile.ZipFile(upstream / "US.zip", "w") as archive:
+        archive.writestr(
+            "US.txt",
+            "US\t94103\tSan Francisco\tCalifornia\tCA\tSan Francisco\t075\t\t\t37.7725\t-122.4147\t4\n",
+        )
+        archive.writestr("readme.txt", "GeoNames postal codes\n")
+    sources = {
+        "US.zip": {"url": f"{base_url}/US.zip", "zip_table": "zip_centroids.npy"}
+    }
+    cache_dir = tmp_path / "raw"
+    cache_dir.mkdir()
+
+    # the ZIP code table is built from the downloaded archive
+    main(cache_dir=str(cache_dir), sources=sources)
+    latitude, longitude, _ = lookup_zips(
+        ["94103"], path=str(cache_dir / "zip_centroids.npy")
+    )
+    assert (latitude[0], longitude[0]) == (37.7725, -122.4147)
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("etag_changes", [False, True])
+def test_fetch_source_resume(tmp_path, range_server, etag_changes):
+    content = b"label,eiaid,name\n" + b"".join(
+        f"{i:024x},{i},Rate {i}\n".encode() for i in range(5000)
+    )
+    compressed = gzip.compress(content)
+    RangeHandler.payload = compressed
+    RangeHandler.etag = '"v1"'
+    RangeHandler.drop_after = len(compressed) // 3
+    source = {
+        "url": range_server + "/usurdb.csv.gz",
+        "decompress_to": "usurdb_raw.csv",
+    }
+
+    # the first attempt is cut off and leaves a partial file behind
+    with pytest.raises(EOFError):
+        fetch_source("usurdb_raw.csv.gz", source, str(tmp_path))
+    assert (tmp_path / "usurdb_raw.csv.gz.part").stat().st_size == len(compressed) // 3
+    assert not (tmp_path / "usurdb_raw.csv.gz").exists()
+
+    # the second attempt only asks for the missing bytes
+    if etag_changes:
+        RangeHandler.etag = '"v2"'
+    entry = fetch_source("usurdb_raw.csv.gz", source, str(tmp_path))
+    assert RangeHandler.requests[-1]["Range"] == f"bytes={len(compressed) // 3}-"
+    assert entry["size"] == len(compressed)
+    assert (tmp_path / "usurdb_raw.csv.gz").read_bytes() == compressed
+    assert (tmp_path / "usurdb_raw.csv").read_bytes() == content
+    assert not (tmp_path / "usurdb_raw.csv.gz.part").exists()
+    assert not (tmp_path / "usurdb_raw.csv.gz.part.json").exists()
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_fetch_with_retries_resume(tmp_path, range_server):
+    payload = bytes(range(256)) * 400
+    RangeHandler.payload = payload
+    RangeHandler.etag = '"v1"'
+    RangeHandler.drop_after = 1000
+    source = {"url": range_server + "/WWTP_Billing.xlsx"}
+
+    entry = fetch_with_retries(
+        "WWTP_Billing.xlsx", source, str(tmp_path), retries=1, backoff=0
+    )
+    assert len(RangeHandler.requests) == 2
+    assert RangeHandler.requests[-1]["Range"] == "bytes=1000-"
+    assert entry["size"] == len(payload)
+    assert (tmp_path / "WWTP_Billing.xlsx").read_bytes() == payload
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_fetch_source_hash_mismatch(tmp_path, range_server):
+    RangeHandler.payload = b"CWNS_No,State\n1,CA\n"
+    RangeHandler.etag = '"v1"'
+    source = {"url": range_server + "/metadata.csv", "sha256": "0" * 64}
+
+    with pytest.raises(OSError, match="SHA-256"):
+        fetch_source("metadata.csv", source, str(tmp_path))
+    assert not (tmp_path / "metadata.csv").exists()
+    assert not (tmp_path / "metadata.csv.part").exists()
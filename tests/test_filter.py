@@ -4,10 +4,16 @@ import datetime
 import subprocess
 import pandas as pd
 from scripts.filter import *
+from scripts.download import cache_parquet
 
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 data_folder_path = os.path.join("data", "filtered")
 skip_all_tests = False
+test_rows = [
+    "row_539f6a0aec4f024411ec8af3.csv",
+    "row_539f6b35ec4f024411ec9a0f.csv",
+    "row_539f6ba0ec4f024411ec9f97.csv",
+]
 
 # ensure that data/raw/usurdb_raw.csv exists
 if not os.path.exists("data/raw/usurdb_raw.csv"):
@@ -15,6 +21,28 @@ if not os.path.exists("data/raw/usurdb_raw.csv"):
     subprocess.run(command, check=True)
 
 
+def write_raw_csv(path):
+    # build a small raw table from the test rows with a mix of sectors,
+    # service types, dates and capacities
+    rows = pd.concat(
+        [pd.read_csv(os.path.join("tests", "data", row)) for row in test_rows],
+        ignore_index=True,
+    )
+    raw = rows.iloc[[i % 3 for i in range(12)]].reset_index(drop=True)
+    raw["label"] = [f"label{i:02d}" for i in range(12)]
+    raw["sector"] = ["Industrial", "Commercial", "Residential"] * 4
+    raw["servicetype"] = ["Bundled", "Delivery", "Delivery with Standard Offer"] * 3 + [
+        "Bundled",
+        "Bundled",
+        "Delivery",
+    ]
+    raw["startdate"] = ["2020-01-01 00:00:00", None, "2024-01-01 00:00:00"] * 4
+    raw["enddate"] = [None] * 6 + ["2022-01-01 00:00:00", "2030-01-01 00:00:00"] * 3
+    raw["peakkwcapacitymin"] = [None, 0, 500, 2000] * 3
+    raw["peakkwcapacitymax"] = [None, 1500, None, 5000, 800, None] * 2
+    raw.to_csv(path, index=False)
+
+
 @pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
 @pytest.mark.parametrize(
     "allowed_sectors, allowed_service_types, outpath, date_cutoff",
@@ -71,3 +99,365 @@ def test_main():
 
     # check that `merged_zipcodes.csv` is created
     assert os.path.exists(os.path.join(data_folder_path, "merged_zipcodes.csv"))
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "allowed_sectors, allowed_service_types, date_cutoff",
+    [
+        (["Industrial", "Commercial"], ["Bundled"], datetime.datetime(2023, 1, 1)),
+        (["Industrial", "Commercial"], ["Delivery"], datetime.datetime(2025, 1, 1)),
+        (["Residential"], ["Bundled", "Delivery"], datetime.datetime(2019, 1, 1)),
+    ],
+)
+def test_filter_tariffs_parquet(
+    tmp_path, allowed_sectors, allowed_service_types, date_cutoff
+):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    parquet_path = str(tmp_path / "usurdb_raw.parquet")
+    write_raw_csv(inpath)
+    cache_parquet(inpath, parquet_path, row_group_size=2)
+    assert use_parquet(inpath, parquet_path)
+
+    csv_outpath = tmp_path / "from_csv.csv"
+    parquet_outpath = tmp_path / "from_parquet.csv"
+    filter_tariffs(
+        allowed_sectors,
+        allowed_service_types,
+        str(csv_outpath),
+        date_cutoff,
+        inpath=inpath,
+        parquet_path=None,
+    )
+    filter_tariffs(
+        allowed_sectors,
+        allowed_service_types,
+        str(parquet_outpath),
+        date_cutoff,
+        inpath=inpath,
+        parquet_path=parquet_path,
+    )
+
+    # check that reading from the Parquet cache gives exactly the same file
+    assert parquet_outpath.read_bytes() == csv_outpath.read_bytes()
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("use_parquet_cache", [False, True])
+def test_filter_tariff_variants(tmp_path, use_parquet_cache):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    parquet_path = str(tmp_path / "usurdb_raw.parquet")
+    write_raw_csv(inpath)
+    cache_parquet(inpath, parquet_path, row_group_size=4)
+    if not use_parquet_cache:
+        parquet_path = None
+
+    variants = [
+        {
+            "allowed_service_types": ["Bundled", "Delivery with Standard Offer"],
+            "outpath": str(tmp_path / "bundled.csv"),
+            "date_cutoff": datetime.datetime(2023, 1, 1),
+        },
+        {
+            "allowed_service_types": ["Delivery"],
+            "outpath": str(tmp_path / "delivery_only.csv"),
+            "date_cutoff": datetime.datetime(2023, 1, 1),
+        },
+        {
+            "allowed_sectors": ["Residential"],
+            "allowed_service_types": ["Bundled"],
+            "outpath": str(tmp_path / "residential.csv"),
+            "date_cutoff": datetime.datetime(2025, 1, 1),
+            "capacity_kw": 3000,
+        },
+    ]
+    filter_tariff_variants(variants, inpath=inpath, parquet_path=parquet_path)
+
+    # check that each output matches filtering for that variant on its own
+    for variant in variants:
+        expected_outpath = str(tmp_path / "expected.csv")
+        filter_tariffs(
+            **dict(variant, outpath=expected_outpath),
+            inpath=inpath,
+            parquet_path=None,
+        )
+        with open(variant["outpath"], "rb") as result, open(
+            expected_outpath, "rb"
+        ) as expected:
+            assert result.read() == expected.read()
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("chunksize", [1, 5, 100])
+@pytest.mark.parametrize("with_times", [False, True])
+def test_filter_tariffs_chunksize(tmp_path, capsys, chunksize, with_times):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    write_raw_csv(inpath)
+    if with_times:
+        raw = pd.read_csv(inpath)
+        raw.loc[3, "startdate"] = "2020-01-01 06:30:00"
+        raw.to_csv(inpath, index=False)
+
+    variants = [
+        {
+            "allowed_service_types": ["Bundled", "Delivery with Standard Offer"],
+            "outpath": str(tmp_path / "bundled.csv"),
+            "date_cutoff": datetime.datetime(2023, 1, 1),
+        },
+        {
+            "allowed_service_types": ["Delivery"],
+            "outpath": str(tmp_path / "delivery_only.csv"),
+            "date_cutoff": datetime.datetime(2023, 1, 1),
+        },
+    ]
+    filter_tariff_variants(variants, inpath=inpath, parquet_path=None)
+    expected_counts = capsys.readouterr().out
+    expected = [open(variant["outpath"], "rb").read() for variant in variants]
+
+    filter_tariff_variants(
+        variants, inpath=inpath, parquet_path=None, chunksize=chunksize
+    )
+
+    # check that streaming gives the same files and prints the same counts
+    assert capsys.readouterr().out == expected_counts
+    for variant, expected_bytes in zip(variants, expected):
+        assert open(variant["outpath"], "rb").read() == expected_bytes
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "use_parquet_cache, chunksize", [(False, None), (True, None), (False, 5)]
+)
+def test_filter_tariffs_project(tmp_path, use_parquet_cache, chunksize):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    parquet_path = None
+    write_raw_csv(inpath)
+    if use_parquet_cache:
+        parquet_path = str(tmp_path / "usurdb_raw.parquet")
+        cache_parquet(inpath, parquet_path, row_group_size=2)
+
+    full_outpath = str(tmp_path / "full.csv")
+    projected_outpath = str(tmp_path / "projected.csv")
+    kwargs = {
+        "date_cutoff": datetime.datetime(2023, 1, 1),
+        "inpath": inpath,
+        "parquet_path": parquet_path,
+        "chunksize": chunksize,
+    }
+    filter_tariffs(outpath=full_outpath, **kwargs)
+    filter_tariffs(outpath=projected_outpath, project=True, **kwargs)
+
+    # check that projection only drops the columns that convert.py never reads
+    full = pd.read_csv(full_outpath)
+    projected = pd.read_csv(projected_outpath)
+    assert len(projected.columns) < len(full.columns)
+    assert list(projected.columns) == convert_columns(full.columns)
+    pd.testing.assert_frame_equal(projected, full[projected.columns])
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("use_parquet_cache", [False, True])
+@pytest.mark.parametrize("project", [False, True])
+def test_filter_tariff_panel(tmp_path, use_parquet_cache, project):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    parquet_path = None
+    write_raw_csv(inpath)
+    if use_parquet_cache:
+        parquet_path = str(tmp_path / "usurdb_raw.parquet")
+        cache_parquet(inpath, parquet_path, row_group_size=2)
+
+    cutoff_dates = list(pd.date_range("2019-01-01", "2031-01-01", freq="6MS"))
+    panel = filter_tariff_panel(
+        cutoff_dates,
+        allowed_service_types=["Bundled", "Delivery"],
+        outpath=str(tmp_path / "panel.csv"),
+        outpath_template=str(tmp_path / "panel_{date:%Y%m%d}.csv"),
+        inpath=inpath,
+        parquet_path=parquet_path,
+        project=project,
+    )
+    assert panel.equals(pd.read_csv(tmp_path / "panel.csv", parse_dates=[0]))
+
+    # check that each date matches a separate `filter_tariffs` run
+    for cutoff_date in cutoff_dates:
+        outpath = tmp_path / "single.csv"
+        filter_tariffs(
+            allowed_service_types=["Bundled", "Delivery"],
+            outpath=str(outpath),
+            date_cutoff=cutoff_date,
+            inpath=inpath,
+            parquet_path=parquet_path,
+            project=project,
+        )
+        expected = pd.read_csv(outpath)
+        assert list(panel[panel["date_cutoff"] == cutoff_date]["label"]) == list(
+            expected["label"]
+        )
+        assert (
+            tmp_path / f"panel_{cutoff_date:%Y%m%d}.csv"
+        ).read_bytes() == outpath.read_bytes()
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "startdates, expected",
+    [
+        (["2020-01-01", "2021-01-01", "2019-01-01", "2018-01-01"], [1, 2, 3]),
+        (["2020-01-01", None, None, None], [0, 2, 3]),
+        (["2021-01-01", "2021-01-01", "2019-01-01", "2019-01-01"], [0, 2, 3]),
+    ],
+)
+def test_latest_versions(startdates, expected):
+    df = pd.DataFrame(
+        {
+            "eiaid": [1, 1, 1, 2],
+            "name": ["A", "A", None, None],
+            "sector": ["Industrial"] * 4,
+            "servicetype": ["Bundled"] * 4,
+        }
+    )
+    result = latest_versions(df, pd.to_datetime(pd.Series(startdates)))
+    assert sorted(result) == expected
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "use_parquet_cache, chunksize", [(False, None), (True, None), (False, 5)]
+)
+def test_filter_tariffs_latest_only(tmp_path, use_parquet_cache, chunksize):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    parquet_path = None
+    write_raw_csv(inpath)
+    if use_parquet_cache:
+        parquet_path = str(tmp_path / "usurdb_raw.parquet")
+        cache_parquet(inpath, parquet_path, row_group_size=2)
+
+    kwargs = {
+        "allowed_sectors": ["Industrial", "Commercial", "Residential"],
+        "allowed_service_types": ["Bundled", "Delivery"],
+        "date_cutoff": datetime.datetime(2025, 1, 1),
+        "capacity_kw": 0,
+        "inpath": inpath,
+        "parquet_path": parquet_path,
+        "chunksize": chunksize,
+    }
+    filter_tariffs(outpath=str(tmp_path / "all.csv"), **kwargs)
+    filter_tariffs(outpath=str(tmp_path / "latest.csv"), latest_only=True, **kwargs)
+
+    # check that only the latest version of each tariff is kept
+    full = pd.read_csv(tmp_path / "all.csv")
+    latest = pd.read_csv(tmp_path / "latest.csv")
+    assert 0 < len(latest) < len(full)
+    assert not latest.duplicated(DEDUP_COLUMNS).any()
+    expected = full.loc[
+        latest_versions(full, pd.to_datetime(full["startdate"]))
+    ].sort_index()
+    assert list(latest["label"]) == list(expected["label"])
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "states, bbox, expected_eiaids",
+    [
+        (["CA"], None, {11124, 16088}),
+        (["PA", "NY"], None, {10494}),
+        (None, (37, -123, 39, -120), {11124}),
+        (["CA"], (39, -80, 41, -75), set()),
+    ],
+)
+@pytest.mark.parametrize("chunksize", [None, 5])
+def test_filter_tariffs_region(tmp_path, states, bbox, expected_eiaids, chunksize):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    zipcodes_path = str(tmp_path / "merged_zipcodes.csv")
+    write_raw_csv(inpath)
+    # 16088 is missing, so its state comes from its utility name (California)
+    pd.DataFrame(
+        {
+            "zip": [95242, 10001, 19530],
+            "eiaid": [11124, 11124, 10494],
+            "state": ["CA", "NY", "PA"],
+            "latitude": [38.13, 40.75, 40.52],
+            "longitude": [-121.27, -73.99, -75.78],
+        }
+    ).to_csv(zipcodes_path, index=False)
+
+    kwargs = {
+        "allowed_sectors": ["Industrial", "Commercial", "Residential"],
+        "allowed_service_types": [
+            "Bundled",
+            "Delivery",
+            "Delivery with Standard Offer",
+        ],
+        "date_cutoff": datetime.datetime(2025, 1, 1),
+        "inpath": inpath,
+        "parquet_path": None,
+        "chunksize": chunksize,
+    }
+    filter_tariffs(outpath=str(tmp_path / "all.csv"), **kwargs)
+    filter_tariffs(
+        outpath=str(tmp_path / "region.csv"),
+        states=states,
+        bbox=bbox,
+        zipcodes_path=zipcodes_path,
+        **kwargs,
+    )
+
+    full = pd.read_csv(tmp_path / "all.csv")
+    region = pd.read_csv(tmp_path / "region.csv")
+    expected = full[full["eiaid"].isin(expected_eiaids)]
+    assert list(region["label"]) == list(expected["label"])
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("capacity_kw", [0, 200, 500, 1000, 1500, 5000, 20000])
+def test_capacity_index(capacity_kw):
+    df = pd.DataFrame(
+        {
+            "label": [f"label{i}" for i in range(8)],
+            "peakkwcapacitymin": [None, 0, 500, 2000, None, 200, 1000, 5000],
+            "peakkwcapacitymax": [None, 1500, None, 5000, 800, 200, 1000, None],
+        }
+    )
+    index = CapacityIndex(df)
+    expected = (
+        (df["peakkwcapacitymin"] <= capacity_kw) | df["peakkwcapacitymin"].isna()
+    ) & ((df["peakkwcapacitymax"] >= capacity_kw) | df["peakkwcapacitymax"].isna())
+    assert list(index.rows(capacity_kw)) == list(df.index[expected])
+    assert list(index.labels(capacity_kw)) == list(df["label"][expected])
+    # a list of peak demands keeps the tariffs available for any of them
+    both = expected | index.mask(200)
+    assert list(index.labels([capacity_kw, 200])) == list(df["label"][both])
+
+    # the peak demands can be looked up without labels, but not the labels
+    index = CapacityIndex(df.drop(columns="label"))
+    assert list(index.rows(capacity_kw)) == list(df.index[expected])
+    with pytest.raises(ValueError, match="label"):
+        index.labels(capacity_kw)
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize("chunksize", [None, 5])
+def test_filter_tariffs_capacity_list(tmp_path, chunksize):
+    inpath = str(tmp_path / "usurdb_raw.csv")
+    write_raw_csv(inpath)
+    kwargs = {
+        "allowed_sectors": ["Industrial", "Commercial", "Residential"],
+        "date_cutoff": datetime.datetime(2025, 1, 1),
+        "inpath": inpath,
+        "parquet_path": None,
+        "chunksize": chunksize,
+    }
+    labels = set()
+    for capacity_kw in [200, 1000, 4000]:
+        filter_tariffs(
+            outpath=str(tmp_path / "single.csv"), capacity_kw=capacity_kw, **kwargs
+        )
+        labels |= set(pd.read_csv(tmp_path / "single.csv")["label"])
+    filter_tariffs(
+        outpath=str(tmp_path / "union.csv"), capacity_kw=[200, 1000, 4000], **kwargs
+    )
+
+    # check that a list of sizes keeps the tariffs available for any of them
+    union = pd.read_csv(tmp_path / "union.csv")
+    assert set(union["label"]) == labels
+    assert list(union["label"]) == sorted(union["label"])
@@ -0,0 +1,92 @@
+import os
+import math
+import zipfile
+import pytest
+import numpy as np
+from scripts.geocode import *
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+skip_all_tests = False
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "zipcode, expected",
+    [
+        ("94103", "94103"),
+        (94103, "94103"),
+        (94103.0, "94103"),
+        (601, "00601"),
+        ("601", "00601"),
+        ("0601", "00601"),
+        (" 03901 ", "03901"),
+        ("941030", None),
+        ("9410A", None),
+        ("NaN", None),
+        ("", None),
+        (math.nan, None),
+        (None, None),
+        (601.5, None),
+        (-601, None),
+    ],
+)
+def test_normalize_zipcode(zipcode, expected):
+    assert normalize_zipcode(zipcode) == expected
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "postal_codes_name, zipcodes, expected_latitude, expected_longitude, expected_states",
+    [
+        (
+            "US.txt",
+            ["94103", "95242", "00601", "601", 95242, None, math.nan, "99999"],
+            [37.7725, 38.2, 18.16] + [math.nan] * 5,
+            [-122.4147, -121.4, -66.72] + [math.nan] * 5,
+            ["CA", "CA", "PR"] + [None] * 5,
+        ),
+        (
+            "US.zip",
+            ["94103", "95242", "00601", "601", 95242, None, math.nan, "99999"],
+            [37.7725, 38.2, 18.16] + [math.nan] * 5,
+            [-122.4147, -121.4, -66.72] + [math.nan] * 5,
+            ["CA", "CA", "PR"] + [None] * 5,
+        ),
+    ],
+)
+def test_build_zip_table(
+    tmp_path,
+    postal_codes_name,
+    zipcodes,
+    expected_latitude,
+    expected_longitude,
+    expected_states,
+):
+    # a few rows of GeoNames' US postal codes, with two places in 95242
+    postal_codes_path = tmp_path / "US.txt"
+    postal_codes_path.write_text(
+        "US\t94103\tSan Francisco\tCalifornia\tCA\tSan Francisco\t075\t\t\t37.7725\t-122.4147\t4\n"
+        "US\t95242\tLodi\tCalifornia\tCA\tSan Joaquin\t077\t\t\t38.1\t-121.3\t4\n"
+        "US\t00601\tAdjuntas\tPuerto Rico\tPR\tAdjuntas\t001\t\t\t18.16\t-66.72\t1\n"
+        "US\t95242\tLodi\tCalifornia\tCA\tSan Joaquin\t077\t\t\t38.3\t-121.5\t4\n"
+    )
+    if postal_codes_name == "US.zip":
+        # GeoNames' archive also has a readme
+        with zipfile.ZipFile(tmp_path / "US.zip", "w") as archive:
+            archive.write(postal_codes_path, "US.txt")
+            archive.writestr("readme.txt", "GeoNames postal codes\n")
+        postal_codes_path = tmp_path / "US.zip"
+    path = str(tmp_path / "zip_centroids.npy")
+    build_zip_table(path, str(postal_codes_path))
+
+    # the ZIP codes are sorted and the table is memory-mapped
+    assert list(zip_table(path)[0]) == [601, 94103, 95242]
+    assert isinstance(zip_table(path), np.memmap)
+
+    # only 5 digit strings are found, like with pgeocode
+    latitude, longitude, states = lookup_zips(zipcodes, path=path)
+    np.testing.assert_allclose(latitude, expected_latitude)
+    np.testing.assert_allclose(longitude, expected_longitude)
+    assert [
+        ZIP_TABLE_STATES[state] if state >= 0 else None for state in states
+    ] == expected_states
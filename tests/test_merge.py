@@ -34,6 +34,18 @@ def test_main():
     )
     assert len(merged_metadata) == len(old_metadata) + 100
 
+    # check the EIA IDs and zipcodes are written back as they were converted
+    old_metadata = pd.read_csv(
+        os.path.join("data", "converted", "metadata_bundled.csv"), dtype=str
+    )
+    merged_metadata = pd.read_csv(
+        os.path.join(data_folder_path, "metadata_bundled.csv"), dtype=str
+    )
+    for column in ["eiaid", "zipcode"]:
+        pd.testing.assert_series_equal(
+            merged_metadata[column].iloc[: len(old_metadata)], old_metadata[column]
+        )
+
     # check the tariff sheets have been copied to the
     old_tariffs = glob.glob(os.path.join("data", "converted", "bundled", "*.csv"))
     merged_tariffs = glob.glob(os.path.join("data", "merged", "bundled", "*.csv"))
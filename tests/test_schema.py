@@ -0,0 +1,130 @@
+import os
+import pytest
+import pandas as pd
+from scripts.schema import *
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+data_folder_path = os.path.join("tests", "data")
+skip_all_tests = False
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "columns, schema, expected",
+    [
+        (
+            [
+                "label",
+                "sector",
+                "energyratestructure/period11/tier3rate",
+                "demandratestructure/period0/tier0unit",
+                "lookbackmonth0",
+            ],
+            "usurdb",
+            {
+                "label": "str",
+                "sector": "category",
+                "energyratestructure/period11/tier3rate": "float64",
+                "demandratestructure/period0/tier0unit": "category",
+            },
+        ),
+        (
+            ["zip", "eiaid", "state"],
+            "zipcodes",
+            {"zip": "Int32", "eiaid": "Int64", "state": "category"},
+        ),
+        (
+            ["month_start", "charge (metric)", "extra"],
+            "tariff",
+            {"month_start": "float64", "charge (metric)": "float64"},
+        ),
+    ],
+)
+def test_schema_dtypes(columns, schema, expected):
+    result = schema_dtypes(columns, schema)
+    assert result == expected
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "tariff_row_path",
+    [
+        ("row_539f6a0aec4f024411ec8af3.csv"),
+        ("row_539f6b35ec4f024411ec9a0f.csv"),
+        ("row_539f6ba0ec4f024411ec9f97.csv"),
+    ],
+)
+def test_read_typed_csv(tariff_row_path):
+    path = os.path.join(data_folder_path, tariff_row_path)
+    result = read_typed_csv(path, "usurdb")
+    inferred = pd.read_csv(path)
+
+    # check that the declared dtypes are used and the values are unchanged
+    assert result["sector"].dtype == "category"
+    assert result["eiaid"].dtype == "Int64"
+    assert result["energyratestructure/period0/tier0rate"].dtype == "float64"
+    assert list(result.columns) == list(inferred.columns)
+    for column in result.columns:
+        assert (
+            result[column]
+            .astype(object)
+            .equals(inferred[column].astype(result[column].dtype).astype(object))
+        )
+
+    # a dtype that is passed in takes precedence over the schema
+    result = read_typed_csv(path, "usurdb", dtype={"sector": "str"})
+    assert result["sector"].dtype != "category"
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "path, schema, usecols",
+    [
+        (
+            os.path.join(data_folder_path, "row_539f6a0aec4f024411ec8af3.csv"),
+            "usurdb",
+            None,
+        ),
+        (
+            os.path.join(data_folder_path, "row_539f6b35ec4f024411ec9a0f.csv"),
+            "usurdb",
+            None,
+        ),
+        (
+            os.path.join(data_folder_path, "row_539f6ba0ec4f024411ec9f97.csv"),
+            "usurdb",
+            ["label", "sector", "description", "energyratestructure/period0/tier0rate"],
+        ),
+        ("merged_zipcodes.csv", "zipcodes", None),
+    ],
+)
+def test_read_typed_csv_pyarrow(path, schema, usecols, tmp_path):
+    pytest.importorskip("pyarrow")
+    if path == "merged_zipcodes.csv":
+        # zipcodes with leading zeros and a utility without an EIA ID
+        path = str(tmp_path / path)
+        pd.DataFrame(
+            {
+                "zip": ["03901", "95242", "92501"],
+                "eiaid": pd.array([17609, 11124, None], dtype="Int64"),
+                "utility_name": ["Unitil", "City of Lodi", None],
+                "state": ["NH", "CA", "CA"],
+                "service_type": ["Bundled", "Bundled", "Delivery"],
+                "ownership": ["Investor Owned", "Municipal", "Municipal"],
+                "comm_rate": [0.1, 0.12, None],
+                "ind_rate": [0.08, 0.09, None],
+                "res_rate": [0.15, 0.16, None],
+            }
+        ).to_csv(path, index=False)
+    expected = read_typed_csv(path, schema, usecols=usecols)
+    result = read_typed_csv(path, schema, engine="pyarrow", usecols=usecols)
+    pd.testing.assert_frame_equal(result, expected)
+
+    # options that only the default engine has fall back to it
+    chunks = read_typed_csv(
+        path, schema, engine="pyarrow", usecols=usecols, chunksize=1
+    )
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks),
+        pd.concat(read_typed_csv(path, schema, usecols=usecols, chunksize=1)),
+    )
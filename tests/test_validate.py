@@ -3,7 +3,8 @@ import glob
 import pytest
 import subprocess
 import pandas as pd
-from scripts.validate import validate_tariffs
+from scripts.schema import read_typed_csv
+from scripts.validate import validate_tariff, validate_tariffs
 
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 data_folder_path = os.path.join("data", "validated")
@@ -65,3 +66,60 @@ def test_main():
         os.path.join("data", "validated", "delivery_only", "*.csv")
     )
     assert len(valid_tariffs) == len(old_tariffs) - len(reject_list)
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+@pytest.mark.parametrize(
+    "month_start, expected",
+    [
+        ("1", True),
+        ("", False),
+    ],
+)
+def test_validate_tariff(month_start, expected, tmp_path):
+    # an empty period start is read as NaN, which fails the start <= end check
+    tariff_path = tmp_path / "tariff.csv"
+    tariff_path.write_text(
+        "label,utility,type,assessed,period,basic_charge_limit (imperial),"
+        "basic_charge_limit (metric),month_start,month_end,hour_start,hour_end,"
+        "weekday_start,weekday_end,charge (imperial),charge (metric),units,Notes\n"
+        "a,electric,customer,,,,,,,,,,,10.0,10.0,$/month,\n"
+        f"a,electric,energy,,period0,0,0,{month_start},12,0,24,0,6,0.1,0.1,$/kWh,\n"
+    )
+    tariff_df = read_typed_csv(str(tariff_path), "tariff")
+    result, message = validate_tariff(tariff_df, "a")
+    assert result == expected
+    assert expected or "Period start" in message
+
+
+@pytest.mark.skipif(skip_all_tests, reason="Exclude all tests")
+def test_validate_tariffs_unreadable(tmp_path, monkeypatch):
+    # a sheet that cannot be read with the tariff dtypes is rejected on its own
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join("data", "merged", "bundled"))
+    os.makedirs(os.path.join("data", "validated"))
+    header = (
+        "label,utility,type,assessed,period,basic_charge_limit (imperial),"
+        "basic_charge_limit (metric),month_start,month_end,hour_start,hour_end,"
+        "weekday_start,weekday_end,charge (imperial),charge (metric),units,Notes\n"
+    )
+    for label, hour_start in [("a", "0"), ("b", "8:30")]:
+        with open(os.path.join("data", "merged", "bundled", label + ".csv"), "w") as f:
+            f.write(
+                header + f"{label},electric,customer,,,,,,,,,,,10.0,10.0,$/month,\n"
+                f"{label},electric,energy,,period0,0,0,1,12,{hour_start},24,0,6,"
+                "0.1,0.1,$/kWh,\n"
+            )
+    pd.DataFrame({"label": ["a", "b"]}).to_csv(
+        os.path.join("data", "merged", "metadata_bundled.csv"), index=False
+    )
+
+    validate_tariffs(
+        savefolder="data/validated/bundled/",
+        datafolder="data/merged/bundled/",
+        suffix="_bundled",
+    )
+    assert os.listdir(os.path.join("data", "validated", "bundled")) == ["a.csv"]
+    reject_list = pd.read_csv(os.path.join("data", "validated", "rejected_bundled.csv"))
+    assert reject_list["tariff_id"].tolist() == ["b"]
+    assert reject_list["reason"].iloc[0].startswith("Error with b: ")